@@ -1,6 +1,7 @@
 """
 Configuration for StudyWithAI - Plan Limits and Constants
 """
+import os
 from dataclasses import dataclass
 from typing import Set
 
@@ -59,6 +60,13 @@ MAX_IMAGE_MB = 5
 
 # Token estimation (approximate: 4 characters ≈ 1 token)
 TOKEN_PER_CHAR = 0.25
+# Without tiktoken, the token/char ratio is refined from OpenAI's reported prompt_tokens
+# (exponential moving average; higher = adapts faster to the current documents)
+TOKEN_RATIO_EMA_ALPHA = 0.1
+# Texts at least this long are tokenized as windows of ~TOKENIZE_WINDOW_CHARS in
+# tiktoken's native thread pool (windows end at pre-token boundaries, so counts are exact)
+TOKENIZE_PARALLEL_MIN_CHARS = 200_000
+TOKENIZE_WINDOW_CHARS = 50_000
 
 # Chunking configuration for map-reduce
 CHUNK_INPUT_TARGET = 3500  # target tokens per chunk for map phase
@@ -67,21 +75,109 @@ CHUNK_INPUT_TARGET = 3500  # target tokens per chunk for map phase
 CHUNK_OUTPUT_BASE = 600  # Balanced: deep but efficient
 CHUNK_OUTPUT_FORMULA_BOOST = 200  # Key derivation steps, not full proofs
 CHUNK_OUTPUT_THEOREM_BOOST = 250  # Essential proof elements
+CHUNK_OUTPUT_MAX = 800  # Hard cap per chunk (also bounds each summary's share of the REDUCE prompt)
 
 MERGE_OUTPUT_BUDGET = (4000, 18000)  # Increased upper limit: More comprehensive outputs
+MERGE_BUDGET_BASE = 2000  # REDUCE budget = base + per_chunk * chunks, clamped to MERGE_OUTPUT_BUDGET
+MERGE_BUDGET_PER_CHUNK = 600
+CHUNK_OUTPUT_MIN = 200  # Short chunks get ~1 output token per 4 input tokens, never below this
 
 # OpenAI configuration
 OPENAI_MODEL = "gpt-4o"  # Best quality model (was gpt-4o-mini)
 TEMPERATURE = 0.0
 TOP_P = 1.0
 
+# Context window of OPENAI_MODEL; a document split into only two chunks is
+# summarized in one pass when it fits in this fraction of the window
+MODEL_CONTEXT_TOKENS = 128_000
+SINGLE_PASS_CONTEXT_FRACTION = 0.7
+
+# Max parallel OpenAI calls during the MAP phase (chunk summaries are independent I/O);
+# raise OPENAI_MAP_CONCURRENCY on accounts with higher rate limits
+MAP_CONCURRENCY = max(1, int(os.getenv("OPENAI_MAP_CONCURRENCY", "8")))
+# A few failed MAP calls only cost their chunks (the summary is flagged as partial);
+# beyond this share of failed calls the whole summary fails instead
+MAP_MAX_FAILED_FRACTION = 0.1
+
+# Suspend the cyclic garbage collector while MAP results are collected (one
+# collection afterwards instead of many mid-phase); refcounting still frees memory
+MAP_GC_PAUSE = True
+# Overlapping requests share the pause, so under steady load it may never end:
+# the cycles are still collected once the pause has lasted this long
+MAP_GC_PAUSE_MAX_SECONDS = 5.0
+
+# Small adjacent chunks (e.g. short heading sections) are sent together in one
+# MAP call, up to this many per call and CHUNK_INPUT_TARGET tokens combined
+MAP_MARSHAL_MAX_CHUNKS = 4
+
+# Above MERGE_FANOUT * 2 chunk summaries, groups of MERGE_FANOUT are first merged
+# in parallel (intermediate REDUCE) so the final REDUCE prompt stays bounded
+MERGE_FANOUT = 6
+INTERMEDIATE_REDUCE_OUTPUT = 6000  # max_tokens for one intermediate merge
+REDUCE_KNOWLEDGE_MAX_CHARS = 150000  # Cap on the serialized MAP knowledge embedded in REDUCE prompts
+
+# Chunks whose word-shingle Jaccard similarity to an earlier chunk is at least
+# this are treated as duplicates and reuse its summary (1.0 = exact matches only)
+CHUNK_DEDUP_JACCARD = 0.9
+
+# MAP summaries this similar to an earlier one are dropped before REDUCE
+# (repeated boilerplate slides yield near-identical summaries)
+SUMMARY_DEDUP_JACCARD = 0.85
+
+# Pooled HTTP connections to the OpenAI API (keep-alive, reused across calls)
+OPENAI_POOL_CONNECTIONS = 16
+OPENAI_POOL_MAXSIZE = 32
+OPENAI_TCP_KEEPALIVE_IDLE = 30  # Seconds idle before TCP keepalive probes (keeps pooled sockets alive through NAT/LB timeouts)
+OPENAI_PREWARM_CONNECTIONS = int(os.getenv("OPENAI_PREWARM_CONNECTIONS", "1"))  # Opened at startup so the first request skips the TCP+TLS handshake (0 disables)
+OPENAI_TRANSPORT_RETRIES = 5  # Retries on 429/5xx and connection errors at the pool level
+OPENAI_RETRY_BACKOFF = 1.0  # Seconds; doubles per retry (a Retry-After header takes precedence)
+OPENAI_RETRY_BACKOFF_MAX = 30.0  # Cap on a single backoff sleep
+OPENAI_RETRY_JITTER = 1.0  # Up to this many random seconds added so parallel MAP calls don't retry in lockstep
+OPENAI_CALL_RETRIES = 2  # Re-sends when a connection drops after the response started (the pool can't retry those)
+
+# Client-side pacing below the account's OpenAI tokens-per-minute limit
+OPENAI_TPM_LIMIT = 450_000
+
+# OpenAI Batch API (offline MAP phase: ~50% cheaper, up to 24h turnaround)
+OPENAI_BATCH_POLL_SECONDS = 30
+OPENAI_BATCH_COMPLETION_WINDOW = "24h"
+OPENAI_BATCH_PRICE_FACTOR = 0.5  # Batch requests are billed at half the synchronous rate
+# MAP mode for background refreshes of stale cached summaries: "bulk" uses the Batch API
+# (half price; the stale copy keeps being served meanwhile, but a worker thread waits on the job)
+CACHE_REVALIDATE_MAP_MODE = os.getenv("CACHE_REVALIDATE_MAP_MODE", "interactive")
+
 # Ensure we request enough tokens to complete JSON
 # gpt-4o-mini can output up to 16k tokens
 MAX_OUTPUT_TOKENS_ABSOLUTE = 16000
 
 # Cache TTL (in seconds)
 CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # 7 days
+CACHE_STALE_GRACE_SECONDS = 7 * 24 * 60 * 60  # Past TTL, serve stale while refreshing in background
+CACHE_MEMORY_MAX_ENTRIES = 2048  # In-process LRU in front of the summary_cache table
+CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024  # ...and its cap on total (uncompressed) JSON
+# Model replies (MAP chunk summaries, LLM calls) get their own, smaller LRU so one
+# large document can't push the hot full summaries out of memory
+CACHE_REPLY_MEMORY_MAX_ENTRIES = 1024
+CACHE_REPLY_MEMORY_MAX_BYTES = 16 * 1024 * 1024
+CACHE_HIT_FLUSH_SECONDS = 30  # How often batched cache access stats are written
+CACHE_SWEEP_INTERVAL_SECONDS = 60 * 60  # How often expired cache rows are deleted
+CACHE_COMPRESSION_LEVEL = 6  # zlib level for cached summary JSON (1=fast, 9=small)
+LLM_CACHE_MAX_TEMPERATURE = 0.3  # Hotter sampling is meant to vary, so its replies are never cached
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60  # Cached model replies (chunk summaries) live longer than summaries: same input, same reply
+
+# SQLite tuning for the cache connection (ignored on PostgreSQL)
+SQLITE_CACHE_SIZE_KB = 64 * 1024  # Page cache per connection
+SQLITE_MMAP_SIZE_BYTES = 256 * 1024 * 1024  # Memory-mapped reads
+
+# Quality telemetry is written in background batches
+TELEMETRY_BATCH_SIZE = 100  # Flush early once this many rows are queued
+TELEMETRY_FLUSH_SECONDS = 5.0  # Max time a row waits in the queue
 
 # Density Boost mode thresholds (flexible scaling)
 DENSITY_BOOST_THRESHOLD = 15000  # Soft threshold: enable density boost compression
 AGGRESSIVE_DENSITY_THRESHOLD = 40000  # Aggressive threshold: max compression + de-duplication
+
+# Documents up to this many tokens are summarized in one call (no chunking)
+SINGLE_PASS_TOKEN_LIMIT = 10000
+# Texts shorter than this carry too few keywords to classify; use the "general" domain
+DOMAIN_DETECT_MIN_CHARS = 500
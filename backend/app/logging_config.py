@@ -0,0 +1,45 @@
+"""
+Process-wide logging setup
+Records are handed to a queue and written to stdout by a background listener,
+so request threads never block on console I/O
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+_listener = None
+
+
+def _stop_listener() -> None:
+    """Flush queued records on shutdown"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def setup_logging(level: str = None) -> None:
+    """
+    Route the app.* loggers through a QueueHandler/QueueListener pair
+    Safe to call more than once; only the first call installs handlers
+    """
+    global _listener
+    if _listener is not None:
+        return
+    
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    
+    # Same plain "[TAG] message" lines the services printed before
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+    
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(level)
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    app_logger.propagate = False
@@ -2,6 +2,7 @@
 Telemetry models for quality tracking
 """
 from sqlalchemy import Column, Integer, String, Float, JSON, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -46,6 +47,6 @@ class SummaryQuality(Base):
     generation_time_seconds = Column(Float)
     
     # Warnings/issues
-    warnings = Column(JSON)  # List of warning strings
+    warnings = Column(JSON().with_variant(JSONB(), "postgresql"))  # List of warning strings (JSONB on Postgres)
     
     created_at = Column(DateTime, default=datetime.utcnow)
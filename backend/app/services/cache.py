@@ -2,12 +2,31 @@
 Caching service for summary results
 Reduces redundant OpenAI API calls for identical requests
 """
-from typing import Optional
+from typing import Optional, Dict, Tuple, Union
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from sqlalchemy import Column, Integer, String, DateTime, Text, create_engine
+from sqlalchemy import (
+    Column, Integer, String, DateTime, Text, LargeBinary, Index, create_engine,
+    select, update, delete, bindparam, inspect, text, event, and_, or_, not_
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
+import atexit
+import logging
 import os
+import threading
+import time
+import zlib
+from app.config import (
+    CACHE_TTL_SECONDS, CACHE_HIT_FLUSH_SECONDS, CACHE_MEMORY_MAX_ENTRIES, CACHE_MEMORY_MAX_BYTES,
+    CACHE_REPLY_MEMORY_MAX_ENTRIES, CACHE_REPLY_MEMORY_MAX_BYTES,
+    CACHE_SWEEP_INTERVAL_SECONDS, CACHE_COMPRESSION_LEVEL, CACHE_STALE_GRACE_SECONDS,
+    SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE_BYTES, LLM_CACHE_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
 
 # Use existing database connection
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./study_assistant.db")
@@ -16,6 +35,17 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./study_assistant.db")
 if DATABASE_URL.startswith("sqlite"):
     from sqlalchemy import create_engine
     cache_engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    
+    @event.listens_for(cache_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL lets readers proceed while a writer commits; the rest trade durability-on-power-loss for speed"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_BYTES}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 else:
     cache_engine = create_engine(DATABASE_URL)
 
@@ -28,77 +58,403 @@ class SummaryCache(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     request_hash = Column(String, unique=True, index=True)  # SHA256 of request params
-    result_json = Column(Text)  # Cached JSON result
+    result_json = Column(Text)  # Legacy uncompressed JSON (rows written before result_blob)
+    result_blob = Column(LargeBinary)  # zlib-compressed JSON result
     created_at = Column(DateTime, default=datetime.utcnow)
     accessed_at = Column(DateTime, default=datetime.utcnow)  # For LRU cleanup
     access_count = Column(Integer, default=0)  # Hit counter
+    
+    # Lookup + TTL predicate resolved from the index alone
+    __table_args__ = (
+        Index("ix_summary_cache_hash_created", "request_hash", "created_at"),
+    )
 
 
 # Create table if it doesn't exist
 Base.metadata.create_all(bind=cache_engine)
 
+# Add result_blob to tables created before compressed storage
+try:
+    _cache_columns = [col["name"].lower() for col in inspect(cache_engine).get_columns("summary_cache")]
+    if "result_blob" not in _cache_columns:
+        _blob_type = LargeBinary().compile(dialect=cache_engine.dialect)
+        with cache_engine.begin() as _conn:
+            _conn.execute(text(f"ALTER TABLE summary_cache ADD COLUMN result_blob {_blob_type}"))
+        logger.info("[MIGRATION] Added 'result_blob' column to summary_cache table")
+except Exception as e:
+    logger.error("Cache column migration error: %s", e)
+
+# Tables created before the composite index existed don't get it from create_all
+try:
+    for _index in SummaryCache.__table__.indexes:
+        _index.create(bind=cache_engine, checkfirst=True)
+except Exception as e:
+    logger.error("Cache index creation error: %s", e)
+
+
+# Prebuilt Core statements (no ORM entity materialization on the hot path)
+_GET_STMT = select(
+    SummaryCache.result_blob, SummaryCache.result_json, SummaryCache.created_at
+).where(
+    SummaryCache.request_hash == bindparam("h"),
+    SummaryCache.created_at > bindparam("cutoff")
+)
+# Key prefixes of cached model replies (call_openai / MAP chunk summaries), kept for
+# LLM_CACHE_TTL_SECONDS instead of the summary TTL
+REPLY_KEY_PREFIXES = ("llm:", "chunk:")
+_IS_REPLY = or_(*(SummaryCache.request_hash.startswith(prefix) for prefix in REPLY_KEY_PREFIXES))
+_SWEEP_STMT = delete(SummaryCache).where(or_(
+    and_(not_(_IS_REPLY), SummaryCache.created_at <= bindparam("cutoff")),
+    and_(_IS_REPLY, SummaryCache.created_at <= bindparam("reply_cutoff"))
+))
+_HIT_STMT = update(SummaryCache).where(
+    SummaryCache.request_hash == bindparam("h")
+).values(
+    accessed_at=bindparam("now"),
+    access_count=SummaryCache.access_count + bindparam("n")
+)
+
+# Access stats are accumulated in memory and written in one batched UPDATE
+# by a background thread, so a cache hit does no synchronous DB write.
+_pending_hits: Dict[str, int] = {}
+_pending_lock = threading.Lock()
+_maintenance_started = False
+
+
+def _flush_hits() -> None:
+    """Write accumulated hit counts to the database in a single batch"""
+    global _pending_hits
+    with _pending_lock:
+        if not _pending_hits:
+            return
+        batch, _pending_hits = _pending_hits, {}
+    
+    now = datetime.utcnow()
+    try:
+        with cache_engine.begin() as conn:
+            conn.execute(_HIT_STMT, [{"h": h, "n": n, "now": now} for h, n in batch.items()])
+    except Exception as e:
+        logger.error("Cache hit-stat flush error: %s", e)
+
+
+def delete_expired_entries(
+    ttl_seconds: int = CACHE_TTL_SECONDS + CACHE_STALE_GRACE_SECONDS,
+    reply_ttl_seconds: int = LLM_CACHE_TTL_SECONDS
+) -> int:
+    """
+    Physically remove entries past their TTL (including the stale-serve grace window)
+    Cached model replies use reply_ttl_seconds; reads already ignore expired rows,
+    this only reclaims space
+    """
+    try:
+        now = datetime.utcnow()
+        params = {
+            "cutoff": now - timedelta(seconds=ttl_seconds),
+            "reply_cutoff": now - timedelta(seconds=reply_ttl_seconds),
+        }
+        with cache_engine.begin() as conn:
+            return conn.execute(_SWEEP_STMT, params).rowcount
+    except Exception as e:
+        logger.error("Cache sweep error: %s", e)
+        return 0
+
+
+def _checkpoint_wal() -> None:
+    """Fold the SQLite WAL back into the main file so it doesn't grow unbounded"""
+    if cache_engine.dialect.name != "sqlite":
+        return
+    try:
+        with cache_engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    except Exception as e:
+        logger.error("Cache WAL checkpoint error: %s", e)
+
+
+def _cache_maintenance() -> None:
+    """Background loop: flush hit stats often, sweep expired rows hourly"""
+    last_sweep = 0.0
+    while True:
+        _flush_hits()
+        if time.monotonic() - last_sweep >= CACHE_SWEEP_INTERVAL_SECONDS:
+            deleted = delete_expired_entries()
+            if deleted:
+                logger.info("[CACHE] Swept %s expired entries", deleted)
+            _checkpoint_wal()
+            last_sweep = time.monotonic()
+        time.sleep(CACHE_HIT_FLUSH_SECONDS)
+
+
+def _ensure_maintenance() -> None:
+    global _maintenance_started
+    if _maintenance_started:
+        return
+    with _pending_lock:
+        if not _maintenance_started:
+            threading.Thread(target=_cache_maintenance, name="cache-maintenance", daemon=True).start()
+            _maintenance_started = True
+
+
+def _record_hit(request_hash: str) -> None:
+    """Queue an access-stat update for a cache hit"""
+    with _pending_lock:
+        _pending_hits[request_hash] = _pending_hits.get(request_hash, 0) + 1
+
+
+atexit.register(_flush_hits)
+
 
-def get_cached(request_hash: str, db: Session, ttl_seconds: int = 7 * 24 * 60 * 60) -> Optional[str]:
+class _MemoryLRU:
+    """
+    LRU of (json_bytes, created_at) bounded by entry count and total bytes
+    Not thread-safe on its own: callers hold _mem_lock
+    """
+    
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[bytes, datetime]]" = OrderedDict()
+        self.size = 0
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+    
+    def get(self, key: str) -> Optional[Tuple[bytes, datetime]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+    
+    def put(self, key: str, json_bytes: bytes, created_at: datetime) -> None:
+        self.pop(key)
+        if len(json_bytes) > self.max_bytes:
+            return  # Would evict everything else; the DB still has it
+        self.entries[key] = (json_bytes, created_at)
+        self.size += len(json_bytes)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.size -= len(self.entries.popitem(last=False)[1][0])
+    
+    def pop(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+    
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+
+# In-process LRUs in front of the DB: hot keys never touch the database.
+# Entries keep their DB created_at so the caller's TTL is still honoured.
+# Values are UTF-8 JSON bytes, ready to be written to an HTTP response as-is.
+_mem_cache = _MemoryLRU(CACHE_MEMORY_MAX_ENTRIES, CACHE_MEMORY_MAX_BYTES)
+_reply_mem_cache = _MemoryLRU(CACHE_REPLY_MEMORY_MAX_ENTRIES, CACHE_REPLY_MEMORY_MAX_BYTES)
+_mem_lock = threading.RLock()
+
+# Concurrent lookups for the same key wait on one DB fetch instead of stampeding
+_inflight: Dict[str, Future] = {}
+
+
+def _compress(json_bytes: bytes) -> bytes:
+    return zlib.compress(json_bytes, CACHE_COMPRESSION_LEVEL)
+
+
+def _decompress(blob: bytes) -> bytes:
+    return zlib.decompress(blob)
+
+
+@lru_cache(maxsize=32)
+def _seconds(n: int) -> timedelta:
+    """Shared timedelta per TTL value (callers pass the same few constants)"""
+    return timedelta(seconds=n)
+
+
+def _mem_for(request_hash: str) -> _MemoryLRU:
+    return _reply_mem_cache if request_hash.startswith(REPLY_KEY_PREFIXES) else _mem_cache
+
+
+def _mem_get(request_hash: str, cutoff: datetime) -> Optional[Tuple[bytes, datetime]]:
+    with _mem_lock:
+        lru = _mem_for(request_hash)
+        entry = lru.get(request_hash)
+        if entry is None:
+            return None
+        if entry[1] <= cutoff:
+            lru.pop(request_hash)
+            return None
+        return entry
+
+
+def _mem_put(request_hash: str, json_bytes: bytes, created_at: datetime) -> None:
+    with _mem_lock:
+        _mem_for(request_hash).put(request_hash, json_bytes, created_at)
+
+
+def clear_memory_cache() -> None:
+    """Drop all in-process cache entries (call after clearing the DB table)"""
+    with _mem_lock:
+        _mem_cache.clear()
+        _reply_mem_cache.clear()
+
+
+def _db_get(request_hash: str, db: Session, cutoff: datetime) -> Optional[Tuple[bytes, datetime]]:
+    # Expiry is part of the WHERE clause; expired rows are left for the sweep
+    row = db.execute(_GET_STMT, {"h": request_hash, "cutoff": cutoff}).first()
+    
+    if row is None:
+        return None
+    
+    if row.result_blob is not None:
+        json_bytes = _decompress(row.result_blob)
+    else:
+        json_bytes = row.result_json.encode("utf-8")  # Legacy uncompressed row
+    _mem_put(request_hash, json_bytes, row.created_at)
+    return json_bytes, row.created_at
+
+
+def get_cached(request_hash: str, db: Session, ttl_seconds: int = CACHE_TTL_SECONDS) -> Optional[str]:
     """
     Retrieve cached summary result
     Returns None if not found or expired
     """
+    result = get_cached_bytes(request_hash, db, ttl_seconds)
+    return result.decode("utf-8") if result is not None else None
+
+
+def get_cached_bytes(request_hash: str, db: Session, ttl_seconds: int = CACHE_TTL_SECONDS) -> Optional[bytes]:
+    """
+    Retrieve cached summary result as UTF-8 JSON bytes
+    Lets HTTP handlers send a hit without decoding and re-serializing it
+    Returns None if not found or expired
+    """
+    entry = get_cached_entry(request_hash, db, ttl_seconds, stale_grace_seconds=0)
+    return entry[0] if entry is not None else None
+
+
+def get_cached_entry(
+    request_hash: str,
+    db: Session,
+    ttl_seconds: int = CACHE_TTL_SECONDS,
+    stale_grace_seconds: int = CACHE_STALE_GRACE_SECONDS
+) -> Optional[Tuple[bytes, bool]]:
+    """
+    Stale-while-revalidate lookup
+    Returns (json_bytes, is_stale): entries past ttl_seconds but within the grace
+    window are still returned, flagged stale so the caller can refresh them
+    Returns None if not found or older than ttl + grace
+    """
+    _ensure_maintenance()
+    # One clock read per lookup; everything below is datetime comparisons
+    now = datetime.utcnow()
+    fresh_cutoff = now - _seconds(ttl_seconds)
+    cutoff = fresh_cutoff - _seconds(stale_grace_seconds) if stale_grace_seconds else fresh_cutoff
     try:
-        cache_entry = db.query(SummaryCache).filter(
-            SummaryCache.request_hash == request_hash
-        ).first()
+        result = _mem_get(request_hash, cutoff)
         
-        if not cache_entry:
-            return None
+        if result is None:
+            with _mem_lock:
+                future = _inflight.get(request_hash)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    _inflight[request_hash] = future
+            
+            if owner:
+                try:
+                    result = _db_get(request_hash, db, cutoff)
+                    future.set_result(result)
+                except Exception as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    with _mem_lock:
+                        _inflight.pop(request_hash, None)
+            else:
+                result = future.result()
         
-        # Check if expired
-        expiry = cache_entry.created_at + timedelta(seconds=ttl_seconds)
-        if datetime.utcnow() > expiry:
-            # Delete expired entry
-            db.delete(cache_entry)
-            db.commit()
+        if result is None:
             return None
         
-        # Update access stats
-        cache_entry.accessed_at = datetime.utcnow()
-        cache_entry.access_count += 1
-        db.commit()
+        # Update access stats (batched, off the request path)
+        _record_hit(request_hash)
         
-        return cache_entry.result_json
+        json_bytes, created_at = result
+        return json_bytes, created_at <= fresh_cutoff
     
     except Exception as e:
-        print(f"Cache retrieval error: {e}")
+        logger.error("Cache retrieval error: %s", e)
+        return None
+
+
+def _build_upsert_stmt():
+    """
+    Single-statement INSERT ... ON CONFLICT DO UPDATE for dialects that support it
+    Returns None for other dialects (set_cached falls back to select-then-write)
+    """
+    dialect = cache_engine.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
         return None
+    
+    stmt = insert(SummaryCache).values(
+        request_hash=bindparam("h"),
+        result_json=None,
+        result_blob=bindparam("blob"),
+        created_at=bindparam("now"),
+        accessed_at=bindparam("now"),
+        access_count=0
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[SummaryCache.request_hash],
+        set_={
+            "result_json": None,
+            "result_blob": stmt.excluded.result_blob,
+            "created_at": stmt.excluded.created_at,
+            "accessed_at": stmt.excluded.accessed_at,
+            "access_count": 0
+        }
+    )
+
+
+_UPSERT_STMT = _build_upsert_stmt()
 
 
-def set_cached(request_hash: str, json_text: str, db: Session) -> None:
+def set_cached(request_hash: str, json_text: Union[str, bytes], db: Session) -> None:
     """
-    Store summary result in cache
+    Store summary result in cache (JSON text or UTF-8 bytes)
     """
     try:
-        # Check if entry already exists
-        existing = db.query(SummaryCache).filter(
-            SummaryCache.request_hash == request_hash
-        ).first()
+        now = datetime.utcnow()
+        json_bytes = json_text.encode("utf-8") if isinstance(json_text, str) else json_text
+        blob = _compress(json_bytes)
         
-        if existing:
-            # Update existing
-            existing.result_json = json_text
-            existing.created_at = datetime.utcnow()
-            existing.accessed_at = datetime.utcnow()
-            existing.access_count = 0
+        if _UPSERT_STMT is not None:
+            # One round-trip, and no SELECT-then-INSERT race between workers
+            db.execute(_UPSERT_STMT, {"h": request_hash, "blob": blob, "now": now})
         else:
-            # Create new
-            cache_entry = SummaryCache(
-                request_hash=request_hash,
-                result_json=json_text
-            )
-            db.add(cache_entry)
+            # Check if entry already exists
+            existing = db.query(SummaryCache).filter(
+                SummaryCache.request_hash == request_hash
+            ).first()
+            
+            if existing:
+                # Update existing
+                existing.result_json = None
+                existing.result_blob = blob
+                existing.created_at = now
+                existing.accessed_at = now
+                existing.access_count = 0
+            else:
+                # Create new
+                db.add(SummaryCache(request_hash=request_hash, result_blob=blob))
         
         db.commit()
+        _mem_put(request_hash, json_bytes, now)
     
     except Exception as e:
-        print(f"Cache storage error: {e}")
+        logger.error("Cache storage error: %s", e)
         db.rollback()
 
 
@@ -113,9 +469,10 @@ def clear_old_cache_entries(db: Session, days: int = 30) -> int:
             SummaryCache.accessed_at < cutoff
         ).delete()
         db.commit()
+        clear_memory_cache()
         return deleted
     except Exception as e:
-        print(f"Cache cleanup error: {e}")
+        logger.error("Cache cleanup error: %s", e)
         db.rollback()
         return 0
 
@@ -0,0 +1,308 @@
+"""
+Shared HTTP session for OpenAI API calls
+Keeps TCP/TLS connections alive across requests instead of reconnecting per call
+"""
+import hashlib
+import logging
+import random
+import socket
+import threading
+import time
+from functools import lru_cache
+from typing import Dict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+from app.config import (
+    OPENAI_POOL_CONNECTIONS, OPENAI_POOL_MAXSIZE, OPENAI_TCP_KEEPALIVE_IDLE, OPENAI_PREWARM_CONNECTIONS,
+    OPENAI_TRANSPORT_RETRIES, OPENAI_RETRY_BACKOFF,
+    OPENAI_RETRY_BACKOFF_MAX, OPENAI_RETRY_JITTER,
+    OPENAI_TPM_LIMIT, MAP_CONCURRENCY,
+    OPENAI_BATCH_POLL_SECONDS, OPENAI_BATCH_COMPLETION_WINDOW
+)
+from app.utils import json_codec
+from app.utils.tokens import token_per_char
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_BASE = "https://api.openai.com/v1"
+OPENAI_CHAT_URL = f"{OPENAI_API_BASE}/chat/completions"
+
+_session: requests.Session = None
+_session_lock = threading.Lock()
+
+
+def _keepalive_socket_options() -> list:
+    options = list(HTTPConnection.default_socket_options)  # TCP_NODELAY
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # Linux/macOS knobs; other platforms keep the OS defaults
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, OPENAI_TCP_KEEPALIVE_IDLE))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, OPENAI_TCP_KEEPALIVE_IDLE))
+    return options
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose pooled sockets send TCP keepalives
+    Idle connections between requests would otherwise be dropped silently by
+    NAT/load balancers, costing a failed send plus a fresh TCP+TLS handshake
+    """
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault("socket_options", _keepalive_socket_options())
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    retry = Retry(
+        total=OPENAI_TRANSPORT_RETRIES,
+        # A POST that timed out waiting for the reply may still be generating (and
+        # billed) upstream: only refused connects and 429/5xx replies are re-sent
+        read=0,
+        backoff_factor=OPENAI_RETRY_BACKOFF,
+        backoff_max=OPENAI_RETRY_BACKOFF_MAX,
+        backoff_jitter=OPENAI_RETRY_JITTER,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False  # Let callers see the final status and error body
+    )
+    adapter = _KeepAliveAdapter(
+        pool_connections=OPENAI_POOL_CONNECTIONS,
+        # Every MAP worker plus the merge call must get a kept-alive connection,
+        # otherwise urllib3 discards the overflow and re-handshakes next time
+        pool_maxsize=max(OPENAI_POOL_MAXSIZE, MAP_CONCURRENCY + 1),
+        max_retries=retry
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """
+    Return the process-wide pooled session (created on first use)
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def warm_http_session(api_key: str, connections: int = OPENAI_PREWARM_CONNECTIONS) -> list:
+    """
+    Open pooled connections to the API in background threads
+    The TCP+TLS handshake then happens at startup instead of on the first user request
+    Returns the started threads (daemon; failures are only logged)
+    """
+    if not api_key or connections <= 0:
+        return []
+    
+    def _warm():
+        try:
+            # Cheap authenticated GET; the fully read response returns its connection to the pool
+            get_http_session().get(f"{OPENAI_API_BASE}/models", headers=auth_headers(api_key), timeout=10)
+        except Exception as e:
+            logger.debug("[OPENAI] Connection prewarm failed: %s", e)
+    
+    threads = [threading.Thread(target=_warm, name="openai-prewarm", daemon=True) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+@lru_cache(maxsize=4)
+def auth_headers(api_key: str) -> Dict[str, str]:
+    """Authorization header for the OpenAI API (built once per key; treat as read-only)"""
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+@lru_cache(maxsize=4)
+def json_headers(api_key: str) -> Dict[str, str]:
+    """Headers for JSON POSTs to the OpenAI API (built once per key; treat as read-only)"""
+    return {**auth_headers(api_key), "Content-Type": "application/json"}
+
+
+@lru_cache(maxsize=1024)
+def openai_user_tag(user_id: int) -> str:
+    """
+    Stable, non-reversible end-user id for the OpenAI "user" field
+    Keeps a user's requests on the same prompt-cache route without sending raw ids
+    """
+    return hashlib.sha256(f"studywithai:{user_id}".encode("utf-8")).hexdigest()[:32]
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: callers block until enough capacity is available
+    Used to pace OpenAI calls just under the account's tokens-per-minute limit
+    """
+    
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def acquire(self, amount: float) -> float:
+        """Take amount tokens, sleeping as needed; returns seconds waited"""
+        amount = min(amount, self.capacity)  # Oversized requests wait for a full bucket
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                elif self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                else:
+                    delay = (amount - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+    
+    def penalize(self, retry_after: float) -> None:
+        """Empty the bucket and hold all callers for retry_after seconds (after a 429)"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+
+openai_limiter = TokenBucket(rate_per_second=OPENAI_TPM_LIMIT / 60.0, capacity=OPENAI_TPM_LIMIT)
+
+
+def estimate_request_tokens(system_prompt: str, user_prompt: str, max_output_tokens: int) -> int:
+    """Tokens a chat request counts against TPM: prompt (approximate) + requested completion"""
+    return int((len(system_prompt) + len(user_prompt)) * token_per_char()) + max_output_tokens
+
+
+def retry_after_seconds(response: requests.Response, default: float = 1.0) -> float:
+    """Parse the Retry-After header of a 429/5xx response (OpenAI's retry-after-ms first)"""
+    try:
+        retry_after_ms = response.headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000
+        return float(response.headers.get("retry-after", default))
+    except (TypeError, ValueError):
+        return default
+
+
+def backoff_seconds(retry: int, minimum: float = 0.0) -> float:
+    """
+    Sleep before app-level retry number `retry` (0-based): exponential with jitter
+    Same curve as the pool's Retry, never shorter than `minimum` (e.g. a Retry-After)
+    """
+    delay = min(OPENAI_RETRY_BACKOFF * (2 ** retry), OPENAI_RETRY_BACKOFF_MAX)
+    return max(minimum, delay + random.uniform(0, OPENAI_RETRY_JITTER))
+
+
+# ========== Batch API ==========
+
+_BATCH_TERMINAL_FAILURES = {"failed", "expired", "cancelled", "cancelling"}
+
+
+def _raise_for_openai_status(response: requests.Response, action: str) -> None:
+    if response.status_code != 200:
+        raise Exception(f"OpenAI {action} failed ({response.status_code}): {response.text[:500]}")
+
+
+def submit_chat_batch(bodies: Dict[str, dict], api_key: str) -> str:
+    """
+    Upload chat-completion bodies (keyed by custom_id) as one JSONL batch
+    Returns the batch id
+    """
+    session = get_http_session()
+    auth = auth_headers(api_key)
+    
+    jsonl = b"\n".join(
+        json_codec.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body
+        })
+        for custom_id, body in bodies.items()
+    )
+    
+    upload = session.post(
+        f"{OPENAI_API_BASE}/files",
+        headers=auth,
+        data={"purpose": "batch"},
+        files={"file": ("batch.jsonl", jsonl, "application/jsonl")},
+        timeout=180
+    )
+    _raise_for_openai_status(upload, "batch file upload")
+    
+    batch = session.post(
+        f"{OPENAI_API_BASE}/batches",
+        headers=auth,
+        json={
+            "input_file_id": upload.json()["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": OPENAI_BATCH_COMPLETION_WINDOW
+        },
+        timeout=60
+    )
+    _raise_for_openai_status(batch, "batch creation")
+    return batch.json()["id"]
+
+
+def wait_for_batch(batch_id: str, api_key: str, poll_seconds: float = OPENAI_BATCH_POLL_SECONDS) -> dict:
+    """
+    Poll a batch until it completes; returns the final batch object
+    Raises if the batch fails, expires or is cancelled
+    """
+    session = get_http_session()
+    auth = auth_headers(api_key)
+    
+    while True:
+        response = session.get(f"{OPENAI_API_BASE}/batches/{batch_id}", headers=auth, timeout=60)
+        _raise_for_openai_status(response, "batch status")
+        batch = response.json()
+        status = batch.get("status")
+        if status == "completed":
+            return batch
+        if status in _BATCH_TERMINAL_FAILURES:
+            raise Exception(f"OpenAI batch {batch_id} ended with status '{status}'")
+        time.sleep(poll_seconds)
+
+
+def fetch_batch_results(batch: dict, api_key: str) -> Dict[str, dict]:
+    """
+    Download a completed batch's output file
+    Returns {custom_id: chat completion body} for every successful request
+    """
+    output_file_id = batch.get("output_file_id")
+    if not output_file_id:
+        return {}
+    
+    response = get_http_session().get(
+        f"{OPENAI_API_BASE}/files/{output_file_id}/content",
+        headers=auth_headers(api_key),
+        timeout=180
+    )
+    _raise_for_openai_status(response, "batch output download")
+    
+    results = {}
+    for line in response.content.splitlines():
+        if not line.strip():
+            continue
+        record = json_codec.loads(line)
+        reply = record.get("response") or {}
+        if reply.get("status_code") == 200:
+            results[record["custom_id"]] = reply["body"]
+    return results
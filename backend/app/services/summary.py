@@ -3,35 +3,134 @@ AI-powered summary service with map-reduce for large documents
 Includes domain detection and quality guardrails for consistent output
 Enhanced with deep learning prompts for maximum depth and coverage
 """
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict, Iterator, Iterable, Tuple
+from functools import lru_cache
+from itertools import accumulate
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import difflib
+import gc
+import hashlib
+import logging
 import os
-import requests
 import re
+import threading
+import time
+import requests
+from urllib3.exceptions import ProtocolError
 from app.config import (
     OPENAI_MODEL, TEMPERATURE, TOP_P,
-    CHUNK_INPUT_TARGET, MERGE_OUTPUT_BUDGET
+    CHUNK_INPUT_TARGET, MERGE_OUTPUT_BUDGET, MAP_CONCURRENCY,
+    CHUNK_DEDUP_JACCARD, MAP_MARSHAL_MAX_CHUNKS, SUMMARY_DEDUP_JACCARD,
+    MODEL_CONTEXT_TOKENS, SINGLE_PASS_CONTEXT_FRACTION, OPENAI_BATCH_PRICE_FACTOR,
+    LLM_CACHE_MAX_TEMPERATURE, MERGE_FANOUT, INTERMEDIATE_REDUCE_OUTPUT, MAP_GC_PAUSE,
+    MAP_GC_PAUSE_MAX_SECONDS, MAP_MAX_FAILED_FRACTION,
+    REDUCE_KNOWLEDGE_MAX_CHARS, OPENAI_CALL_RETRIES, LLM_CACHE_TTL_SECONDS,
+    DENSITY_BOOST_THRESHOLD, AGGRESSIVE_DENSITY_THRESHOLD, SINGLE_PASS_TOKEN_LIMIT, DOMAIN_DETECT_MIN_CHARS
 )
-from app.utils.files import approx_tokens_from_text_len
-from app.utils.chunking import split_text_approx_tokens, merge_texts
+from app.utils.adaptive_budget import calculate_chunk_budget, calculate_merge_budget, max_reduce_inputs
+from app.utils.chunking import find_duplicate_chunks, DuplicateChunkIndex
+from app.utils.coverage_validator import validate_coverage, generate_coverage_report
+from app.utils.json_helpers import parse_json_robust
+from app.utils.structure_parser import extract_heading_hierarchy, chunk_by_headings, blocks_to_text
+from app.utils.tokens import count_tokens, try_encode, iter_text_chunks, observe_prompt_tokens
+from app.utils import json_codec
+from app.services.openai_client import (
+    get_http_session, OPENAI_CHAT_URL,
+    openai_limiter, estimate_request_tokens, retry_after_seconds, backoff_seconds,
+    submit_chat_batch, wait_for_batch, fetch_batch_results, json_headers,
+    openai_user_tag
+)
+
 
+logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Process-wide MAP worker pool: concurrent requests share MAP_CONCURRENCY
+# in-flight OpenAI calls instead of each spinning up its own threads
+_map_executor: ThreadPoolExecutor = None
+_map_executor_lock = threading.Lock()
+
+
+def get_map_executor() -> ThreadPoolExecutor:
+    """
+    Return the shared MAP-phase thread pool (created on first use)
+    """
+    global _map_executor
+    if _map_executor is None:
+        with _map_executor_lock:
+            if _map_executor is None:
+                _map_executor = ThreadPoolExecutor(
+                    max_workers=MAP_CONCURRENCY, thread_name_prefix="map-chunk"
+                )
+    return _map_executor
+
+
+# gc.disable() is process-wide, so overlapping requests share one pause:
+# the collector is re-enabled (and run once) when the last of them finishes,
+# and run every MAP_GC_PAUSE_MAX_SECONDS while they keep overlapping
+_gc_pause_depth = 0
+_gc_resume = False  # Whether the collector was on when the first pause began
+_gc_collected_at = 0.0  # time.monotonic() of the pause start or its last collection
+_gc_pause_lock = threading.Lock()
+
+
+def _gc_collect_if_overdue() -> None:
+    """Collect cycles if the shared pause has kept the collector off for too long"""
+    global _gc_collected_at
+    with _gc_pause_lock:
+        now = time.monotonic()
+        overdue = _gc_pause_depth > 0 and _gc_resume and now - _gc_collected_at >= MAP_GC_PAUSE_MAX_SECONDS
+        if overdue:
+            _gc_collected_at = now
+    if overdue:
+        gc.collect()
+
+
+@contextmanager
+def _gc_paused():
+    """Suspend cyclic garbage collection for the duration (no-op if MAP_GC_PAUSE is off)"""
+    global _gc_pause_depth, _gc_resume, _gc_collected_at
+    if not MAP_GC_PAUSE:
+        yield
+        return
+    with _gc_pause_lock:
+        if _gc_pause_depth == 0:
+            _gc_resume = gc.isenabled()
+            _gc_collected_at = time.monotonic()
+            gc.disable()
+        _gc_pause_depth += 1
+    _gc_collect_if_overdue()
+    try:
+        yield
+    finally:
+        _gc_collect_if_overdue()
+        with _gc_pause_lock:
+            _gc_pause_depth -= 1
+            resume = _gc_pause_depth == 0 and _gc_resume
+            if resume:
+                gc.enable()
+        if resume:
+            gc.collect()
+
 
 # ========== PROMPTS ==========
 # Import enhanced deep prompts for maximum quality
 from app.services.summary_prompts import SYSTEM_PROMPT_DEEP, FEW_SHOT_EXAMPLES
 
-# Use the deep prompt system-wide
+# Use the deep prompt system-wide. Keep it a fixed module-level string and always
+# the first message: identical leading bytes let OpenAI's prompt cache reuse the
+# prefill across calls, so per-request text belongs in the user message only
 SYSTEM_PROMPT = SYSTEM_PROMPT_DEEP
 
 
-def get_chunk_summary_prompt(language: str = "en") -> str:
-    """
-    Prompt for extracting key information from chunks (MAP phase)
-    Focus on identifying main themes, evidence, concepts for synthesis
-    Returns structured mini-JSON to preserve concept/formula/example separation
-    """
+# Marker used to pre-split prompt templates around their per-call parts
+_SPLICE = "\x00"
+
+
+def _build_chunk_summary_prompt(language: str) -> str:
+    """Render the MAP-phase prompt (called once per language at import)"""
     lang_instr = "Write in TURKISH." if language == "tr" else "Write in ENGLISH."
     
     return f"""You are analyzing a document excerpt to extract key information for a professional briefing.
@@ -98,61 +197,103 @@ RULES:
 - Output ONLY valid JSON, no extra text"""
 
 
+# The chunk prompt only varies by language: render both once
+_CHUNK_PROMPT_EN = _build_chunk_summary_prompt("en")
+_CHUNK_PROMPT_TR = _build_chunk_summary_prompt("tr")
+
+
+def get_chunk_summary_prompt(language: str = "en") -> str:
+    """
+    Prompt for extracting key information from chunks (MAP phase)
+    Focus on identifying main themes, evidence, concepts for synthesis
+    Returns structured mini-JSON to preserve concept/formula/example separation
+    """
+    return _CHUNK_PROMPT_TR if language == "tr" else _CHUNK_PROMPT_EN
+
+
+# Domain indicator keywords, matched as substrings of the lowercased sample;
+# within a domain the words that occur most often in course material come first,
+# so typical documents reach the hit threshold after a few tests
+_DOMAIN_KEYWORDS = {
+    # Technical/scientific indicators
+    "technical": ("function", "variable", "equation", "formula", "compute",
+                  "algorithm", "solve", "calculate", "matrix", "theorem",
+                  "proof", "derivative", "integral"),
+    # Social sciences indicators
+    "social": ("social", "history", "theory", "culture", "political",
+               "economic", "society", "policy", "psychology", "philosophy",
+               "ethics", "sociology"),
+    # Procedural/manual indicators
+    "procedural": ("step", "process", "method", "guide", "instruction",
+                   "implementation", "procedure", "how to", "install", "manual"),
+}
+_DOMAIN_MIN_HITS = 3  # Distinct keywords needed to claim a domain
+# Flattened (keyword, domain, keywords left in that domain) triples, grouped in domain
+# priority order: a domain can only reach the threshold after every higher-priority
+# keyword has been tested
+_DOMAIN_KEYWORD_PAIRS = tuple(
+    (keyword, domain, len(keywords) - i - 1)
+    for domain, keywords in _DOMAIN_KEYWORDS.items() for i, keyword in enumerate(keywords)
+)
+
+
 def detect_domain(text: str) -> str:
     """
     Automatically detect document domain from content to adjust summary style.
     Returns: 'technical', 'social', 'procedural', or 'general'
     """
-    sample = text[:4000].lower()
-    
-    # Technical/scientific indicators
-    technical_keywords = ["equation", "theorem", "proof", "algorithm", "derivative", 
-                         "integral", "matrix", "function", "variable", "formula",
-                         "calculate", "compute", "solve"]
-    
-    # Social sciences indicators
-    social_keywords = ["policy", "sociology", "history", "philosophy", "ethics",
-                      "society", "culture", "theory", "political", "economic",
-                      "psychology", "social"]
+    # The pipeline and the telemetry hook both classify the same upload
+    return _detect_domain_sample(text[:4000])
+
+
+@lru_cache(maxsize=128)
+def _detect_domain_sample(prefix: str) -> str:
+    sample = prefix.lower()
     
-    # Procedural/manual indicators
-    procedural_keywords = ["step", "procedure", "manual", "instruction", "how to",
-                          "guide", "process", "method", "implementation", "install"]
-    
-    technical_count = sum(1 for k in technical_keywords if k in sample)
-    social_count = sum(1 for k in social_keywords if k in sample)
-    procedural_count = sum(1 for k in procedural_keywords if k in sample)
-    
-    if technical_count >= 3:
-        return "technical"
-    elif social_count >= 3:
-        return "social"
-    elif procedural_count >= 3:
-        return "procedural"
+    # One pass over all keywords; each test is a C-level substring search and the
+    # scan stops as soon as a domain has enough hits. Keywords of a domain that can
+    # no longer reach the threshold are skipped without searching
+    hits = dict.fromkeys(_DOMAIN_KEYWORDS, 0)
+    for keyword, domain, left in _DOMAIN_KEYWORD_PAIRS:
+        if hits[domain] + left + 1 < _DOMAIN_MIN_HITS:
+            continue
+        if keyword in sample:
+            hits[domain] += 1
+            if hits[domain] >= _DOMAIN_MIN_HITS:
+                return domain
     return "general"
 
 
+# Quality score components: (target that earns full marks, weight)
+_QUALITY_DEPTH = (400, 0.25)      # Avg explanation chars per concept
+_QUALITY_EXAMPLES = (2.0, 0.20)   # Examples per concept
+_QUALITY_FORMULAS = (1.0, 0.15)   # Share of formulas with a worked example
+_QUALITY_DIAGRAMS = (3, 0.15)
+_QUALITY_PSEUDOCODE = (2, 0.10)
+_QUALITY_PRACTICE = (4, 0.15)
+
+
 def quality_score_legacy(result: dict) -> float:
     """
     Calculate quality score (0.0-1.0) based on content depth and richness.
     Focus: concept depth, formula completeness, examples, diagrams, pseudocode, practice problems
     """
+    if not isinstance(result, dict):
+        return 0.5
     try:
         s = result.get("summary", {})
-        sections = s.get("sections", [])
         
         # Count concepts and check depth
         num_concepts = 0
         total_explanation_length = 0
         total_examples = 0
         
-        for sec in sections:
+        for sec in s.get("sections", []):
             concepts = sec.get("concepts", [])
             num_concepts += len(concepts)
             
             for concept in concepts:
-                explanation = concept.get("explanation", "")
-                total_explanation_length += len(explanation)
+                total_explanation_length += len(concept.get("explanation", ""))
                 
                 # Count examples (either array or single)
                 examples = concept.get("examples", [])
@@ -174,40 +315,34 @@ def quality_score_legacy(result: dict) -> float:
         num_pseudocode = len(s.get("pseudocode", []))
         num_practice = len(s.get("practice_problems", []))
         
-        # Calculate weighted score (depth + interactivity)
-        concept_depth_score = min((avg_explanation_length / 400), 1.0)  # 400 chars = good depth
-        example_richness_score = min(avg_examples_per_concept / 2.0, 1.0)  # 2 examples per concept = target
-        formula_completeness_score = formulas_with_examples / max(num_formulas, 1) if num_formulas > 0 else 0.5
-        diagrams_score = min(num_diagrams / 3, 1.0)  # 3 diagrams = target
-        pseudocode_score = min(num_pseudocode / 2, 1.0)  # 2 pseudocode = target
-        practice_score = min(num_practice / 4, 1.0)  # 4 practice problems = target
+        # Weighted score (depth + interactivity): each component is capped at its target
+        score = 0.0
+        for value, (target, weight) in (
+            (avg_explanation_length, _QUALITY_DEPTH),
+            (avg_examples_per_concept, _QUALITY_EXAMPLES),
+            (formulas_with_examples / num_formulas if num_formulas else 0.5, _QUALITY_FORMULAS),
+            (num_diagrams, _QUALITY_DIAGRAMS),
+            (num_pseudocode, _QUALITY_PSEUDOCODE),
+            (num_practice, _QUALITY_PRACTICE),
+        ):
+            score += min(value / target, 1.0) * weight
         
-        score = (
-            concept_depth_score * 0.25 +        # 25% for explanation depth
-            example_richness_score * 0.20 +     # 20% for example richness
-            formula_completeness_score * 0.15 + # 15% for formula completeness
-            diagrams_score * 0.15 +             # 15% for visual diagrams
-            pseudocode_score * 0.10 +           # 10% for pseudocode
-            practice_score * 0.15               # 15% for practice problems
+        logger.info(
+            "[QUALITY SCORE] Concepts: %s, Avg explanation: %s chars, Avg examples/concept: %.1f, "
+            "Formulas: %s (examples: %s), Diagrams: %s, Pseudocode: %s, Practice: %s, Score: %.2f",
+            num_concepts, int(avg_explanation_length), avg_examples_per_concept, num_formulas,
+            formulas_with_examples, num_diagrams, num_pseudocode, num_practice, score
         )
         
-        print(f"[QUALITY SCORE] Concepts: {num_concepts}, Avg explanation: {int(avg_explanation_length)} chars, "
-              f"Avg examples/concept: {avg_examples_per_concept:.1f}, Formulas: {num_formulas} (examples: {formulas_with_examples}), "
-              f"Diagrams: {num_diagrams}, Pseudocode: {num_pseudocode}, Practice: {num_practice}, Score: {score:.2f}")
-        
         return round(score, 2)
     except Exception as e:
-        print(f"[QUALITY SCORE] Error calculating: {e}")
+        logger.error("[QUALITY SCORE] Error calculating: %s", e)
         return 0.5  # Default to medium quality on error
 
 
-def get_final_merge_prompt(language: str = "en", additional_instructions: str = "", domain: str = "general") -> str:
-    """
-    REDUCE phase: Synthesize all chunks into professional briefing document
-    Focus on main themes, evidence, insights - NOT comprehensive tutorial
-    """
+def _build_final_merge_prompt(language: str, domain: str, additional: str) -> str:
+    """Render the REDUCE-phase prompt (pre-split per language/domain at import)"""
     lang_instr = "Use TURKISH for ALL output." if language == "tr" else "Use ENGLISH for ALL output."
-    additional = f"\n\nUSER REQUIREMENTS (FOLLOW STRICTLY):\n{additional_instructions}" if additional_instructions else ""
 
     # Domain-specific guidance
     domain_guidance = ""
@@ -512,6 +647,44 @@ VALIDATION CHECKLIST (before output):
 OUTPUT PURE JSON NOW (no other text):"""
 
 
+# (head, tail) around the user-requirements slot, per (language, domain)
+_FINAL_MERGE_PARTS = {
+    (language, domain): tuple(_build_final_merge_prompt(language, domain, _SPLICE).split(_SPLICE))
+    for language in ("en", "tr")
+    for domain in ("technical", "social", "general")
+}
+
+
+def normalize_instructions(text: Optional[str]) -> str:
+    """
+    Canonical form of user instructions (trimmed, no trailing spaces, \n line ends)
+    Whitespace-only differences then yield byte-identical prompts, which keeps the
+    prompt memos, the MAP cache and OpenAI's prefix cache hitting
+    """
+    if not text:
+        return ""
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def get_final_merge_prompt(language: str = "en", additional_instructions: str = "", domain: str = "general") -> str:
+    """
+    REDUCE phase: Synthesize all chunks into professional briefing document
+    Focus on main themes, evidence, insights - NOT comprehensive tutorial
+    """
+    return _final_merge_prompt(language, normalize_instructions(additional_instructions), domain)
+
+
+@lru_cache(maxsize=32)
+def _final_merge_prompt(language: str, additional_instructions: str, domain: str) -> str:
+    head, tail = _FINAL_MERGE_PARTS[(
+        "tr" if language == "tr" else "en",
+        domain if domain in ("technical", "social") else "general"
+    )]
+    additional = f"\n\nUSER REQUIREMENTS (FOLLOW STRICTLY):\n{additional_instructions}" if additional_instructions else ""
+    return head + additional + tail
+
+
+@lru_cache(maxsize=16)
 def get_reduce_outline_prompt(language: str, domain: str) -> str:
     """
     First stage of two-stage REDUCE: generate topology/outline only
@@ -534,6 +707,12 @@ def get_reduce_fill_prompt(language: str, domain: str, additional: str = "") ->
     """
     Second stage of two-stage REDUCE: fill outline with content
     """
+    # Only the static body is memoized; free-form user text is appended per call
+    return _reduce_fill_base(language, domain) + additional
+
+
+@lru_cache(maxsize=16)
+def _reduce_fill_base(language: str, domain: str) -> str:
     L = "Use TURKISH for ALL output." if language == "tr" else "Use ENGLISH for ALL output."
     domain_note = ""
     if domain == "technical":
@@ -555,11 +734,11 @@ Constraints:
 - If the outline missed some themes, you MAY add concise sub-concepts, but avoid unnecessary padding.
 - Output single valid JSON, no markdown.
 
-{additional}"""
+"""
 
 
-def get_no_files_prompt(topic: str, language: str = "en") -> str:
-    """Prompt for generating summary without uploaded files - from general knowledge"""
+def _build_no_files_prompt(topic: str, language: str) -> str:
+    """Render the no-files prompt (pre-split around the topic at import)"""
     lang_instr = "Generate in TURKISH." if language == "tr" else "Generate in ENGLISH."
     
     return f"""You are creating comprehensive study notes on: "{topic}"
@@ -625,6 +804,18 @@ Use EXACT JSON format from system prompt (with all required fields: title, overv
 🚨 REMEMBER: Generate REAL CONTENT about "{topic}", NOT placeholders!"""
 
 
+# Static segments between the topic occurrences, per language
+_NO_FILES_PARTS = {
+    language: _build_no_files_prompt(_SPLICE, language).split(_SPLICE)
+    for language in ("en", "tr")
+}
+
+
+def get_no_files_prompt(topic: str, language: str = "en") -> str:
+    """Prompt for generating summary without uploaded files - from general knowledge"""
+    return topic.join(_NO_FILES_PARTS["tr" if language == "tr" else "en"])
+
+
 # ========== Helper Functions for Two-Stage REDUCE ==========
 
 def estimate_full_section_tokens(domain: str) -> int:
@@ -671,13 +862,16 @@ def coverage_gaps(outline: dict, aggregated_knowledge: dict) -> list:
     return [h for h in source_tops if h and all(h.lower() not in p.lower() for p in planned)]
 
 
+# Words marking a diagram as a probabilistic network whose edges need P= labels
+_PROBABILISTIC_DIAGRAM_KEYWORDS = ("bayesian", "probabilistic", "markov", "probability", "network", "chain")
+
+
 def validate_reduce_output(result: dict) -> list:
     """
     Universal validation for any domain/subject.
     Checks examples, formulas, glossary, citations with domain-agnostic rules.
     Returns list of issue strings (empty if all good)
     """
-    import re
     issues = []
     summary = result.get("summary", {})
     
@@ -768,10 +962,10 @@ def validate_reduce_output(result: dict) -> list:
         diagram_type = diagram.get("type", "").lower()
         diagram_title = diagram.get("title", f"Diagram {idx+1}").lower()
         diagram_content = diagram.get("content", "")
+        diagram_text = f"{diagram_title}\n{diagram_type}\n{diagram_content.lower()}"
         
         # Check if this is a probabilistic diagram
-        is_probabilistic = any(keyword in diagram_title or keyword in diagram_type or keyword in diagram_content.lower()
-                              for keyword in ["bayesian", "probabilistic", "markov", "probability", "network", "chain"])
+        is_probabilistic = any(keyword in diagram_text for keyword in _PROBABILISTIC_DIAGRAM_KEYWORDS)
         
         if is_probabilistic and "-->" in diagram_content:
             # Count edges (connections)
@@ -791,9 +985,7 @@ def validate_reduce_output(result: dict) -> list:
         issues.append(f"Practice problems too few ({len(practice_problems)}), expected ≥4")
     
     # Check output length (STRICT - this is critical!)
-    import json
-    result_json = json.dumps(result, ensure_ascii=False)
-    estimated_tokens = len(result_json) // 4  # Rough estimate: 4 chars per token
+    estimated_tokens = count_tokens(json_codec.dumps_text(result))
     
     # Adjusted minimum: 6000 tokens for comprehensiveness (was 8000 which was too strict)
     MIN_OUTPUT_TOKENS = 6000
@@ -810,7 +1002,6 @@ def build_self_repair_prompt(result: dict, issues: list, language: str) -> str:
     Domain-agnostic validation and repair instructions.
     ENHANCED: More aggressive expansion instructions
     """
-    import json
     lang = "Use TURKISH." if language == "tr" else "Use ENGLISH."
     issues_text = "\n- ".join(issues)
     
@@ -870,11 +1061,68 @@ Issues to fix:
 If not, EXPAND MORE - add more content, more details, more examples, more sections!
 
 CURRENT JSON:
-{json.dumps(result, ensure_ascii=False)}"""
+{json_codec.dumps_text(result)}"""
 
 
 # ========== Two-Stage REDUCE Orchestrator ==========
 
+# Item fields the reducer has no use for: char offsets only feed citation tracking,
+# and each item's _source repeats a heading that source_structure lists once per chunk
+_PROMPT_OMITTED_FIELDS = frozenset(("_source", "char_start", "char_end"))
+
+
+def _prompt_item(item):
+    """
+    An aggregated item as sent to the reducer: empty and internal fields dropped,
+    _source shortened to its chunk number
+    """
+    if not isinstance(item, dict):
+        return item
+    view = {
+        field: value for field, value in item.items()
+        if field not in _PROMPT_OMITTED_FIELDS and value not in ("", None, [], {})
+    }
+    source = item.get("_source")
+    if isinstance(source, dict) and "chunk" in source:
+        view["chunk"] = f"{source['chunk']}-{source['chunk_end']}" if "chunk_end" in source else source["chunk"]
+    return view
+
+
+def _knowledge_json(aggregated_knowledge: Dict, max_chars: float) -> str:
+    """
+    Compact JSON of the aggregated knowledge, serialized item by item and cut at
+    max_chars: later items are never serialized, and the result stays valid JSON
+    (lists past the cut are emitted empty) instead of ending mid-string
+    """
+    parts = ["{"]
+    size = 1
+    total = kept = 0
+    for key, value in aggregated_knowledge.items():
+        prefix = ("," if len(parts) > 1 else "") + json_codec.dumps_text(key) + ":"
+        parts.append(prefix)
+        size += len(prefix)
+        if not isinstance(value, list):
+            encoded = json_codec.dumps_text(value)
+            parts.append(encoded)
+            size += len(encoded)
+            continue
+        parts.append("[")
+        size += 2  # Both brackets
+        total += len(value)
+        for n, item in enumerate(value):
+            if size >= max_chars:
+                break
+            encoded = ("," if n else "") + json_codec.dumps_text(_prompt_item(item))
+            parts.append(encoded)
+            size += len(encoded)
+            kept += 1
+        parts.append("]")
+    parts.append("}")
+    if kept < total:
+        logger.info("[REDUCE] Aggregated knowledge truncated at %s chars (%s/%s items kept)", max_chars, kept, total)
+    return "".join(parts)
+
+
 def reduce_two_stage(
     aggregated_knowledge: dict,
     language: str,
@@ -882,7 +1130,8 @@ def reduce_two_stage(
     out_cap: int,
     additional_instructions: str = "",
     user_id: Optional[int] = None,
-    db = None
+    db = None,
+    on_delta: Optional[Callable[[str], None]] = None
 ) -> dict:
     """
     Two-stage REDUCE process:
@@ -892,24 +1141,18 @@ def reduce_two_stage(
     
     Returns: Final summary dict (parsed JSON)
     """
-    import json
-    from app.utils.json_helpers import parse_json_robust
     
     # === STAGE 1: Generate Outline ===
-    print("[REDUCE] Stage 1: Generating outline/topology...")
+    logger.info("[REDUCE] Stage 1: Generating outline/topology...")
     outline_prompt = get_reduce_outline_prompt(language, domain)
     
     # Truncate aggregated knowledge if too large (keep structure, limit content)
-    agg_str = json.dumps(aggregated_knowledge, ensure_ascii=False)
-    if len(agg_str) > 150000:
-        print(f"[REDUCE] Truncating aggregated knowledge ({len(agg_str)} → 150k chars)")
-        agg_str = agg_str[:150000] + "..."
-    
-    outline_user = (
-        outline_prompt
-        + "\n\nSTRUCTURED SOURCE KNOWLEDGE:\n"
-        + agg_str
-    )
+    agg_str = _knowledge_json(aggregated_knowledge, REDUCE_KNOWLEDGE_MAX_CHARS)
+    
+    # Prompts embed agg_str (up to 150k chars): assemble them with one join each
+    # instead of chained + / += that copy the whole buffer per step
+    outline_parts = [outline_prompt, "\n\nSTRUCTURED SOURCE KNOWLEDGE:\n", agg_str]
+    outline_user = "".join(outline_parts)
     
     outline_json = call_openai(
         system_prompt=SYSTEM_PROMPT,
@@ -918,7 +1161,8 @@ def reduce_two_stage(
         temperature=0,
         user_id=user_id,
         endpoint="/summarize",
-        db=db
+        db=db,
+        response_format=JSON_MODE
     )
     outline = parse_json_robust(outline_json)
     
@@ -928,15 +1172,16 @@ def reduce_two_stage(
         out_cap=out_cap,
         domain=domain
     )
-    print(f"[REDUCE] Outline targets: min={target_min}, soft_max={target_soft_max}, themes={approx_themes}")
+    logger.info("[REDUCE] Outline targets: min=%s, soft_max=%s, themes=%s", target_min, target_soft_max, approx_themes)
     
     # === SELF-REPAIR: Expand if outline too shallow ===
     if len(outline.get("sections", [])) < target_min:
-        print(f"[REDUCE] Outline too shallow ({len(outline.get('sections', []))} < {target_min}), expanding...")
-        outline_user += (
+        logger.info("[REDUCE] Outline too shallow (%s < %s), expanding...", len(outline.get('sections', [])), target_min)
+        outline_parts.append(
             f"\n\n[REPAIR] Expand sections to ensure full theme coverage "
             f"(expected ~{target_min}–{target_soft_max}, but exceeding is allowed if needed)."
         )
+        outline_user = "".join(outline_parts)
         outline_json = call_openai(
             system_prompt=SYSTEM_PROMPT,
             user_prompt=outline_user,
@@ -944,19 +1189,21 @@ def reduce_two_stage(
             temperature=0,
             user_id=user_id,
             endpoint="/summarize",
-            db=db
+            db=db,
+            response_format=JSON_MODE
         )
         outline = parse_json_robust(outline_json)
     
     # === SELF-REPAIR: Check coverage gaps ===
     missing = coverage_gaps(outline, aggregated_knowledge)
     if missing:
-        print(f"[REDUCE] Coverage gaps detected: {missing}")
-        outline_user += (
-            "\n\n[REPAIR] Missing key themes: "
-            + ", ".join(missing)
-            + ". Add them as sections or concise sub-concepts."
-        )
+        logger.info("[REDUCE] Coverage gaps detected: %s", missing)
+        outline_parts.extend((
+            "\n\n[REPAIR] Missing key themes: ",
+            ", ".join(missing),
+            ". Add them as sections or concise sub-concepts."
+        ))
+        outline_user = "".join(outline_parts)
         outline_json = call_openai(
             system_prompt=SYSTEM_PROMPT,
             user_prompt=outline_user,
@@ -964,20 +1211,21 @@ def reduce_two_stage(
             temperature=0,
             user_id=user_id,
             endpoint="/summarize",
-            db=db
+            db=db,
+            response_format=JSON_MODE
         )
         outline = parse_json_robust(outline_json)
     
     # === STAGE 2: Fill Outline ===
-    print("[REDUCE] Stage 2: Filling outline with content...")
+    logger.info("[REDUCE] Stage 2: Filling outline with content...")
     fill_prompt = get_reduce_fill_prompt(language, domain, additional_instructions)
-    fill_user = (
-        fill_prompt
-        + "\n\nOUTLINE (DO NOT CHANGE ORDER):\n"
-        + json.dumps(outline, ensure_ascii=False, indent=2)
-        + "\n\nSTRUCTURED SOURCE KNOWLEDGE:\n"
-        + agg_str
-    )
+    fill_user = "".join((
+        fill_prompt,
+        "\n\nOUTLINE (DO NOT CHANGE ORDER):\n",
+        json_codec.dumps_text(outline),
+        "\n\nSTRUCTURED SOURCE KNOWLEDGE:\n",
+        agg_str
+    ))
     
     filled_json = call_openai(
         system_prompt=SYSTEM_PROMPT,
@@ -986,15 +1234,18 @@ def reduce_two_stage(
         temperature=0,
         user_id=user_id,
         endpoint="/summarize",
-        db=db
+        db=db,
+        response_format=JSON_MODE,
+        stream=True,  # Largest output of the pipeline
+        on_delta=on_delta
     )
     result = parse_json_robust(filled_json)
     
     # === STAGE 3: Validate & Self-Repair ===
-    print("[REDUCE] Stage 3: Validating output...")
+    logger.info("[REDUCE] Stage 3: Validating output...")
     issues = validate_reduce_output(result)
     if issues:
-        print(f"[REDUCE] Quality issues detected: {issues}")
+        logger.info("[REDUCE] Quality issues detected: %s", issues)
         repair_user = build_self_repair_prompt(result, issues, language)
         repaired = call_openai(
             system_prompt=SYSTEM_PROMPT,
@@ -1003,18 +1254,74 @@ def reduce_two_stage(
             temperature=0,
             user_id=user_id,
             endpoint="/summarize",
-            db=db
+            db=db,
+            response_format=JSON_MODE
         )
         result = parse_json_robust(repaired) or result
-        print("[REDUCE] Self-repair complete")
+        logger.info("[REDUCE] Self-repair complete")
     else:
-        print("[REDUCE] Output validated ✓")
+        logger.info("[REDUCE] Output validated ✓")
     
     return result
 
 
 # ========== OpenAI Integration ==========
 
+def _track_token_usage(usage: Dict, user_id: int, endpoint: str, price_factor: float = 1.0) -> None:
+    """
+    Log an OpenAI usage block via the token tracker
+    price_factor scales the list price (e.g. discounted Batch API requests)
+    Never raises: tracking failures must not fail the request
+    """
+    try:
+        input_tokens = usage.get("prompt_tokens", 0)
+        output_tokens = usage.get("completion_tokens", 0)
+        total_tokens = usage.get("total_tokens", 0)
+        
+        # Skip if no tokens
+        if total_tokens == 0:
+            logger.warning("[TOKEN TRACKING] ⚠️ Skipping - zero tokens")
+            return
+        
+        # Cost calculation (per 1M tokens)
+        if "gpt-4o" in OPENAI_MODEL.lower() and "mini" not in OPENAI_MODEL.lower():
+            input_cost_per_1m = 2.50
+            output_cost_per_1m = 10.00
+        elif "gpt-4" in OPENAI_MODEL.lower():
+            input_cost_per_1m = 30.00
+            output_cost_per_1m = 60.00
+        else:
+            input_cost_per_1m = 0.150
+            output_cost_per_1m = 0.600
+        
+        estimated_cost = (input_tokens / 1_000_000 * input_cost_per_1m) + (output_tokens / 1_000_000 * output_cost_per_1m)
+        estimated_cost *= price_factor
+        
+        # Use centralized token tracker with fresh session
+        from app.services.token_tracker import log_token_usage
+        log_token_usage(
+            user_id=user_id,
+            endpoint=endpoint,
+            model=OPENAI_MODEL,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=total_tokens,
+            estimated_cost=estimated_cost
+        )
+    except Exception as e:
+        # Don't fail the request if token tracking fails
+        logger.exception("[TOKEN TRACKING ERROR] ❌ Failed to track: %s", e)
+
+
+# OpenAI JSON mode: output is constrained to one syntactically valid JSON object
+JSON_MODE = {"type": "json_object"}
+
+_CONTINUE_PROMPT = (
+    "Continue exactly where you stopped. Output only the remaining text - "
+    "do not repeat anything already written and do not add markdown fences."
+)
+
+
 def call_openai(
     system_prompt: str,
     user_prompt: str,
@@ -1024,29 +1331,43 @@ def call_openai(
     retry_on_length: bool = True,
     user_id: Optional[int] = None,
     endpoint: str = "/summarize",
-    db = None
+    db = None,
+    response_format: Optional[Dict] = None,
+    stream: bool = False,
+    cache: bool = False,
+    on_delta: Optional[Callable[[str], None]] = None
 ) -> str:
     """
-    Call OpenAI API with given prompts and automatic retry on truncation
+    Call OpenAI API with given prompts and automatic continuation on truncation
     Returns the response text
     Tracks token usage in database if db and user_id provided
+    Pass response_format=JSON_MODE to have the decoder emit a single valid JSON object
+    Pass stream=True for long outputs: the reply is received as SSE deltas
+    Pass on_delta to also receive each delta as it arrives (implies stream=True)
+    Pass cache=True to reuse the reply of an identical earlier request (low temperature only)
     """
     if not OPENAI_API_KEY:
         raise ValueError("OpenAI API key not configured")
     
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    cache_key = None
+    if cache and temperature <= LLM_CACHE_MAX_TEMPERATURE:
+        cache_key = _llm_cache_key(system_prompt, user_prompt, max_output_tokens, temperature, top_p, response_format)
+        cached = _cache_lookup(cache_key)
+        if cached is not None:
+            logger.debug("[LLM CACHE] Hit for %s", endpoint)
+            return cached
+    
+    url = OPENAI_CHAT_URL
+    headers = json_headers(OPENAI_API_KEY)
     
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
+    prompt_text = user_prompt
     
     attempt = 0
-    current_max_tokens = max_output_tokens
+    parts = []
     
     while attempt < 2:  # Max 2 attempts
         attempt += 1
@@ -1056,77 +1377,221 @@ def call_openai(
             "messages": messages,
             "temperature": temperature,
             "top_p": top_p,
-            "max_tokens": current_max_tokens
+            "max_tokens": max_output_tokens
         }
+        # JSON mode forces a complete object, so it can't be used to continue a truncated one
+        if response_format and attempt == 1:
+            payload["response_format"] = response_format
+        if user_id:
+            payload["user"] = openai_user_tag(user_id)
         
-        print(f"[OPENAI REQUEST] Attempt {attempt}, Model: {OPENAI_MODEL}, max_tokens: {current_max_tokens}")
-        
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+        logger.debug("[OPENAI REQUEST] Attempt %s, Model: %s, max_tokens: %s", attempt, OPENAI_MODEL, max_output_tokens)
         
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            raise Exception(f"OpenAI API call failed ({response.status_code}): {error_detail}")
+        # Pace against the TPM limit instead of bursting into 429s
+        waited = openai_limiter.acquire(estimate_request_tokens(system_prompt, prompt_text, max_output_tokens))
+        if waited:
+            logger.info("[OPENAI RATE LIMIT] Waited %.1fs for TPM capacity", waited)
         
-        result = response.json()
-        content = result["choices"][0]["message"]["content"]
-        finish_reason = result["choices"][0].get("finish_reason")
-        usage = result.get("usage", {})
-        
-        print(f"[OPENAI RESPONSE] Returned {len(content)} chars, finish_reason: {finish_reason}")
-        
-        # Track token usage in database (non-blocking)
-        if endpoint and attempt == 1 and usage and user_id:  # Only track on first successful attempt with usage data
+        # 429/5xx and failed connects are retried by the pooled session; a connection
+        # the server drops mid-reply is re-sent here with the same backoff. Timeouts
+        # are not: the request may still be running (and billed) upstream.
+        # Streams already forwarded to on_delta can't be replayed, so they aren't retried
+        retries = 0 if on_delta else OPENAI_CALL_RETRIES
+        for retry in range(retries + 1):
             try:
-                input_tokens = usage.get("prompt_tokens", 0)
-                output_tokens = usage.get("completion_tokens", 0)
-                total_tokens = usage.get("total_tokens", 0)
-                
-                # Skip if no tokens
-                if total_tokens == 0:
-                    print(f"[TOKEN TRACKING] ⚠️ Skipping - zero tokens")
+                if stream or on_delta:
+                    content, finish_reason, usage = _post_chat_stream(headers, payload, on_delta)
                 else:
-                    # Cost calculation (per 1M tokens)
-                    if "gpt-4o" in OPENAI_MODEL.lower() and "mini" not in OPENAI_MODEL.lower():
-                        input_cost_per_1m = 2.50
-                        output_cost_per_1m = 10.00
-                    elif "gpt-4" in OPENAI_MODEL.lower():
-                        input_cost_per_1m = 30.00
-                        output_cost_per_1m = 60.00
-                    else:
-                        input_cost_per_1m = 0.150
-                        output_cost_per_1m = 0.600
-                    
-                    estimated_cost = (input_tokens / 1_000_000 * input_cost_per_1m) + (output_tokens / 1_000_000 * output_cost_per_1m)
-                    
-                    # Use centralized token tracker with fresh session
-                    from app.services.token_tracker import log_token_usage
-                    log_token_usage(
-                        user_id=user_id,
-                        endpoint=endpoint,
-                        model=OPENAI_MODEL,
-                        input_tokens=input_tokens,
-                        output_tokens=output_tokens,
-                        total_tokens=total_tokens,
-                        estimated_cost=estimated_cost
-                    )
-            except Exception as e:
-                # Don't fail the request if token tracking fails
-                print(f"[TOKEN TRACKING ERROR] ❌ Failed to track: {e}")
-                import traceback
-                traceback.print_exc()
+                    content, finish_reason, usage = _post_chat(url, headers, payload)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if retry == retries or not _dropped_mid_reply(e):
+                    raise
+                delay = backoff_seconds(retry)
+                logger.warning("[OPENAI RETRY] %s; retrying in %.1fs", e, delay)
+                time.sleep(delay)
+        parts.append(content)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[OPENAI RESPONSE] Returned %s chars, finish_reason: %s", len(content), finish_reason)
         
-        # If truncated and retry enabled, try with 20% more tokens
+        # Track token usage in database (non-blocking); continuations are billed too
+        if endpoint and usage and user_id:
+            _track_token_usage(usage, user_id, endpoint)
+        if attempt == 1 and usage:
+            observe_prompt_tokens(len(system_prompt) + len(user_prompt), usage.get("prompt_tokens", 0))
+        
+        # If truncated, ask the model to continue from where it stopped instead of
+        # regenerating the whole answer with a bigger budget
         if finish_reason == "length" and retry_on_length and attempt < 2:
-            current_max_tokens = min(int(current_max_tokens * 1.2), 16000)
-            print(f"[OPENAI RETRY] Response truncated, retrying with {current_max_tokens} tokens")
+            logger.info("[OPENAI CONTINUE] Response truncated, requesting continuation")
+            messages = messages + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": _CONTINUE_PROMPT}
+            ]
+            prompt_text += content + _CONTINUE_PROMPT
             continue
         
-        return content
+        break
     
-    # If still truncated after retry, return what we have
+    # If still truncated after the continuation, return what we have (but don't
+    # cache it: a re-run should get the chance of a complete reply)
+    content = "".join(parts)
+    if cache_key and finish_reason != "length":
+        _cache_store(cache_key, content)
     return content
 
 
+def _dropped_mid_reply(error: requests.RequestException) -> bool:
+    """Whether a request failed because the server closed the connection mid-reply"""
+    if isinstance(error, requests.exceptions.ChunkedEncodingError):
+        return True
+    cause = error.args[0] if error.args else None
+    # Once the pool's retries are spent, the last error is wrapped in a MaxRetryError
+    return isinstance(getattr(cause, "reason", cause), ProtocolError)
+
+
+def _llm_cache_key(
+    system_prompt: str,
+    user_prompt: str,
+    max_output_tokens: int,
+    temperature: float,
+    top_p: float,
+    response_format: Optional[Dict]
+) -> str:
+    """Key for one call_openai request: hash of everything that shapes the reply"""
+    request = [OPENAI_MODEL, system_prompt, user_prompt, max_output_tokens, temperature, top_p, response_format]
+    return "llm:" + hashlib.blake2b(json_codec.dumps(request), digest_size=16).hexdigest()
+
+
+def _post_chat(url: str, headers: Dict, payload: Dict) -> tuple:
+    """Send a non-streaming chat completion; returns (content, finish_reason, usage)"""
+    response = get_http_session().post(url, headers=headers, data=json_codec.dumps(payload), timeout=180)
+    
+    if response.status_code == 429:
+        openai_limiter.penalize(retry_after_seconds(response))
+    
+    if response.status_code != 200:
+        error_detail = response.text[:500]
+        raise Exception(f"OpenAI API call failed ({response.status_code}): {error_detail}")
+    
+    result = json_codec.loads(response.content)
+    choice = result["choices"][0]
+    return choice["message"]["content"], choice.get("finish_reason"), result.get("usage", {})
+
+
+def _iter_stream_events(response) -> Iterator[dict]:
+    """Decode the SSE "data:" frames of a streaming chat completion"""
+    for line in response.iter_lines():
+        if not line or not line.startswith(b"data: "):
+            continue
+        data = line[6:]
+        if data == b"[DONE]":
+            break
+        yield json_codec.loads(data)
+
+
+def _post_chat_stream(headers: Dict, payload: Dict, on_delta: Optional[Callable[[str], None]] = None) -> tuple:
+    """
+    Send a chat completion with stream=True and accumulate it
+    Returns (content, finish_reason, usage); output arrives incrementally, so long
+    generations never sit idle on the socket waiting for the full body
+    on_delta (optional) is called with each content delta as it arrives
+    """
+    payload = dict(payload, stream=True, stream_options={"include_usage": True})
+    with get_http_session().post(
+        OPENAI_CHAT_URL, headers=headers, data=json_codec.dumps(payload), timeout=180, stream=True
+    ) as response:
+        if response.status_code == 429:
+            openai_limiter.penalize(retry_after_seconds(response))
+        if response.status_code != 200:
+            error_detail = response.text[:500]
+            raise Exception(f"OpenAI API call failed ({response.status_code}): {error_detail}")
+        
+        pieces = []
+        finish_reason = None
+        usage = {}
+        for event in _iter_stream_events(response):
+            if event.get("usage"):
+                usage = event["usage"]
+            for choice in event.get("choices") or ():
+                delta = choice.get("delta", {}).get("content")
+                if delta:
+                    pieces.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+    
+    return "".join(pieces), finish_reason, usage
+
+
+def call_openai_stream(
+    system_prompt: str,
+    user_prompt: str,
+    max_output_tokens: int,
+    temperature: float = TEMPERATURE,
+    top_p: float = TOP_P,
+    user_id: Optional[int] = None,
+    endpoint: str = "/summarize",
+) -> Iterator[str]:
+    """
+    Stream an OpenAI completion, yielding content deltas as they arrive (SSE)
+    Lets callers start consuming output before generation finishes
+    Tracks token usage from the final usage frame if user_id provided
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not configured")
+    
+    headers = json_headers(OPENAI_API_KEY)
+    payload = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": temperature,
+        "top_p": top_p,
+        "max_tokens": max_output_tokens,
+        "stream": True,
+        "stream_options": {"include_usage": True}
+    }
+    if user_id:
+        payload["user"] = openai_user_tag(user_id)
+    
+    logger.debug("[OPENAI STREAM] Model: %s, max_tokens: %s", OPENAI_MODEL, max_output_tokens)
+    
+    openai_limiter.acquire(estimate_request_tokens(system_prompt, user_prompt, max_output_tokens))
+    
+    with get_http_session().post(
+        OPENAI_CHAT_URL, headers=headers, data=json_codec.dumps(payload), timeout=180, stream=True
+    ) as response:
+        if response.status_code == 429:
+            openai_limiter.penalize(retry_after_seconds(response))
+        if response.status_code != 200:
+            error_detail = response.text[:500]
+            raise Exception(f"OpenAI API call failed ({response.status_code}): {error_detail}")
+        
+        usage = None
+        finish_reason = None
+        total_chars = 0
+        for event in _iter_stream_events(response):
+            if event.get("usage"):
+                usage = event["usage"]
+            for choice in event.get("choices") or ():
+                delta = choice.get("delta", {}).get("content")
+                if delta:
+                    total_chars += len(delta)
+                    yield delta
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+    
+    logger.debug("[OPENAI STREAM] Returned %s chars, finish_reason: %s", total_chars, finish_reason)
+    
+    if endpoint and usage and user_id:
+        _track_token_usage(usage, user_id, endpoint)
+
+
 # ========== Map-Reduce Pipeline ==========
 
 def summarize_chunk(
@@ -1141,27 +1606,508 @@ def summarize_chunk(
     Summarize a single chunk of text (MAP phase)
     Returns structured mini-JSON with concepts/formulas/theorems/examples
     """
+    additional_instructions = normalize_instructions(additional_instructions)
+    user_prompt, out_budget = _build_chunk_request(chunk_text, language, additional_instructions, out_budget)
+    
+    # Re-uploaded material yields byte-identical chunks: serve those from cache
+    cache_key = _chunk_cache_key(chunk_text, language, additional_instructions, out_budget)
+    cached = _chunk_cache_get(cache_key)
+    if cached is not None:
+        logger.debug("[MAP CACHE] Hit for chunk (%s chars)", len(chunk_text))
+        return cached
+    
+    # The same chunk may already be in flight for a concurrent upload: share that call
+    with _inflight_lock:
+        shared = _inflight_chunks.get(cache_key)
+        if shared is None:
+            _inflight_chunks[cache_key] = owned = Future()
+    if shared is not None:
+        logger.debug("[MAP DEDUPE] Waiting for in-flight summary of identical chunk")
+        return shared.result()
+    
+    try:
+        # A truncated MAP summary means the chunk is too big, not that a bigger
+        # budget will help, so don't pay for a second round trip
+        content = call_openai(
+            system_prompt=SYSTEM_PROMPT,
+            user_prompt=user_prompt,
+            max_output_tokens=out_budget,
+            retry_on_length=False,
+            user_id=user_id,
+            endpoint="/summarize",
+            db=db,
+            response_format=JSON_MODE
+        )
+        _chunk_cache_put(cache_key, content)
+        owned.set_result(content)
+        return content
+    except BaseException as e:
+        owned.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_chunks.pop(cache_key, None)
+
+
+# MAP calls currently running, by chunk cache key (single-flight across requests)
+_inflight_chunks: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+# Everything besides the chunk itself that shapes a MAP response; part of every chunk cache key
+_MAP_PROMPT_DIGEST = hashlib.sha256(
+    "\x00".join((SYSTEM_PROMPT, _CHUNK_PROMPT_EN, _CHUNK_PROMPT_TR)).encode("utf-8")
+).hexdigest()
+
+
+def _chunk_cache_key(chunk_text: str, language: str, additional_instructions: str, out_budget: int) -> str:
+    """Content-addressed key for one MAP call (hashes the chunk rather than embedding it)"""
+    h = hashlib.sha256()
+    for part in (
+        _MAP_PROMPT_DIGEST, OPENAI_MODEL, repr(TEMPERATURE), repr(TOP_P), str(out_budget),
+        language, additional_instructions or "", chunk_text
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return "chunk:" + h.hexdigest()
+
+
+def _cache_lookup(key: str) -> Optional[str]:
+    """Look up a cached model reply (memory LRU, then DB); None on miss or error"""
+    try:
+        from sqlalchemy.orm import Session
+        from app.services.cache import cache_engine, get_cached
+        # MAP runs on worker threads: use a private session, never the request's
+        with Session(cache_engine) as cache_db:
+            return get_cached(key, cache_db, ttl_seconds=LLM_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("[LLM CACHE] Lookup failed: %s", e)
+        return None
+
+
+def _cache_store(key: str, content: str) -> None:
+    if not content:
+        return
+    try:
+        from sqlalchemy.orm import Session
+        from app.services.cache import cache_engine, set_cached
+        with Session(cache_engine) as cache_db:
+            set_cached(key, content, cache_db)
+    except Exception as e:
+        logger.warning("[LLM CACHE] Store failed: %s", e)
+
+
+def _chunk_cache_get(key: str) -> Optional[str]:
+    """Look up a cached chunk summary; None on miss"""
+    if TEMPERATURE > LLM_CACHE_MAX_TEMPERATURE:
+        return None  # Sampled outputs are meant to differ between runs
+    return _cache_lookup(key)
+
+
+def _chunk_cache_put(key: str, content: str) -> None:
+    if TEMPERATURE <= LLM_CACHE_MAX_TEMPERATURE:
+        _cache_store(key, content)
+
+
+def _build_chunk_request(
+    chunk_text: str,
+    language: str,
+    additional_instructions: str,
+    out_budget: Optional[int]
+) -> tuple:
+    """
+    Build the MAP user prompt and output budget for one chunk
+    Shared by the synchronous and Batch API paths so both send identical requests
+    """
     # Adaptive budget based on chunk content
     if out_budget is None:
-        from app.utils.adaptive_budget import calculate_chunk_budget
         out_budget = calculate_chunk_budget(chunk_text)
-        print(f"[MAP ADAPTIVE] Allocated {out_budget} tokens for this chunk")
+        logger.debug("[MAP ADAPTIVE] Allocated %s tokens for this chunk", out_budget)
     
+    return _chunk_prompt_prefix(language, additional_instructions) + chunk_text, out_budget
+
+
+@lru_cache(maxsize=32)
+def _chunk_prompt_prefix(language: str, additional_instructions: str) -> str:
+    """Everything in a MAP prompt before the chunk text (same for every chunk of a document)"""
     user_prompt = get_chunk_summary_prompt(language)
     
     if additional_instructions:
         user_prompt += f"\n\nUser preferences: {additional_instructions}"
     
-    user_prompt += f"\n\nTEXT TO EXTRACT FROM:\n{chunk_text}"
+    return user_prompt + "\n\nTEXT TO EXTRACT FROM:\n"
+
+
+_SUMMARY_BREAK = "===SUMMARY BREAK==="
+
+
+def summarize_chunk_group(
+    chunk_texts: List[str],
+    language: str = "en",
+    additional_instructions: str = "",
+    user_id: Optional[int] = None,
+    db = None,
+    chunk_tokens: Optional[List[int]] = None
+) -> List[str]:
+    """
+    Summarize several small chunks in one MAP call (one system prompt, one round trip)
+    Falls back to one call per chunk if the reply does not split into one block each
+    chunk_tokens optionally carries the chunks' token counts (not re-tokenized then)
+    """
+    if chunk_tokens is None:
+        chunk_tokens = [None] * len(chunk_texts)
+    if len(chunk_texts) == 1:
+        return [summarize_chunk(chunk_texts[0], language=language,
+                                additional_instructions=additional_instructions,
+                                out_budget=calculate_chunk_budget(chunk_texts[0], chunk_tokens[0]),
+                                user_id=user_id, db=db)]
+    
+    additional_instructions = normalize_instructions(additional_instructions)
+    budgets = [calculate_chunk_budget(text, tokens) for text, tokens in zip(chunk_texts, chunk_tokens)]
+    cache_keys = [
+        _chunk_cache_key(text, language, additional_instructions, budget)
+        for text, budget in zip(chunk_texts, budgets)
+    ]
+    cached = [_chunk_cache_get(key) for key in cache_keys]
+    misses = [i for i, hit in enumerate(cached) if hit is None]
+    if len(misses) < len(chunk_texts):
+        if misses:
+            fresh = summarize_chunk_group(
+                [chunk_texts[i] for i in misses], language=language,
+                additional_instructions=additional_instructions, user_id=user_id, db=db,
+                chunk_tokens=[chunk_tokens[i] for i in misses]
+            )
+            for i, content in zip(misses, fresh):
+                cached[i] = content
+        return cached
+    out_budget = sum(budgets)
+    
+    parts = [get_chunk_summary_prompt(language)]
+    if additional_instructions:
+        parts.append(f"\n\nUser preferences: {additional_instructions}")
+    parts.append(
+        f"\n\nThe text below contains {len(chunk_texts)} separate excerpts. "
+        f"Output one JSON object per excerpt, in order, separated by a line containing only {_SUMMARY_BREAK}"
+    )
+    for n, text in enumerate(chunk_texts, 1):
+        parts.append(f"\n\n=== EXCERPT {n} ===\n{text}")
     
-    return call_openai(
+    content = call_openai(
         system_prompt=SYSTEM_PROMPT,
-        user_prompt=user_prompt,
-        max_output_tokens=out_budget,
+        user_prompt="".join(parts),
+        max_output_tokens=min(out_budget, 16000),
+        retry_on_length=False,
         user_id=user_id,
         endpoint="/summarize",
         db=db
     )
+    
+    blocks = [block.strip() for block in content.split(_SUMMARY_BREAK)]
+    blocks = [block for block in blocks if block]
+    if len(blocks) == len(chunk_texts):
+        for key, block in zip(cache_keys, blocks):
+            _chunk_cache_put(key, block)
+        return blocks
+    
+    logger.warning("[MAP MARSHAL] Expected %s blocks, got %s - summarizing separately", len(chunk_texts), len(blocks))
+    return [
+        summarize_chunk(text, language=language, additional_instructions=additional_instructions,
+                        user_id=user_id, db=db)
+        for text in chunk_texts
+    ]
+
+
+def _iter_chunk_groups(indexed_tokens: Iterable[Tuple[int, int]]) -> Iterator[List[int]]:
+    """
+    Pack consecutive (chunk index, token count) pairs into groups within the MAP input target
+    Each group is yielded as soon as it is full, so callers can dispatch it right away
+    """
+    current, current_tokens = [], 0
+    for i, tokens in indexed_tokens:
+        if current and (current_tokens + tokens > CHUNK_INPUT_TARGET or len(current) >= MAP_MARSHAL_MAX_CHUNKS):
+            yield current
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def _group_small_chunks(indices: List[int], chunk_tokens: List[int]) -> List[List[int]]:
+    """Pack consecutive chunk indices into groups within the MAP input target"""
+    return list(_iter_chunk_groups((i, chunk_tokens[i]) for i in indices))
+
+
+def call_openai_batch(requests: List[Dict], user_id: Optional[int] = None) -> List[Optional[str]]:
+    """
+    Run several chat completions as one OpenAI Batch API job (offline use)
+    Each request is a dict of call_openai arguments: system_prompt, user_prompt,
+    max_output_tokens and optionally temperature, top_p, response_format
+    Returns the reply contents in request order; None where a request failed
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not configured")
+    if not requests:
+        return []
+    
+    bodies = {}
+    for i, request in enumerate(requests):
+        body = {
+            "model": OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": request["system_prompt"]},
+                {"role": "user", "content": request["user_prompt"]}
+            ],
+            "temperature": request.get("temperature", TEMPERATURE),
+            "top_p": request.get("top_p", TOP_P),
+            "max_tokens": request["max_output_tokens"]
+        }
+        if request.get("response_format"):
+            body["response_format"] = request["response_format"]
+        if user_id:
+            body["user"] = openai_user_tag(user_id)
+        bodies[f"req-{i}"] = body
+    
+    batch_id = submit_chat_batch(bodies, OPENAI_API_KEY)
+    logger.info("[OPENAI BATCH] Submitted %s requests as batch %s", len(bodies), batch_id)
+    batch = wait_for_batch(batch_id, OPENAI_API_KEY)
+    results = fetch_batch_results(batch, OPENAI_API_KEY)
+    
+    contents = []
+    for custom_id in bodies:
+        body = results.get(custom_id)
+        if body is None:
+            contents.append(None)
+            continue
+        contents.append(body["choices"][0]["message"]["content"])
+        if user_id and body.get("usage"):
+            _track_token_usage(body["usage"], user_id, "/summarize", price_factor=OPENAI_BATCH_PRICE_FACTOR)
+    
+    failed = contents.count(None)
+    if failed:
+        logger.warning("[OPENAI BATCH] Batch %s: %s/%s requests failed", batch_id, failed, len(bodies))
+    return contents
+
+
+def summarize_chunks_batch(
+    chunks: List[str],
+    language: str = "en",
+    additional_instructions: str = "",
+    user_id: Optional[int] = None
+) -> List[str]:
+    """
+    Summarize all chunks through the OpenAI Batch API (MAP phase, offline use)
+    Half the price of synchronous calls but may take minutes to hours to complete
+    Chunks already in the MAP cache are not resubmitted; failed requests are redone synchronously
+    Returns summaries in chunk order
+    """
+    additional_instructions = normalize_instructions(additional_instructions)
+    summaries = [None] * len(chunks)
+    pending = []  # (chunk index, cache key, request)
+    for i, chunk_text in enumerate(chunks):
+        user_prompt, out_budget = _build_chunk_request(chunk_text, language, additional_instructions, None)
+        cache_key = _chunk_cache_key(chunk_text, language, additional_instructions, out_budget)
+        summaries[i] = _chunk_cache_get(cache_key)
+        if summaries[i] is None:
+            pending.append((i, cache_key, {
+                "system_prompt": SYSTEM_PROMPT,
+                "user_prompt": user_prompt,
+                "max_output_tokens": out_budget,
+                "response_format": JSON_MODE
+            }))
+    if len(pending) < len(chunks):
+        logger.info("[OPENAI BATCH] %s/%s chunks served from cache", len(chunks) - len(pending), len(chunks))
+    
+    contents = call_openai_batch([request for _, _, request in pending], user_id=user_id)
+    for (i, cache_key, _), content in zip(pending, contents):
+        if content is None:
+            # Individual requests can fail inside a completed batch
+            content = summarize_chunk(
+                chunks[i],
+                language=language,
+                additional_instructions=additional_instructions,
+                user_id=user_id
+            )
+        else:
+            _chunk_cache_put(cache_key, content)
+        summaries[i] = content
+    
+    return summaries
+
+
+# Mermaid repair patterns, compiled once (applied to every diagram of every summary)
+_MERMAID_HEADERS = ('graph ', 'flowchart ', 'sequenceDiagram', 'classDiagram')
+_MERMAID_BARE_SOURCE = re.compile(r'\b([A-Z][a-zA-Z0-9_]*)\s+(-->)')
+_MERMAID_BARE_TARGET = re.compile(r'\|\s+([A-Z][a-zA-Z0-9_]*)(?:\s|$)')
+_MERMAID_PAREN_LABEL = re.compile(r'-->\|([^|"]+\([^)]*\)[^|"]*)\|')
+_MERMAID_NODE_AFTER_NODE = re.compile(r'(\])\s+([A-Z]\[)')
+_MERMAID_NODE_AFTER_LABEL = re.compile(r'(\|)\s+([A-Z]\[)')
+
+
+def fix_mermaid_syntax(content: str) -> str:
+    """
+    Repair common Mermaid syntax errors in model-generated diagrams
+    Brackets bare node names, quotes edge labels containing parentheses,
+    and splits edges that were emitted on one line
+    """
+    fixed_lines = []
+    for line in content.split('\n'):
+        # Skip the graph/flowchart declaration line
+        if line.strip().startswith(_MERMAID_HEADERS):
+            fixed_lines.append(line)
+            continue
+        
+        # Fix 1: NodeName -->  becomes  NodeName[NodeName] -->,  | NodeName  becomes  | NodeName[NodeName]
+        line = _MERMAID_BARE_SOURCE.sub(r'\1[\1] \2', line)
+        line = _MERMAID_BARE_TARGET.sub(r'| \1[\1] ', line)
+        # Fix 2: -->|label(x)|  becomes  -->|"label(x)"|
+        line = _MERMAID_PAREN_LABEL.sub(r'-->|"\1"|', line)
+        fixed_lines.append(line)
+    
+    fixed = '\n'.join(fixed_lines)
+    
+    # Fix 3: Add newlines between edges that share a line
+    fixed = _MERMAID_NODE_AFTER_NODE.sub(r'\1\n  \2', fixed)
+    return _MERMAID_NODE_AFTER_LABEL.sub(r'\1\n  \2', fixed)
+
+
+def _normalized_value(value) -> str:
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return repr(value)
+
+
+def _drop_repeated_items(items: List) -> List:
+    """
+    Remove MAP items whose content repeats an earlier item, ignoring case,
+    whitespace and internal fields (e.g. _source); keeps first-seen order
+    """
+    seen = set()
+    kept = []
+    for item in items:
+        if isinstance(item, dict):
+            key = tuple(sorted(
+                (field, _normalized_value(value)) for field, value in item.items() if not field.startswith("_")
+            ))
+        else:
+            key = _normalized_value(item)
+        if key not in seen:
+            seen.add(key)
+            kept.append(item)
+    if len(kept) < len(items):
+        logger.info("[REDUCE] Dropped %s repeated items (%s → %s)", len(items) - len(kept), len(items), len(kept))
+    return kept
+
+
+# (field naming an item, field whose length decides which duplicate to keep) per MAP list
+_ITEM_IDENTITY = {
+    "concepts": ("term", "explanation"),
+    "formulas": ("expression", "worked_example"),
+    "theorems": ("name", "proof_sketch"),
+}
+_ITEM_KEY_PUNCT = re.compile(r"[^\w\s]")
+_FUZZY_KEY_CUTOFF = 0.9  # difflib ratio at which two names count as the same item
+# Words that tell otherwise identical names apart ("Type I" / "Type II", "Layer 2" /
+# "Layer 3"): names that differ in such a word are never fuzzy-matched
+_NUMBERING_WORD = re.compile(r"\d|^(?=[ivxlcdm]+$)m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})$")
+# Fields whose values from every duplicate are kept (joined) rather than only filled in
+_EXAMPLE_FIELDS = ("example", "examples", "worked_example")
+_MATH_DELIMITERS = re.compile(r"^(?:\\\(|\$)+|(?:\\\)|\$)+$")
+
+
+def _item_key(value) -> str:
+    """Name of an item with case, punctuation and spacing removed"""
+    if not isinstance(value, str):
+        return ""
+    return " ".join(_ITEM_KEY_PUNCT.sub(" ", value.lower()).split())
+
+
+def _expression_key(value) -> str:
+    """
+    Formula expression without whitespace or surrounding \\( \\) / $ delimiters
+    Case and symbols are kept: in math they change the meaning
+    """
+    if not isinstance(value, str):
+        return ""
+    return _MATH_DELIMITERS.sub("", "".join(value.split()))
+
+
+def _differ_in_numbering(key: str, other: str) -> bool:
+    """Whether two item names differ in a number or roman numeral"""
+    return any(_NUMBERING_WORD.search(word) for word in set(key.split()) ^ set(other.split()))
+
+
+def _join_examples(value, other):
+    """Examples of two duplicate items, each kept once"""
+    if isinstance(value, list) and isinstance(other, list):
+        return value + [example for example in other if example not in value]
+    if isinstance(value, str) and isinstance(other, str) and other.strip() not in value:
+        return f"{value}\n{other}"
+    return value
+
+
+def _merge_same_named_items(
+    items: List,
+    name_field: str,
+    detail_field: str,
+    key_fn: Callable[[object], str] = _item_key,
+    fuzzy: bool = True
+) -> List:
+    """
+    Collapse items that name the same thing ("Gradient Descent" / "gradient descent." /
+    "gradient descents"): the one with the longest detail_field is kept, fields it
+    leaves empty are filled from the others and their examples are appended. Unnamed
+    items pass through; order is kept
+    key_fn normalizes name_field; fuzzy=False requires keys to match exactly, and
+    fuzzy matching never joins names that differ in numbering ("Type I" / "Type II")
+    """
+    kept = []
+    slot_by_key = {}
+    keys_by_prefix = {}  # Fuzzy candidates share the first 4 characters
+    for item in items:
+        key = key_fn(item.get(name_field)) if isinstance(item, dict) else ""
+        if not key:
+            kept.append(item)
+            continue
+        slot = slot_by_key.get(key)
+        if slot is None and fuzzy:
+            match = [
+                close for close in difflib.get_close_matches(key, keys_by_prefix.get(key[:4], ()), n=3, cutoff=_FUZZY_KEY_CUTOFF)
+                if not _differ_in_numbering(key, close)
+            ]
+            if match:
+                slot = slot_by_key[key] = slot_by_key[match[0]]
+        if slot is None:
+            slot_by_key[key] = len(kept)
+            keys_by_prefix.setdefault(key[:4], []).append(key)
+            kept.append(item)
+            continue
+        first, other = kept[slot], item
+        if len(str(other.get(detail_field) or "")) > len(str(first.get(detail_field) or "")):
+            first, other = other, first
+        merged = dict(first)
+        for field, value in other.items():
+            if value and not merged.get(field):
+                merged[field] = value
+            elif value and field in _EXAMPLE_FIELDS:
+                merged[field] = _join_examples(merged[field], value)
+        kept[slot] = merged
+    return kept
+
+
+def _tag_chunk_source(chunk_data: Dict, index: int, citation_info: Dict) -> None:
+    """
+    Attach the chunk number(s) and heading of a parsed summary to its concepts and
+    formulas; a tree-reduced summary carries the span of chunks it was merged from
+    """
+    first = citation_info.get("chunk_id", index + 1)
+    source = {"chunk": first, "heading": citation_info.get("heading_path", "Unknown")}
+    if citation_info.get("chunk_end", first) != first:
+        source["chunk_end"] = citation_info["chunk_end"]
+    for field in ("concepts", "formulas"):
+        for item in chunk_data.get(field) or ():
+            if isinstance(item, dict):
+                item["_source"] = dict(source)
 
 
 def merge_summaries(
@@ -1173,16 +2119,23 @@ def merge_summaries(
     chunk_citations: List[Dict] = None,
     original_text: str = "",  # For coverage validation
     user_id: Optional[int] = None,
-    db = None
+    db = None,
+    on_delta: Optional[Callable[[str], None]] = None,
+    parsed_summaries: Optional[List[Optional[Dict]]] = None,
+    summary_sources: Optional[List[Dict]] = None
 ) -> str:
     """
     Merge structured chunk JSONs into final exam-ready summary (REDUCE phase)
     Now receives structured mini-JSONs from MAP phase
     ENHANCED: Includes coverage validation to ensure no topics are skipped
+    on_delta receives the raw REDUCE output as it is generated (progress only:
+    the returned JSON is repaired/validated and is the authoritative result)
+    parsed_summaries optionally carries chunk_summaries already parsed (None
+    where parsing failed), so the MAP phase's parse work is not repeated
+    summary_sources gives the citation of each entry of chunk_summaries when they
+    are not one per chunk (tree-reduced groups); defaults to chunk_citations
     Returns final JSON string
     """
-    import json
-    from app.utils.coverage_validator import validate_coverage, generate_coverage_report
     
     # Parse chunk JSONs and aggregate
     all_concepts = []
@@ -1190,15 +2143,26 @@ def merge_summaries(
     all_theorems = []
     all_examples = []
     
+    # Near-identical summaries would only make the reducer re-read the same items
+    duplicate_of = find_duplicate_chunks(chunk_summaries, threshold=SUMMARY_DEDUP_JACCARD)
+    skipped = sum(dup is not None for dup in duplicate_of)
+    if skipped:
+        logger.info("[REDUCE] Dropping %s duplicate chunk summaries", skipped)
+    
+    # Items are tagged only when each summary's citation is known
+    sources = summary_sources if summary_sources is not None else chunk_citations
+    if sources and len(sources) != len(chunk_summaries):
+        logger.warning("[REDUCE WARNING] %s citations for %s summaries, not tagging sources", len(sources), len(chunk_summaries))
+        sources = None
+    
     for i, chunk_json in enumerate(chunk_summaries):
-        try:
-            chunk_data = json.loads(chunk_json)
-            all_concepts.extend(chunk_data.get("concepts", []))
-            all_formulas.extend(chunk_data.get("formulas", []))
-            all_theorems.extend(chunk_data.get("theorems", []))
-            all_examples.extend(chunk_data.get("examples", []))
-        except json.JSONDecodeError as e:
-            print(f"[REDUCE WARNING] Chunk {i+1} JSON parse failed: {e}")
+        if duplicate_of[i] is not None:
+            continue
+        chunk_data = parsed_summaries[i] if parsed_summaries else None
+        if chunk_data is None:
+            chunk_data = _parse_map_summary(chunk_json)
+        if chunk_data is None:
+            logger.warning("[REDUCE WARNING] Chunk %s is not a JSON object", i+1)
             # Fallback: treat as plain text
             all_concepts.append({
                 "term": f"Content from chunk {i+1}",
@@ -1206,28 +2170,29 @@ def merge_summaries(
                 "explanation": chunk_json[:500],
                 "example": ""
             })
-    
-    # Enrich concepts with source citations
-    if chunk_citations:
-        for i, chunk_json in enumerate(chunk_summaries):
-            try:
-                chunk_data = json.loads(chunk_json)
-                citation_info = chunk_citations[i] if i < len(chunk_citations) else {}
-                
-                # Add citation metadata to each concept
-                for concept in chunk_data.get("concepts", []):
-                    concept["_source"] = {
-                        "chunk": i + 1,
-                        "heading": citation_info.get("heading_path", "Unknown")
-                    }
-                
-                for formula in chunk_data.get("formulas", []):
-                    formula["_source"] = {
-                        "chunk": i + 1,
-                        "heading": citation_info.get("heading_path", "Unknown")
-                    }
-            except:
-                pass
+            continue
+        if sources:
+            _tag_chunk_source(chunk_data, i, sources[i])
+        all_concepts.extend(chunk_data.get("concepts", []))
+        all_formulas.extend(chunk_data.get("formulas", []))
+        all_theorems.extend(chunk_data.get("theorems", []))
+        all_examples.extend(chunk_data.get("examples", []))
+    
+    # Neighbouring chunks often restate the same definition or worked example verbatim
+    all_concepts, all_formulas, all_theorems, all_examples = (
+        _drop_repeated_items(items) for items in (all_concepts, all_formulas, all_theorems, all_examples)
+    )
+    # Long documents restate the same concept in many chunks with different wording;
+    # keep one (the most detailed) per name so the reducer isn't re-reading them
+    for field, items in (("concepts", all_concepts), ("formulas", all_formulas), ("theorems", all_theorems)):
+        before = len(items)
+        if field == "formulas":
+            # The same equation is restated with different names; the expression identifies it
+            items[:] = _merge_same_named_items(items, *_ITEM_IDENTITY[field], key_fn=_expression_key, fuzzy=False)
+        else:
+            items[:] = _merge_same_named_items(items, *_ITEM_IDENTITY[field])
+        if len(items) < before:
+            logger.info("[DEDUPE] %s: %s → %s", field, before, len(items))
     
     # Create structured source material for REDUCE
     aggregated_knowledge = {
@@ -1244,7 +2209,7 @@ def merge_summaries(
     
     # Use two-stage REDUCE with fallback to single-stage if errors occur
     try:
-        print("[REDUCE] Attempting two-stage REDUCE (outline → fill → validate)...")
+        logger.info("[REDUCE] Attempting two-stage REDUCE (outline → fill → validate)...")
         result = reduce_two_stage(
             aggregated_knowledge=aggregated_knowledge,
             language=language,
@@ -1252,20 +2217,21 @@ def merge_summaries(
             out_cap=out_budget,
             additional_instructions=additional_instructions or "",
             user_id=user_id,
-            db=db
+            db=db,
+            on_delta=on_delta
         )
-        print("[REDUCE] Two-stage REDUCE completed successfully ✓")
+        logger.info("[REDUCE] Two-stage REDUCE completed successfully ✓")
         
         # COVERAGE VALIDATION: Check if all topics are covered
         if original_text:
-            print("[COVERAGE] Validating topic coverage...")
+            logger.info("[COVERAGE] Validating topic coverage...")
             coverage_result = validate_coverage(original_text, result, min_coverage=0.85)
-            print(generate_coverage_report(coverage_result))
+            logger.info("%s", generate_coverage_report(coverage_result))
             
             # If coverage is insufficient, add missing topics and regenerate
             if not coverage_result['passed'] and coverage_result['missing_topics']:
-                print(f"[COVERAGE] ⚠️  Coverage insufficient ({coverage_result['coverage_score']:.1%})")
-                print(f"[COVERAGE] Adding {len(coverage_result['missing_topics'])} missing topics...")
+                logger.warning("[COVERAGE] ⚠️  Coverage insufficient (%.1f%%)", coverage_result['coverage_score'] * 100)
+                logger.info("[COVERAGE] Adding %s missing topics...", len(coverage_result['missing_topics']))
                 
                 # Create enhanced instructions with missing topics
                 missing_topics_str = ", ".join(coverage_result['missing_topics'][:10])
@@ -1276,7 +2242,7 @@ def merge_summaries(
                 
                 # Regenerate with coverage fix (one retry only)
                 enhanced_instructions = (additional_instructions or "") + coverage_instructions
-                print("[COVERAGE] Regenerating with missing topics...")
+                logger.info("[COVERAGE] Regenerating with missing topics...")
                 result = reduce_two_stage(
                     aggregated_knowledge=aggregated_knowledge,
                     language=language,
@@ -1286,73 +2252,36 @@ def merge_summaries(
                     user_id=user_id,
                     db=db
                 )
-                print("[COVERAGE] ✓ Regeneration complete")
+                logger.info("[COVERAGE] ✓ Regeneration complete")
                 
                 # Re-validate after regeneration
                 coverage_result = validate_coverage(original_text, result, min_coverage=0.85)
-                print(f"[COVERAGE] Post-regen coverage: {coverage_result['coverage_score']:.1%}")
+                logger.info("[COVERAGE] Post-regen coverage: %.1f%%", coverage_result['coverage_score'] * 100)
             else:
-                print(f"[COVERAGE] ✅ Coverage validated ({coverage_result['coverage_score']:.1%})")
+                logger.info("[COVERAGE] ✅ Coverage validated (%.1f%%)", coverage_result['coverage_score'] * 100)
             
         # Add coverage info to result for frontend display (ALWAYS, even if 100% coverage)
         # CRITICAL: result is a JSON string, need to parse it first!
         try:
-            result_dict = json.loads(result) if isinstance(result, str) else result
+            result_dict = json_codec.loads(result) if isinstance(result, str) else result
             result_dict['coverage'] = {
                 'score': round(coverage_result['coverage_score'], 2),
                 'missing_topics': coverage_result['missing_topics'][:20]  # Limit to 20 for display
             }
             
             # FIX DIAGRAM FORMATTING: Fix Mermaid syntax errors
-            import re
             if 'diagrams' in result_dict.get('summary', {}):
                 for diagram in result_dict['summary']['diagrams']:
                     if 'content' in diagram:
                         content = diagram['content']
                         # Check if it's Mermaid syntax (starts with graph/flowchart)
-                        if content.strip().startswith(('graph ', 'flowchart ', 'sequenceDiagram', 'classDiagram')):
-                            fixed = content
-                            
-                            # Fix 1: Add brackets to bare node names (Producer → Producer[Producer])
-                            # Match: word followed by --> (but not already in brackets)
-                            # This regex finds node IDs that aren't already bracketed
-                            lines = fixed.split('\n')
-                            fixed_lines = []
-                            for line in lines:
-                                # Skip the graph/flowchart declaration line
-                                if line.strip().startswith(('graph ', 'flowchart ', 'sequenceDiagram', 'classDiagram')):
-                                    fixed_lines.append(line)
-                                    continue
-                                
-                                # Fix bare node names: Producer -->|label| Buffer becomes Producer[Producer] -->|label| Buffer[Buffer]
-                                # Pattern: word at start or after whitespace/newline that's not in brackets
-                                fixed_line = line
-                                
-                                # Find all node names (words that appear before --> or at the end after |)
-                                # Replace: NodeName -->  with  NodeName[NodeName] -->
-                                fixed_line = re.sub(r'\b([A-Z][a-zA-Z0-9_]*)\s+(-->)', r'\1[\1] \2', fixed_line)
-                                
-                                # Replace: | NodeName  with  | NodeName[NodeName]
-                                fixed_line = re.sub(r'\|\s+([A-Z][a-zA-Z0-9_]*)(?:\s|$)', r'| \1[\1] ', fixed_line)
-                                
-                                # Fix 2: Quote edge labels that contain parentheses
-                                # -->|label(x)| becomes -->|"label(x)"|
-                                fixed_line = re.sub(r'-->\|([^|"]+\([^)]*\)[^|"]*)\|', r'-->|"\1"|', fixed_line)
-                                
-                                fixed_lines.append(fixed_line)
-                            
-                            fixed = '\n'.join(fixed_lines)
-                            
-                            # Fix 3: Add newlines between edges if they're on the same line
-                            # Pattern 1: "]" followed by space(s) and capital letter with "[" = new node
-                            fixed = re.sub(r'(\])\s+([A-Z]\[)', r'\1\n  \2', fixed)
-                            # Pattern 2: After arrow with label, if next char is capital = new edge
-                            fixed = re.sub(r'(\|)\s+([A-Z]\[)', r'\1\n  \2', fixed)
+                        if content.strip().startswith(_MERMAID_HEADERS):
+                            fixed = fix_mermaid_syntax(content)
                             
                             if fixed != content:
-                                print(f"[DIAGRAM FIX] Fixed Mermaid syntax in diagram: {diagram.get('title', 'Untitled')}")
-                                print(f"  BEFORE: {content[:150]}...")
-                                print(f"  AFTER: {fixed[:150]}...")
+                                logger.info("[DIAGRAM FIX] Fixed Mermaid syntax in diagram: %s", diagram.get('title', 'Untitled'))
+                                logger.info("  BEFORE: %s...", content[:150])
+                                logger.info("  AFTER: %s...", fixed[:150])
                                 diagram['content'] = fixed
             
             # Also fix practice problem solutions
@@ -1362,67 +2291,47 @@ def merge_summaries(
                         solution = problem['solution']
                         
                         # Check if it's Mermaid syntax (with or without prefix)
-                        is_mermaid = solution.strip().startswith(('graph ', 'flowchart ', 'sequenceDiagram', 'classDiagram'))
+                        is_mermaid = solution.strip().startswith(_MERMAID_HEADERS)
                         
                         # Also detect Mermaid if it has pattern: Node[Label] -->|...| Node[Label]
                         if not is_mermaid and '-->' in solution and '[' in solution and ']' in solution:
                             # This looks like Mermaid without prefix - add graph TD
-                            print(f"[PRACTICE FIX {idx+1}] Detected Mermaid without prefix, adding 'graph TD'")
+                            logger.info("[PRACTICE FIX %s] Detected Mermaid without prefix, adding 'graph TD'", idx+1)
                             solution = f"graph TD\n  {solution.strip()}"
                             is_mermaid = True
                         
                         if is_mermaid:
                             # Apply same fixes as diagrams
-                            fixed = solution
-                            
-                            # Fix 1: Add brackets to bare node names
-                            lines = fixed.split('\n')
-                            fixed_lines = []
-                            for line in lines:
-                                if line.strip().startswith(('graph ', 'flowchart ', 'sequenceDiagram', 'classDiagram')):
-                                    fixed_lines.append(line)
-                                    continue
-                                
-                                fixed_line = line
-                                # Replace: NodeName -->  with  NodeName[NodeName] -->
-                                fixed_line = re.sub(r'\b([A-Z][a-zA-Z0-9_]*)\s+(-->)', r'\1[\1] \2', fixed_line)
-                                # Replace: | NodeName  with  | NodeName[NodeName]
-                                fixed_line = re.sub(r'\|\s+([A-Z][a-zA-Z0-9_]*)(?:\s|$)', r'| \1[\1] ', fixed_line)
-                                # Fix 2: Quote edge labels with parentheses
-                                fixed_line = re.sub(r'-->\|([^|"]+\([^)]*\)[^|"]*)\|', r'-->|"\1"|', fixed_line)
-                                fixed_lines.append(fixed_line)
-                            
-                            fixed = '\n'.join(fixed_lines)
-                            
-                            # Fix 3: Add newlines between edges
-                            fixed = re.sub(r'(\])\s+([A-Z]\[)', r'\1\n  \2', fixed)
-                            fixed = re.sub(r'(\|)\s+([A-Z]\[)', r'\1\n  \2', fixed)
+                            fixed = fix_mermaid_syntax(solution)
                             
                             if fixed != solution:
-                                print(f"[PRACTICE FIX {idx+1}] Fixed Mermaid syntax")
-                                print(f"  BEFORE: {solution[:100]}...")
-                                print(f"  AFTER: {fixed[:100]}...")
+                                logger.info("[PRACTICE FIX %s] Fixed Mermaid syntax", idx+1)
+                                logger.info("  BEFORE: %s...", solution[:100])
+                                logger.info("  AFTER: %s...", fixed[:100])
                                 problem['solution'] = fixed
                             else:
                                 problem['solution'] = solution  # Still update with prefix if added
             
-            result = json.dumps(result_dict, ensure_ascii=False, indent=2)
-            print(f"[COVERAGE] ✅ Coverage added to JSON: {coverage_result['coverage_score']:.1%} score, {len(coverage_result['missing_topics'])} missing topics")
+            # Compact: callers parse this string again, indentation would only add bytes
+            result = json_codec.dumps_text(result_dict)
+            logger.info("[COVERAGE] ✅ Coverage added to JSON: %.1f%% score, %s missing topics", coverage_result['coverage_score'] * 100, len(coverage_result['missing_topics']))
         except Exception as e:
-            print(f"[COVERAGE] ⚠️  Failed to add coverage info: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.warning("[COVERAGE] ⚠️  Failed to add coverage info: %s", e, exc_info=True)
         
         # Return as JSON string (for compatibility with existing pipeline)
-        return json.dumps(result, ensure_ascii=False, indent=2) if not isinstance(result, str) else result
+        return json_codec.dumps_text(result) if not isinstance(result, str) else result
     
     except Exception as e:
-        print(f"[REDUCE TWO-STAGE FALLBACK] Error in two-stage REDUCE: {e}")
-        print("[REDUCE TWO-STAGE FALLBACK] Falling back to single-stage REDUCE...")
+        logger.error("[REDUCE TWO-STAGE FALLBACK] Error in two-stage REDUCE: %s", e)
+        logger.warning("[REDUCE TWO-STAGE FALLBACK] Falling back to single-stage REDUCE...")
         
         # Fallback: single-stage REDUCE (original implementation)
-        user_prompt = get_final_merge_prompt(language, additional_instructions, domain)
-        user_prompt += f"\n\nSTRUCTURED SOURCE KNOWLEDGE (from {len(chunk_summaries)} chunks):\n{json.dumps(aggregated_knowledge, indent=2, ensure_ascii=False)}"
+        # Single join: avoids copying the (large) serialized knowledge twice via +=
+        user_prompt = "".join((
+            get_final_merge_prompt(language, additional_instructions, domain),
+            f"\n\nSTRUCTURED SOURCE KNOWLEDGE (from {len(chunk_summaries)} chunks):\n",
+            _knowledge_json(aggregated_knowledge, float("inf"))
+        ))
         
         return call_openai(
             system_prompt=SYSTEM_PROMPT,
@@ -1430,10 +2339,176 @@ def merge_summaries(
             max_output_tokens=out_budget,
             user_id=user_id,
             endpoint="/summarize",
-            db=db
+            db=db,
+            response_format=JSON_MODE,
+            stream=True,
+            on_delta=on_delta
         )
 
 
+_MAP_ITEM_FIELDS = ("concepts", "formulas", "theorems", "examples")
+
+
+def _parse_map_summary(chunk_json: str) -> Optional[Dict[str, list]]:
+    """
+    Parse one MAP reply for the REDUCE; None if it is not a JSON object
+    Only the item lists are kept (fields that aren't lists are dropped), so the
+    REDUCE never iterates a stray string or carries unused top-level fields
+    """
+    try:
+        data = json_codec.loads(chunk_json)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return {field: data[field] for field in _MAP_ITEM_FIELDS if isinstance(data.get(field), list)}
+
+# Stands in for a chunk whose MAP call failed
+_EMPTY_MAP_SUMMARY = json_codec.dumps({field: [] for field in _MAP_ITEM_FIELDS}).decode("utf-8")
+
+
+def _combine_summary_jsons(summaries: List[str]) -> str:
+    """Concatenate the item lists of several MAP JSONs (no model call); unparsable ones are skipped"""
+    combined = {field: [] for field in _MAP_ITEM_FIELDS}
+    for chunk_json in summaries:
+        try:
+            data = json_codec.loads(chunk_json)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            for field in _MAP_ITEM_FIELDS:
+                combined[field].extend(data.get(field) or [])
+    return json_codec.dumps(combined).decode("utf-8")
+
+
+def _intermediate_reduce_prompt(language: str, count: int) -> str:
+    lang_instr = "Write in TURKISH." if language == "tr" else "Write in ENGLISH."
+    return (
+        f"Below are {count} JSON extractions from consecutive parts of one document. {lang_instr}\n"
+        f"Merge them into ONE JSON object with the same fields ({', '.join(_MAP_ITEM_FIELDS)}). "
+        "Combine items that describe the same thing, keeping the most specific wording, numbers and examples. "
+        "Keep every distinct item; do not summarize away details. Output valid JSON only."
+    )
+
+
+def merge_summary_group(
+    summaries: List[str],
+    language: str = "en",
+    user_id: Optional[int] = None,
+    db = None
+) -> str:
+    """
+    Intermediate REDUCE: merge a few MAP summaries into one of the same shape
+    Falls back to plain concatenation of the items if the call fails or returns invalid JSON
+    """
+    if len(summaries) == 1:
+        return summaries[0]
+    
+    parts = [_intermediate_reduce_prompt(language, len(summaries))]
+    for n, chunk_json in enumerate(summaries, 1):
+        parts.append(f"\n\n=== EXTRACTION {n} ===\n{chunk_json}")
+    
+    try:
+        content = call_openai(
+            system_prompt=SYSTEM_PROMPT,
+            user_prompt="".join(parts),
+            max_output_tokens=INTERMEDIATE_REDUCE_OUTPUT,
+            user_id=user_id,
+            endpoint="/summarize",
+            db=db,
+            response_format=JSON_MODE,
+            cache=True
+        )
+        if isinstance(json_codec.loads(content), dict):
+            return content
+        logger.warning("[TREE REDUCE] Merged group is not a JSON object, concatenating instead")
+    except Exception as e:
+        logger.warning("[TREE REDUCE] Group merge failed (%s), concatenating instead", e)
+    return _combine_summary_jsons(summaries)
+
+
+def _fanout_groups(items: List, fanout: int) -> List[List]:
+    """Consecutive groups of `fanout` items (the last one may be shorter)"""
+    return [items[i:i + fanout] for i in range(0, len(items), fanout)]
+
+
+def tree_reduce_spans(count: int, fanout: int = MERGE_FANOUT) -> List[Tuple[int, int]]:
+    """
+    (first, last) input positions behind each summary tree_reduce returns for
+    `count` inputs; groups are consecutive, so every merged summary covers a span
+    """
+    spans = [(i, i) for i in range(count)]
+    while len(spans) > fanout:
+        spans = [(group[0][0], group[-1][1]) for group in _fanout_groups(spans, fanout)]
+    return spans
+
+
+def _span_citation(citations: List[Dict]) -> Dict:
+    """Citation for a summary merged from consecutive chunks: their span and shared heading path"""
+    shared = []
+    for parts in zip(*(c.get("heading_path", "").split(" > ") for c in citations)):
+        if len(set(parts)) > 1:
+            break
+        shared.append(parts[0])
+    return {
+        "chunk_id": citations[0]["chunk_id"],
+        "chunk_end": citations[-1]["chunk_id"],
+        "heading_path": " > ".join(shared)
+    }
+
+
+def tree_reduce(
+    summaries: List[str],
+    language: str = "en",
+    user_id: Optional[int] = None,
+    db = None,
+    fanout: int = MERGE_FANOUT
+) -> List[str]:
+    """
+    Hierarchically merge MAP summaries in parallel groups of `fanout`
+    until at most `fanout` remain (input for the final REDUCE)
+    """
+    executor = get_map_executor()
+    level = 0
+    while len(summaries) > fanout:
+        level += 1
+        summaries = list(executor.map(
+            lambda group: merge_summary_group(group, language=language, user_id=user_id, db=db),
+            _fanout_groups(summaries, fanout)
+        ))
+        logger.info("[TREE REDUCE] Level %s: merged into %s summaries", level, len(summaries))
+    return summaries
+
+
+def should_map_reduce(num_chunks: int, estimated_tokens: int, model_context: int = MODEL_CONTEXT_TOKENS) -> bool:
+    """
+    Whether a chunked document is worth the MAP phase
+    One chunk never is; two chunks only when the whole text doesn't comfortably fit the context
+    """
+    if num_chunks <= 1:
+        return False
+    if num_chunks == 2:
+        return estimated_tokens >= model_context * SINGLE_PASS_CONTEXT_FRACTION
+    return True
+
+
+# MAP phase strategies selectable per map_reduce_summary call
+MAP_MODES = ("interactive", "bulk")
+
+
+def _detect_document_domain(full_text: str) -> str:
+    """Content domain for the final prompt ("general" for inputs too short to classify)"""
+    domain = detect_domain(full_text) if len(full_text) >= DOMAIN_DETECT_MIN_CHARS else "general"
+    logger.info("[DOMAIN DETECTION] Detected: %s", domain)
+    return domain
+
+
+def _with_domain_hint(instructions: str, domain: str) -> str:
+    """Append the domain hint to the user's instructions"""
+    domain_hint = f"Content domain: {domain}. Adjust depth and style accordingly."
+    return f"{instructions}\n\n{domain_hint}" if instructions else domain_hint
+
+
 def map_reduce_summary(
     full_text: str,
     language: str = "en",
@@ -1441,7 +2516,10 @@ def map_reduce_summary(
     out_cap: int = 12000,
     force_chunking: bool = False,
     user_id: Optional[int] = None,
-    db = None
+    db = None,
+    mode: str = "interactive",
+    on_delta: Optional[Callable[[str], None]] = None,
+    warnings: Optional[List[str]] = None
 ) -> str:
     """
     Main map-reduce pipeline for large document summarization
@@ -1455,52 +2533,66 @@ def map_reduce_summary(
         force_chunking: Force map-reduce even for small docs (for testing)
         user_id: User ID for token tracking
         db: Database session for token tracking
+        mode: "interactive" runs the MAP phase as parallel chat calls; "bulk" submits
+            it as one OpenAI Batch API job (half price, but up to the batch completion
+            window - only for background/offline jobs)
+        on_delta: Called with each chunk of final-summary text as the model
+            generates it (e.g. to stream progress to the client)
+        warnings: Receives a message for each problem that left the summary
+            incomplete (failed MAP calls); callers must not cache such a result
     
     Returns:
         JSON string with complete summary
     """
-    # 1. DETECT DOMAIN
-    domain = detect_domain(full_text)
-    print(f"[DOMAIN DETECTION] Detected: {domain}")
-    
-    # Estimate input tokens
-    estimated_tokens = approx_tokens_from_text_len(len(full_text))
+    if mode not in MAP_MODES:
+        raise ValueError(f"Unknown MAP mode '{mode}' (expected one of {', '.join(MAP_MODES)})")
     
-    # Auto "Density Boost" with flexible thresholds
-    from app.config import DENSITY_BOOST_THRESHOLD
+    # Count input tokens (exact when tiktoken is available); the encoding is
+    # kept so the fallback splitter can slice it instead of re-tokenizing
+    full_tokens = try_encode(full_text)
+    estimated_tokens = len(full_tokens) if full_tokens is not None else count_tokens(full_text)
     
-    # Flexible thresholds:
+    # Auto "Density Boost" with flexible thresholds:
     # 10k-15k: Soft-Merge (default, no special instructions)
     # >15k: Density-Boost + Additional Topics
     # >40k: Aggressive compression + de-duplication
     
-    if estimated_tokens > 40000:
+    if estimated_tokens > AGGRESSIVE_DENSITY_THRESHOLD:
         additional_instructions = (additional_instructions or "") + \
             "\n[AGGRESSIVE DENSITY BOOST]: Very large document. Use extreme compression: " +\
             "(1) Merge similar concepts, (2) 1 concept per minor section, (3) De-duplicate overlapping content, " +\
             "(4) Move all minor themes to 'Additional Topics (Condensed)', (5) Target 18-28 tokens/sentence for density."
-        print(f"[AGGRESSIVE DENSITY BOOST] Enabled (estimated_tokens={estimated_tokens} > 40000)")
+        logger.info("[AGGRESSIVE DENSITY BOOST] Enabled (estimated_tokens=%s > %s)", estimated_tokens, AGGRESSIVE_DENSITY_THRESHOLD)
     elif estimated_tokens > DENSITY_BOOST_THRESHOLD:  # Default 15000
         additional_instructions = (additional_instructions or "") + \
             "\n[DENSITY BOOST]: Large document. Use compression: merge minor topics into compact sections (1 concept each), " +\
             "move overflow to 'Additional Topics (Condensed)', keep all themes visible, prefer dense phrasing (18-28 tokens/sentence)."
-        print(f"[DENSITY BOOST] Enabled (estimated_tokens={estimated_tokens} > {DENSITY_BOOST_THRESHOLD})")
+        logger.info("[DENSITY BOOST] Enabled (estimated_tokens=%s > %s)", estimated_tokens, DENSITY_BOOST_THRESHOLD)
     else:
-        print(f"[SOFT MERGE] Standard mode (estimated_tokens={estimated_tokens} <= {DENSITY_BOOST_THRESHOLD})")
+        logger.info("[SOFT MERGE] Standard mode (estimated_tokens=%s <= %s)", estimated_tokens, DENSITY_BOOST_THRESHOLD)
     
-    # Append domain hint to instructions
-    domain_hint = f"Content domain: {domain}. Adjust depth and style accordingly."
-    enhanced_instructions = f"{additional_instructions}\n\n{domain_hint}" if additional_instructions else domain_hint
+    additional_instructions = normalize_instructions(additional_instructions)
     
     # Decide whether to use map-reduce
     # Use chunking if: forced, OR estimated tokens > threshold
-    # Threshold increased to 10000 to allow longer single-pass summaries
-    use_chunking = force_chunking or estimated_tokens > 10000
+    use_chunking = force_chunking or estimated_tokens > SINGLE_PASS_TOKEN_LIMIT
     
-    if not use_chunking:
-        # Small document: single-pass summary
-        user_prompt = get_final_merge_prompt(language, enhanced_instructions, domain)
-        user_prompt += f"\n\nCOURSE MATERIAL:\n{full_text}"
+    # 1. DETECT DOMAIN
+    # Only the final (REDUCE or single-pass) prompt uses the domain, so a chunked
+    # document detects it on the MAP pool while structure parsing and MAP run
+    domain_future = get_map_executor().submit(_detect_document_domain, full_text) if use_chunking else None
+    
+    def _domain() -> str:
+        return domain_future.result() if domain_future is not None else _detect_document_domain(full_text)
+    
+    def _single_pass() -> str:
+        domain = _domain()
+        enhanced_instructions = _with_domain_hint(additional_instructions, domain)
+        user_prompt = "".join((
+            get_final_merge_prompt(language, enhanced_instructions, domain),
+            "\n\nCOURSE MATERIAL:\n",
+            full_text
+        ))
         
         return call_openai(
             system_prompt=SYSTEM_PROMPT,
@@ -1508,19 +2600,24 @@ def map_reduce_summary(
             max_output_tokens=min(out_cap, MERGE_OUTPUT_BUDGET[1]),
             user_id=user_id,
             endpoint="/summarize",
-            db=db
+            db=db,
+            response_format=JSON_MODE,
+            stream=True,
+            on_delta=on_delta
         )
     
+    if not use_chunking:
+        # Small document: single-pass summary
+        return _single_pass()
+    
     # Large document: map-reduce with structure-aware chunking
-    print(f"[MAP-REDUCE] Estimated {estimated_tokens} tokens, using structure-aware chunking")
+    logger.info("[MAP-REDUCE] Estimated %s tokens, using structure-aware chunking", estimated_tokens)
     
     # 2. EXTRACT STRUCTURE
-    from app.utils.structure_parser import extract_heading_hierarchy, chunk_by_headings, blocks_to_text
-    
     try:
         blocks = extract_heading_hierarchy(full_text)
-        structured_chunks = chunk_by_headings(blocks, target_tokens=CHUNK_INPUT_TARGET)
-        print(f"[STRUCTURE] Extracted {len(blocks)} blocks, {len(structured_chunks)} structured chunks")
+        structured_chunks = chunk_by_headings(blocks, target_tokens=CHUNK_INPUT_TARGET, token_counter=count_tokens)
+        logger.info("[STRUCTURE] Extracted %s blocks, %s structured chunks", len(blocks), len(structured_chunks))
         
         # Convert structured chunks back to text with heading context
         chunks_with_context = []
@@ -1535,57 +2632,206 @@ def map_reduce_summary(
             })
         
         chunks = chunks_with_context
-        print(f"[STRUCTURE] Heading-aware chunks: {[m['heading_path'] for m in chunk_metadata]}")
+        # The parsed block lists duplicate the text; drop them before the MAP phase
+        blocks = structured_chunks = None
+        logger.info("[STRUCTURE] Heading-aware chunks: %s", [m['heading_path'] for m in chunk_metadata])
         
     except Exception as e:
         # Fallback to simple chunking if structure extraction fails
-        print(f"[STRUCTURE WARNING] Failed to extract structure: {e}, using simple chunking")
-        chunks = split_text_approx_tokens(full_text, CHUNK_INPUT_TARGET)
-        chunk_metadata = [{"heading_path": f"Chunk {i+1}", "block_count": 0} for i in range(len(chunks))]
-    
-    print(f"[MAP-REDUCE] Processing {len(chunks)} chunks")
-    
-    # 3. MAP: Summarize each chunk (with adaptive budgeting and citation tracking)
-    chunk_summaries = []
-    chunk_citations = []
-    
-    for i, chunk in enumerate(chunks):
-        heading_path = chunk_metadata[i].get("heading_path", f"Chunk {i+1}")
-        print(f"[MAP-REDUCE] Processing chunk {i+1}/{len(chunks)}: {heading_path}")
-        
-        summary = summarize_chunk(
-            chunk,
+        logger.warning("[STRUCTURE WARNING] Failed to extract structure: %s, using simple chunking", e)
+        chunks = []
+        chunk_metadata = []
+        for i, chunk in enumerate(iter_text_chunks(full_text, CHUNK_INPUT_TARGET, tokens=full_tokens)):
+            chunks.append(chunk)
+            chunk_metadata.append({"heading_path": f"Chunk {i+1}", "block_count": 0})
+    
+    full_tokens = None
+    
+    # MAP + REDUCE costs two round trips and compresses content the reducer could
+    # have read directly; for one or two chunks that fit the context, skip it
+    if not force_chunking and not should_map_reduce(len(chunks), estimated_tokens):
+        logger.info("[MAP-REDUCE] Only %s chunks, using single-pass summary instead", len(chunks))
+        return _single_pass()
+    
+    logger.info("[MAP-REDUCE] Processing %s chunks", len(chunks))
+    
+    # 3. MAP: Summarize chunks concurrently (with adaptive budgeting and citation tracking)
+    # Each call is an independent, network-bound OpenAI request, so run them on the
+    # shared bounded thread pool.
+    def _map_group(group: List[int]) -> List[str]:
+        if logger.isEnabledFor(logging.DEBUG):
+            heading_paths = [chunk_metadata[i].get("heading_path", f"Chunk {i+1}") for i in group]
+            logger.debug("[MAP-REDUCE] Processing chunk %s/%s: %s", group[0]+1, len(chunks), " | ".join(heading_paths))
+        if len(group) == 1:
+            return [summarize_chunk(
+                chunks[group[0]],
+                language=language,
+                additional_instructions=additional_instructions,
+                # Adaptive budget from the token count taken while grouping
+                out_budget=calculate_chunk_budget(chunks[group[0]], chunk_tokens[group[0]]),
+                user_id=user_id,
+                db=db
+            )]
+        return summarize_chunk_group(
+            [chunks[i] for i in group],
             language=language,
             additional_instructions=additional_instructions,
-            out_budget=None,  # Let adaptive budget calculate
             user_id=user_id,
-            db=db
+            db=db,
+            chunk_tokens=[chunk_tokens[i] for i in group]
+        )
+    
+    # Repeated material (duplicate slides, boilerplate pages) is summarized once
+    dedupe = DuplicateChunkIndex(threshold=CHUNK_DEDUP_JACCARD)
+    duplicate_of = []
+    
+    def _unique_indices() -> Iterator[int]:
+        for i, chunk in enumerate(chunks):
+            dup = dedupe.add(chunk)
+            duplicate_of.append(dup)
+            if dup is None:
+                yield i
+    
+    # Each chunk is tokenized once: the count sizes both its group and its output budget
+    chunk_tokens = {}
+    
+    def _counted(indices: Iterable[int]) -> Iterator[Tuple[int, int]]:
+        for i in indices:
+            chunk_tokens[i] = count_tokens(chunks[i])
+            yield i, chunk_tokens[i]
+    
+    if mode == "bulk":
+        unique_indices = list(_unique_indices())
+        logger.info("[MAP-REDUCE] Running MAP through the OpenAI Batch API")
+        batch_summaries = summarize_chunks_batch(
+            [chunks[i] for i in unique_indices],
+            language=language,
+            additional_instructions=additional_instructions,
+            user_id=user_id
         )
-        chunk_summaries.append(summary)
+        unique_summaries = [None] * len(chunks)
+        unique_parsed = [None] * len(chunks)
+        for i, chunk_summary in zip(unique_indices, batch_summaries):
+            unique_summaries[i] = chunk_summary
+            unique_parsed[i] = _parse_map_summary(chunk_summary)
+    else:
+        # Short chunks share a call so the system prompt and round trip are paid once.
+        # Groups are submitted as soon as they fill, so the first MAP calls are in
+        # flight while later chunks are still being deduplicated and counted.
+        executor = get_map_executor()
+        # Many short-lived prompt/response strings: collect cycles once afterwards
+        with _gc_paused():
+            pending = {
+                executor.submit(_map_group, group): group
+                for group in _iter_chunk_groups(_counted(_unique_indices()))
+            }
+            unique_indices = sorted(i for group in pending.values() for i in group)
+            if len(pending) < len(unique_indices):
+                logger.info("[MAP-REDUCE] Marshaled %s chunks into %s calls", len(unique_indices), len(pending))
+            logger.info("[MAP-REDUCE] Running MAP with up to %s parallel workers", min(MAP_CONCURRENCY, len(pending)))
+            # Results land in pre-sized lists by chunk index, so completion order never
+            # leaks into the output. Each reply is parsed for the REDUCE as soon as it
+            # arrives, overlapping that work with the calls still in flight.
+            unique_summaries = [None] * len(chunks)
+            unique_parsed = [None] * len(chunks)
+            # A failed call should cost its chunks, not the whole document: the
+            # REDUCE still runs on every chunk that did come back, unless too many failed
+            total_groups, failed_chunks = len(pending), []
+            failed_groups = 0
+            for future in as_completed(list(pending)):
+                _gc_collect_if_overdue()
+                group = pending.pop(future)
+                try:
+                    group_summaries = future.result()
+                except Exception as e:
+                    failed_groups += 1
+                    if failed_groups > total_groups * MAP_MAX_FAILED_FRACTION:
+                        raise
+                    failed_chunks.extend(i + 1 for i in group)
+                    logger.warning("[MAP-REDUCE] MAP failed for chunks %s: %s", [i + 1 for i in group], e)
+                    group_summaries = [_EMPTY_MAP_SUMMARY] * len(group)
+                for i, chunk_summary in zip(group, group_summaries):
+                    unique_summaries[i] = chunk_summary
+                    unique_parsed[i] = _parse_map_summary(chunk_summary)
+        if failed_chunks and warnings is not None:
+            warnings.append(f"Partial summary: chunks {sorted(failed_chunks)} could not be summarized")
+    if len(unique_indices) < len(chunks):
+        logger.info("[MAP-REDUCE] Reused summaries for %s duplicate chunks", len(chunks) - len(unique_indices))
+    chunk_summaries = [
+        unique_summaries[i if dup is None else dup] for i, dup in enumerate(duplicate_of)
+    ]
+    parsed_summaries = [
+        unique_parsed[i if dup is None else dup] for i, dup in enumerate(duplicate_of)
+    ]
+    
+    # Only the lengths are needed from here on; release the chunk texts
+    chunk_lengths = [len(chunk) for chunk in chunks]
+    chunks = unique_summaries = unique_parsed = None
+    
+    # Chunk i spans [offsets[i], offsets[i+1]) of the concatenated chunk texts
+    offsets = [0, *accumulate(chunk_lengths)]
+    chunk_citations = []
+    for i in range(len(chunk_lengths)):
+        heading_path = chunk_metadata[i].get("heading_path", f"Chunk {i+1}")
         
         # Track citation metadata for this chunk
         chunk_citations.append({
             "chunk_id": i + 1,
             "heading_path": heading_path,
-            "char_start": sum(len(chunks[j]) for j in range(i)),
-            "char_end": sum(len(chunks[j]) for j in range(i+1))
+            "char_start": offsets[i],
+            "char_end": offsets[i + 1]
         })
     
     # 4. REDUCE: Merge into final JSON with citation tracking and coverage validation
-    print(f"[MAP-REDUCE] Merging {len(chunk_summaries)} summaries with domain: {domain}...")
+    domain = _domain()
+    enhanced_instructions = _with_domain_hint(additional_instructions, domain)
+    merge_budget = calculate_merge_budget(len(unique_indices), out_cap)
+    
+    # If every summary could not fit one REDUCE prompt, the summaries are
+    # tree-reduced in groups that do
+    reduce_capacity = max_reduce_inputs(
+        count_tokens(SYSTEM_PROMPT) + count_tokens(get_final_merge_prompt(language, enhanced_instructions, domain))
+    )
+    if len(unique_indices) > reduce_capacity:
+        logger.info("[MAP-REDUCE] %s summaries exceed REDUCE capacity (%s), will tree-reduce", len(unique_indices), reduce_capacity)
+    
+    # Many chunks: merge groups in parallel first so the final prompt stays bounded
+    # (source_structure still lists the original chunks; each merged group is
+    # cited by the span of chunks it came from)
+    summary_sources = None
+    if len(unique_indices) > min(MERGE_FANOUT * 2, reduce_capacity):
+        fanout = min(MERGE_FANOUT, reduce_capacity)
+        chunk_summaries = tree_reduce(
+            [chunk_summaries[i] for i in unique_indices],
+            language=language,
+            user_id=user_id,
+            db=db,
+            fanout=fanout
+        )
+        parsed_summaries = None  # Parsed MAP replies no longer match the merged groups
+        unique_citations = [chunk_citations[i] for i in unique_indices]
+        summary_sources = [
+            _span_citation(unique_citations[first:last + 1])
+            for first, last in tree_reduce_spans(len(unique_citations), fanout)
+        ]
+    
+    logger.info("[MAP-REDUCE] Merging %s summaries with domain: %s (budget %s)...", len(chunk_summaries), domain, merge_budget)
     final_summary = merge_summaries(
         chunk_summaries,
         language=language,
         additional_instructions=enhanced_instructions,
-        out_budget=min(out_cap, MERGE_OUTPUT_BUDGET[1]),
+        out_budget=merge_budget,
         domain=domain,
         chunk_citations=chunk_citations,
         original_text=full_text,  # Pass original text for coverage validation
         user_id=user_id,
-        db=db
+        db=db,
+        on_delta=on_delta,
+        parsed_summaries=parsed_summaries,
+        summary_sources=summary_sources
     )
     
-    print("[MAP-REDUCE] Complete!")
+    logger.info("[MAP-REDUCE] Complete!")
     return final_summary
 
 
@@ -1596,11 +2842,13 @@ def summarize_no_files(
     language: str = "en",
     out_cap: int = 12000,
     user_id: Optional[int] = None,
-    db = None
+    db = None,
+    on_delta: Optional[Callable[[str], None]] = None
 ) -> str:
     """
     Generate summary without uploaded files (from prompt only)
     Uses general knowledge + same JSON format as file-based summaries
+    The 8k+ token reply is streamed; on_delta receives it as it is generated
     """
     lang_instr = "Use TURKISH for ALL output." if language == "tr" else "Use ENGLISH for ALL output."
     
@@ -1715,6 +2963,9 @@ Generate comprehensive study notes about: {topic}"""
         max_output_tokens=min(out_cap, MERGE_OUTPUT_BUDGET[1]),
         user_id=user_id,
         endpoint="/summarize",
-        db=db
+        db=db,
+        response_format=JSON_MODE,
+        stream=True,
+        on_delta=on_delta
     )
 
@@ -4,7 +4,71 @@ Telemetry service for tracking quality metrics
 from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 from app.models.telemetry import SummaryQuality
+from app.config import TELEMETRY_BATCH_SIZE, TELEMETRY_FLUSH_SECONDS
 from datetime import datetime
+import atexit
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Quality rows are queued and bulk-inserted by a background writer, so recording
+# telemetry costs no DB round-trip on the request path.
+_telemetry_queue: "queue.Queue[Dict]" = queue.Queue()
+_batch_ready = threading.Event()
+_flush_lock = threading.Lock()
+_telemetry_bind = None  # Engine captured from the first caller's session
+_writer_started = False
+
+
+def flush_telemetry() -> int:
+    """
+    Write all queued quality records in one bulk insert
+    Returns number of rows written
+    """
+    with _flush_lock:
+        rows = []
+        while True:
+            try:
+                rows.append(_telemetry_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not rows or _telemetry_bind is None:
+            return 0
+        
+        try:
+            with Session(bind=_telemetry_bind) as session:
+                session.bulk_insert_mappings(SummaryQuality, rows)
+                session.commit()
+            logger.info("[TELEMETRY] Flushed %s quality records", len(rows))
+            return len(rows)
+        except Exception as e:
+            logger.error("[TELEMETRY ERROR] Failed to flush %s quality records: %s", len(rows), e)
+            return 0
+
+
+def _telemetry_writer() -> None:
+    """Flush every TELEMETRY_FLUSH_SECONDS, or sooner once a full batch is queued"""
+    while True:
+        _batch_ready.wait(TELEMETRY_FLUSH_SECONDS)
+        _batch_ready.clear()
+        flush_telemetry()
+
+
+def _ensure_writer(db: Session) -> None:
+    global _telemetry_bind, _writer_started
+    if _writer_started:
+        return
+    with _flush_lock:
+        if not _writer_started:
+            _telemetry_bind = db.get_bind()
+            threading.Thread(target=_telemetry_writer, name="telemetry-writer", daemon=True).start()
+            _writer_started = True
+
+
+atexit.register(flush_telemetry)
 
 
 def record_summary_quality(
@@ -36,43 +100,43 @@ def record_summary_quality(
 ):
     """Record quality metrics for a generated summary with comprehensive evrensel metrics"""
     try:
-        quality_record = SummaryQuality(
-            user_id=user_id,
-            request_hash=request_hash,
-            plan=plan,
-            domain=domain,
-            language=language,
-            input_tokens=input_tokens,
-            num_chunks=num_chunks,
-            quality_score=quality_score,
-            num_concepts=num_concepts,
-            num_formulas=num_formulas,
-            num_exam_questions=num_exam_questions,
-            num_glossary_terms=num_glossary_terms,
-            self_repair_triggered=1 if self_repair_triggered else 0,
-            self_repair_improvement=self_repair_improvement,
-            total_tokens_used=total_tokens_used,
-            generation_time_seconds=generation_time_seconds,
-            warnings=warnings,
+        _ensure_writer(db)
+        _telemetry_queue.put({
+            "user_id": user_id,
+            "request_hash": request_hash,
+            "plan": plan,
+            "domain": domain,
+            "language": language,
+            "input_tokens": input_tokens,
+            "num_chunks": num_chunks,
+            "quality_score": quality_score,
+            "num_concepts": num_concepts,
+            "num_formulas": num_formulas,
+            "num_exam_questions": num_exam_questions,
+            "num_glossary_terms": num_glossary_terms,
+            "self_repair_triggered": 1 if self_repair_triggered else 0,
+            "self_repair_improvement": self_repair_improvement,
+            "total_tokens_used": total_tokens_used,
+            "generation_time_seconds": generation_time_seconds,
+            "warnings": warnings,
+            "created_at": datetime.utcnow(),
             # Comprehensive quality metrics (evrensel)
             # TODO: These fields need DB migration - temporarily disabled
-            # coverage_score=coverage_score,
-            # numeric_density=numeric_density,
-            # formula_completeness=formula_completeness,
-            # citation_depth=citation_depth,
-            # readability_score=readability_score,
-            # is_final_ready=1 if is_final_ready else 0
-        )
+            # "coverage_score": coverage_score,
+            # "numeric_density": numeric_density,
+            # "formula_completeness": formula_completeness,
+            # "citation_depth": citation_depth,
+            # "readability_score": readability_score,
+            # "is_final_ready": 1 if is_final_ready else 0
+        })
+        if _telemetry_queue.qsize() >= TELEMETRY_BATCH_SIZE:
+            _batch_ready.set()
         
-        db.add(quality_record)
-        db.commit()
-        
-        print(f"[TELEMETRY] Recorded quality: final_ready_score={quality_score:.2f}, " +
-              f"is_final_ready={is_final_ready}, concepts={num_concepts}, formulas={num_formulas}")
+        logger.info("[TELEMETRY] Queued quality: final_ready_score=%.2f, is_final_ready=%s, concepts=%s, formulas=%s",
+                    quality_score, is_final_ready, num_concepts, num_formulas)
         
     except Exception as e:
-        print(f"[TELEMETRY ERROR] Failed to record quality: {e}")
-        db.rollback()
+        logger.error("[TELEMETRY ERROR] Failed to record quality: %s", e)
 
 
 def get_quality_stats(db: Session, days: int = 7) -> Dict:
@@ -80,6 +144,8 @@ def get_quality_stats(db: Session, days: int = 7) -> Dict:
     from sqlalchemy import func
     from datetime import timedelta
     
+    flush_telemetry()  # Include rows still waiting in the write queue
+    
     try:
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
@@ -119,12 +185,14 @@ def get_quality_stats(db: Session, days: int = 7) -> Dict:
         }
     
     except Exception as e:
-        print(f"[TELEMETRY ERROR] Failed to get stats: {e}")
+        logger.error("[TELEMETRY ERROR] Failed to get stats: %s", e)
         return {"error": str(e)}
 
 
 def get_low_quality_patterns(db: Session, threshold: float = 0.6, limit: int = 10) -> List[Dict]:
     """Identify patterns in low-quality summaries for improvement"""
+    flush_telemetry()
+    
     try:
         low_quality = db.query(SummaryQuality).filter(
             SummaryQuality.quality_score < threshold
@@ -146,5 +214,5 @@ def get_low_quality_patterns(db: Session, threshold: float = 0.6, limit: int = 1
         return patterns
     
     except Exception as e:
-        print(f"[TELEMETRY ERROR] Failed to get low quality patterns: {e}")
+        logger.error("[TELEMETRY ERROR] Failed to get low quality patterns: %s", e)
         return []
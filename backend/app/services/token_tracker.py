@@ -4,7 +4,40 @@ Solves session scope issues by creating fresh session when needed
 """
 from typing import Optional
 from datetime import datetime
+import logging
 import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+_session_factory = None
+_engine_lock = threading.Lock()
+
+
+def _get_session_factory():
+    """
+    Sessionmaker bound to one pooled engine (created on first use)
+    Every OpenAI call logs usage, so building an engine per call meant a new
+    connection (and for Postgres a TCP+TLS handshake) per MAP chunk
+    """
+    global _session_factory
+    if _session_factory is None:
+        with _engine_lock:
+            if _session_factory is None:
+                # Import here to avoid circular dependencies
+                from sqlalchemy import create_engine
+                from sqlalchemy.orm import sessionmaker
+                
+                DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./study_assistant.db")
+                
+                if DATABASE_URL.startswith("sqlite"):
+                    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+                else:
+                    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+                
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return _session_factory
 
 
 def log_token_usage(
@@ -18,26 +51,15 @@ def log_token_usage(
 ):
     """
     Log token usage to database with proper session management
-    Creates fresh session to avoid scope issues
+    Creates fresh session (from the shared connection pool) to avoid scope issues
     """
     try:
-        # Import here to avoid circular dependencies
-        from sqlalchemy import create_engine, text
-        from sqlalchemy.orm import sessionmaker
-        
-        DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./study_assistant.db")
-        
-        # Create engine with minimal settings
-        if DATABASE_URL.startswith("sqlite"):
-            engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-        else:
-            engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+        from sqlalchemy import text
         
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        db = SessionLocal()
+        db = _get_session_factory()()
         
         try:
-            print(f"[TOKEN TRACKER] Recording: user_id={user_id}, endpoint={endpoint}, total={total_tokens}")
+            logger.debug("[TOKEN TRACKER] Recording: user_id=%s, endpoint=%s, total=%s", user_id, endpoint, total_tokens)
             
             sql = text("""
                 INSERT INTO token_usage (user_id, endpoint, model, input_tokens, output_tokens, total_tokens, estimated_cost, created_at)
@@ -55,12 +77,10 @@ def log_token_usage(
                 "created_at": datetime.utcnow()
             })
             db.commit()
-            print(f"[TOKEN TRACKER] ✅ Successfully recorded {total_tokens} tokens for user {user_id}, cost: ${estimated_cost:.4f}")
+            logger.debug("[TOKEN TRACKER] ✅ Successfully recorded %s tokens for user %s, cost: $%.4f", total_tokens, user_id, estimated_cost)
             
         finally:
             db.close()
             
     except Exception as e:
-        print(f"[TOKEN TRACKER ERROR] ❌ Failed to record token usage: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[TOKEN TRACKER ERROR] ❌ Failed to record token usage: %s", e)
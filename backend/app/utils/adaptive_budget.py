@@ -1,10 +1,20 @@
 """
 Adaptive token budget allocation based on content density
 """
-from app.config import CHUNK_OUTPUT_BASE, CHUNK_OUTPUT_FORMULA_BOOST, CHUNK_OUTPUT_THEOREM_BOOST
+from typing import Optional
+from app.config import (
+    CHUNK_OUTPUT_BASE, CHUNK_OUTPUT_FORMULA_BOOST, CHUNK_OUTPUT_THEOREM_BOOST, CHUNK_OUTPUT_MIN,
+    CHUNK_OUTPUT_MAX, MERGE_OUTPUT_BUDGET, MERGE_BUDGET_BASE, MERGE_BUDGET_PER_CHUNK,
+    MODEL_CONTEXT_TOKENS
+)
+from app.utils.tokens import count_tokens
 
+# Content markers that earn a chunk extra output budget (substring tests on the lowercased chunk)
+_FORMULA_INDICATORS = ("equation", "formula", "=", "∫", "∑", "∂", "calculate", "solve")
+_THEOREM_INDICATORS = ("theorem", "proof", "lemma", "proposition", "algorithm", "procedure")
 
-def calculate_chunk_budget(chunk_text: str) -> int:
+
+def calculate_chunk_budget(chunk_text: str, chunk_tokens: Optional[int] = None) -> int:
     """
     Calculate appropriate output budget for a chunk based on content density
     
@@ -12,7 +22,9 @@ def calculate_chunk_budget(chunk_text: str) -> int:
     - Base: 400 tokens for regular text
     - +150 if chunk contains formulas/equations
     - +200 if chunk contains theorems/proofs/algorithms
+    - Never more than ~1/4 of the chunk's own token count (min CHUNK_OUTPUT_MIN)
     
+    Pass chunk_tokens when the chunk was already counted, to skip re-tokenizing it
     Returns: Recommended max_output_tokens for this chunk
     """
     text_lower = chunk_text.lower()
@@ -20,21 +32,43 @@ def calculate_chunk_budget(chunk_text: str) -> int:
     budget = CHUNK_OUTPUT_BASE
     
     # Check for formula indicators
-    formula_indicators = ["equation", "formula", "=", "∫", "∑", "∂", "calculate", "solve"]
-    if any(indicator in text_lower for indicator in formula_indicators):
+    if any(indicator in text_lower for indicator in _FORMULA_INDICATORS):
         budget += CHUNK_OUTPUT_FORMULA_BOOST
     
-    # Check for theorem/proof indicators
-    theorem_indicators = ["theorem", "proof", "lemma", "proposition", "algorithm", "procedure"]
-    if any(indicator in text_lower for indicator in theorem_indicators):
+    # Check for theorem/proof indicators (no need to scan once the cap is reached)
+    if budget < CHUNK_OUTPUT_MAX and any(indicator in text_lower for indicator in _THEOREM_INDICATORS):
         budget += CHUNK_OUTPUT_THEOREM_BOOST
     
     # Cap at reasonable maximum
-    budget = min(budget, 800)
+    budget = min(budget, CHUNK_OUTPUT_MAX)
+    
+    # Short chunks can't fill the density budget: extracted notes run ~1/4 of the source
+    if chunk_tokens is None:
+        chunk_tokens = count_tokens(chunk_text)
+    budget = min(budget, max(CHUNK_OUTPUT_MIN, chunk_tokens // 4))
     
     return budget
 
 
+def calculate_merge_budget(num_chunks: int, out_cap: int) -> int:
+    """
+    REDUCE output budget scaled to the amount of source material
+    Small documents don't reserve the maximum; large ones still get up to out_cap
+    """
+    budget = MERGE_BUDGET_BASE + MERGE_BUDGET_PER_CHUNK * num_chunks
+    budget = max(MERGE_OUTPUT_BUDGET[0], min(budget, MERGE_OUTPUT_BUDGET[1]))
+    return min(budget, out_cap)
+
+
+def max_reduce_inputs(prompt_tokens: int, model_context: int = MODEL_CONTEXT_TOKENS) -> int:
+    """
+    How many MAP summaries a single REDUCE prompt can hold without overflowing the context
+    Assumes every summary may use its full CHUNK_OUTPUT_MAX and reserves the largest REDUCE output
+    """
+    room = model_context - MERGE_OUTPUT_BUDGET[1] - prompt_tokens
+    return max(2, room // CHUNK_OUTPUT_MAX)
+
+
 def distribute_merge_budget(
     total_concepts: int,
     total_formulas: int,
@@ -1,7 +1,8 @@
 """
 Text chunking utilities for map-reduce summarization
 """
-from typing import List
+import hashlib
+from typing import Iterator, List, Optional
 
 
 def split_text_approx_tokens(
@@ -14,11 +15,22 @@ def split_text_approx_tokens(
     Uses character-based approximation (4 chars ≈ 1 token)
     Tries to break at paragraph boundaries when possible
     """
+    return list(iter_text_chunks_approx(text, chunk_tokens, token_per_char))
+
+
+def iter_text_chunks_approx(
+    text: str,
+    chunk_tokens: int = 2400,
+    token_per_char: float = 0.25
+) -> Iterator[str]:
+    """
+    Lazily yield the chunks split_text_approx_tokens would return
+    Lets callers process one chunk at a time instead of holding them all
+    """
     if not text:
-        return []
+        return
     
     chars_per_chunk = int(chunk_tokens / token_per_char)
-    chunks = []
     i = 0
     n = len(text)
     
@@ -50,11 +62,9 @@ def split_text_approx_tokens(
         
         chunk = text[i:j].strip()
         if chunk:
-            chunks.append(chunk)
+            yield chunk
         
         i = j
-    
-    return chunks
 
 
 def merge_texts(texts: List[str], separator: str = "\n\n") -> str:
@@ -62,7 +72,8 @@ def merge_texts(texts: List[str], separator: str = "\n\n") -> str:
     Merge multiple texts with separator
     Useful for combining chunk summaries
     """
-    return separator.join([t.strip() for t in texts if t.strip()])
+    # Strip each text once; the walrus keeps the filter from re-stripping
+    return separator.join(stripped for t in texts if (stripped := t.strip()))
 
 
 def estimate_chunks_needed(text_length: int, chunk_tokens: int = 2400, token_per_char: float = 0.25) -> int:
@@ -71,3 +82,68 @@ def estimate_chunks_needed(text_length: int, chunk_tokens: int = 2400, token_per
     """
     total_tokens = int(text_length * token_per_char)
     return max(1, (total_tokens + chunk_tokens - 1) // chunk_tokens)
+
+
+def _word_shingles(words: List[str], size: int) -> set:
+    """Hashed word n-grams used for near-duplicate comparison"""
+    if len(words) <= size:
+        return {hash(tuple(words))} if words else set()
+    return {hash(tuple(words[k:k + size])) for k in range(len(words) - size + 1)}
+
+
+class DuplicateChunkIndex:
+    """
+    Incremental duplicate detection: add() chunks in order as they are produced
+    Exact duplicates are matched after case/whitespace normalization;
+    near-duplicates by word-shingle Jaccard similarity >= threshold
+    """
+    
+    def __init__(self, threshold: float = 0.9, shingle_size: int = 5):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self._count = 0
+        self._exact = {}  # normalized-text digest -> canonical chunk index
+        self._canonical = []  # (index, shingle set) of chunks that will be summarized
+    
+    def add(self, chunk: str) -> Optional[int]:
+        """Register the next chunk; returns the index of an earlier chunk it duplicates, or None"""
+        i = self._count
+        self._count += 1
+        
+        words = chunk.lower().split()
+        key = hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=16).digest()
+        if key in self._exact:
+            return self._exact[key]
+        
+        match = None
+        shingles = _word_shingles(words, self.shingle_size)
+        threshold = self.threshold
+        if threshold < 1.0 and shingles:
+            for j, other in self._canonical:
+                # Jaccard >= t requires min/max set size >= t; skip hopeless pairs cheaply
+                small, large = sorted((len(shingles), len(other)))
+                if small < threshold * large:
+                    continue
+                inter = len(shingles & other)
+                if inter / (len(shingles) + len(other) - inter) >= threshold:
+                    match = j
+                    break
+        
+        self._exact[key] = i if match is None else match
+        if match is None:
+            self._canonical.append((i, shingles))
+        return match
+
+
+def find_duplicate_chunks(
+    chunks: List[str],
+    threshold: float = 0.9,
+    shingle_size: int = 5
+) -> List[Optional[int]]:
+    """
+    For each chunk, return the index of an earlier chunk it duplicates, or None
+    Exact duplicates are matched after case/whitespace normalization;
+    near-duplicates by word-shingle Jaccard similarity >= threshold
+    """
+    index = DuplicateChunkIndex(threshold, shingle_size)
+    return [index.add(chunk) for chunk in chunks]
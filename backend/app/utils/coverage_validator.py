@@ -90,6 +90,30 @@ def similarity_score(a: str, b: str) -> float:
     return SequenceMatcher(None, a.lower(), b.lower()).ratio()
 
 
+def match_source_topics(source_topics: List[str], summary_topics: List[str], threshold: float = 0.7) -> List[bool]:
+    """
+    For each source topic, whether any summary topic is at least `threshold` similar
+    
+    One pass shared by the missing-topic and coverage computations: each topic is
+    lowercased once, each summary topic is indexed once by SequenceMatcher (set_seq2),
+    cheap upper bounds skip pairs that can't reach the threshold, and a source topic
+    stops being compared as soon as it has a match
+    """
+    sources = [topic.lower() for topic in source_topics]
+    matched = [False] * len(sources)
+    matcher = SequenceMatcher(None)
+    for summary_topic in summary_topics:
+        matcher.set_seq2(summary_topic.lower())
+        for i, source in enumerate(sources):
+            if matched[i]:
+                continue
+            matcher.set_seq1(source)
+            if (matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold
+                    and matcher.ratio() >= threshold):
+                matched[i] = True
+    return matched
+
+
 def find_missing_topics(source_topics: List[str], summary_topics: List[str], threshold: float = 0.7) -> List[str]:
     """
     Find topics from source that don't appear in summary
@@ -102,21 +126,8 @@ def find_missing_topics(source_topics: List[str], summary_topics: List[str], thr
     Returns:
         List of source topics that appear to be missing from summary
     """
-    missing = []
-    
-    for source_topic in source_topics:
-        # Check if this source topic matches any summary topic
-        best_match_score = 0.0
-        for summary_topic in summary_topics:
-            score = similarity_score(source_topic, summary_topic)
-            if score > best_match_score:
-                best_match_score = score
-        
-        # If best match is below threshold, consider it missing
-        if best_match_score < threshold:
-            missing.append(source_topic)
-    
-    return missing
+    matched = match_source_topics(source_topics, summary_topics, threshold)
+    return [topic for topic, found in zip(source_topics, matched) if not found]
 
 
 def calculate_coverage_score(source_topics: List[str], summary_topics: List[str], threshold: float = 0.7) -> float:
@@ -129,14 +140,7 @@ def calculate_coverage_score(source_topics: List[str], summary_topics: List[str]
     if not source_topics:
         return 1.0  # No topics to cover = 100% coverage
     
-    matched_count = 0
-    for source_topic in source_topics:
-        for summary_topic in summary_topics:
-            if similarity_score(source_topic, summary_topic) >= threshold:
-                matched_count += 1
-                break  # Found a match, move to next source topic
-    
-    return matched_count / len(source_topics)
+    return sum(match_source_topics(source_topics, summary_topics, threshold)) / len(source_topics)
 
 
 def validate_coverage(source_text: str, summary_json: dict, min_coverage: float = 0.85) -> Dict:
@@ -159,9 +163,10 @@ def validate_coverage(source_text: str, summary_json: dict, min_coverage: float
     source_topics = extract_source_topics(source_text)
     summary_topics = extract_summary_topics(summary_json)
     
-    missing = find_missing_topics(source_topics, summary_topics)
-    coverage = calculate_coverage_score(source_topics, summary_topics)
+    found = match_source_topics(source_topics, summary_topics)
+    missing = [topic for topic, hit in zip(source_topics, found) if not hit]
     matched = len(source_topics) - len(missing)
+    coverage = matched / len(source_topics) if source_topics else 1.0  # No topics to cover = 100% coverage
     
     result = {
         "passed": coverage >= min_coverage,
@@ -3,7 +3,9 @@ File validation and processing utilities
 """
 import os
 import hashlib
-from typing import Set
+import threading
+from collections import OrderedDict
+from typing import Set, Iterable
 from io import BytesIO
 from PyPDF2 import PdfReader
 
@@ -13,6 +15,48 @@ def sha256_bytes(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
 
+# file_id -> content hash; file ids are derived from the uploaded bytes, so the
+# extracted text for an id doesn't change and needn't be re-hashed per request
+_content_hash_memo: "OrderedDict[tuple, str]" = OrderedDict()
+_content_hash_lock = threading.Lock()
+_CONTENT_HASH_MEMO_MAX = 1024
+
+
+def sha256_bytes_memo(file_id: str, data: bytes) -> str:
+    """
+    SHA256 of file content, memoized per (file_id, size)
+    Repeat summarize requests for the same upload skip re-hashing the text
+    """
+    key = (file_id, len(data))
+    with _content_hash_lock:
+        digest = _content_hash_memo.get(key)
+        if digest is not None:
+            _content_hash_memo.move_to_end(key)
+            return digest
+    
+    digest = sha256_bytes(data)
+    with _content_hash_lock:
+        _content_hash_memo[key] = digest
+        if len(_content_hash_memo) > _CONTENT_HASH_MEMO_MAX:
+            _content_hash_memo.popitem(last=False)
+    return digest
+
+
+def request_hash(params: Iterable[str], content_hashes: Iterable[str]) -> str:
+    """
+    Cache key over fixed-order request params and per-file content hashes
+    Fields are fed to one incremental SHA256, separated by NUL bytes
+    """
+    h = hashlib.sha256()
+    for part in params:
+        h.update(part.encode("utf-8", errors="ignore"))
+        h.update(b"\0")
+    for digest in content_hashes:
+        h.update(digest.encode("ascii"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
 def sha256_text(text: str) -> str:
     """Calculate SHA256 hash of text"""
     return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
@@ -3,7 +3,11 @@ JSON extraction and repair utilities
 """
 import re
 import json
+import logging
 from typing import Optional
+from app.utils import json_codec
+
+logger = logging.getLogger(__name__)
 
 
 # Filler patterns to remove from AI outputs
@@ -168,7 +172,7 @@ def fix_escape_sequences(text: str) -> str:
         fixed = re.sub(pattern, fix_string_backslashes, text)
         return fixed
     except Exception as e:
-        print(f"[ESCAPE FIX] Error: {e}, falling back to simple replacement")
+        logger.warning("[ESCAPE FIX] Error: %s, falling back to simple replacement", e)
         # Fallback: simple double-backslash replacement (less accurate but safe)
         return text.replace('\\', '\\\\')
 
@@ -187,17 +191,17 @@ def parse_json_robust(text: str, max_attempts: int = 3) -> dict:
     Raises:
         ValueError if all parsing attempts fail
     """
-    # Attempt 1: Direct parse
+    # Attempt 1: Direct parse (the common case now that merge calls use JSON mode)
     try:
-        parsed = json.loads(text)
+        parsed = json_codec.loads(text)
         # Check for empty fields
         empty_fields = detect_empty_fields(parsed)
         if empty_fields:
             parsed["_empty_fields_detected"] = empty_fields
-            print(f"[JSON VALIDATION] Empty fields detected: {empty_fields}")
+            logger.info("[JSON VALIDATION] Empty fields detected: %s", empty_fields)
         return parsed
     except json.JSONDecodeError as e1:
-        print(f"[JSON PARSE] Attempt 1 failed: {e1}")
+        logger.warning("[JSON PARSE] Attempt 1 failed: %s", e1)
     
     # Attempt 2: Fix escape sequences and parse
     try:
@@ -206,10 +210,10 @@ def parse_json_robust(text: str, max_attempts: int = 3) -> dict:
         empty_fields = detect_empty_fields(parsed)
         if empty_fields:
             parsed["_empty_fields_detected"] = empty_fields
-        print(f"[JSON PARSE] Attempt 2 succeeded (fixed escape sequences)")
+        logger.info("[JSON PARSE] Attempt 2 succeeded (fixed escape sequences)")
         return parsed
     except json.JSONDecodeError as e2:
-        print(f"[JSON PARSE] Attempt 2 failed: {e2}")
+        logger.warning("[JSON PARSE] Attempt 2 failed: %s", e2)
     
     # Attempt 3: Extract and parse
     try:
@@ -220,7 +224,7 @@ def parse_json_robust(text: str, max_attempts: int = 3) -> dict:
             parsed["_empty_fields_detected"] = empty_fields
         return parsed
     except json.JSONDecodeError as e3:
-        print(f"[JSON PARSE] Attempt 3 failed: {e3}")
+        logger.warning("[JSON PARSE] Attempt 3 failed: %s", e3)
     
     # Attempt 4: Extract, fix escapes, and parse
     try:
@@ -230,10 +234,10 @@ def parse_json_robust(text: str, max_attempts: int = 3) -> dict:
         empty_fields = detect_empty_fields(parsed)
         if empty_fields:
             parsed["_empty_fields_detected"] = empty_fields
-        print(f"[JSON PARSE] Attempt 4 succeeded (extract + fix escapes)")
+        logger.info("[JSON PARSE] Attempt 4 succeeded (extract + fix escapes)")
         return parsed
     except json.JSONDecodeError as e4:
-        print(f"[JSON PARSE] Attempt 4 failed: {e4}")
+        logger.warning("[JSON PARSE] Attempt 4 failed: %s", e4)
     
     # Attempt 5: Balance braces and parse
     try:
@@ -244,10 +248,10 @@ def parse_json_robust(text: str, max_attempts: int = 3) -> dict:
         empty_fields = detect_empty_fields(parsed)
         if empty_fields:
             parsed["_empty_fields_detected"] = empty_fields
-        print(f"[JSON PARSE] Attempt 5 succeeded (balance + fix escapes)")
+        logger.info("[JSON PARSE] Attempt 5 succeeded (balance + fix escapes)")
         return parsed
     except json.JSONDecodeError as e5:
-        print(f"[JSON PARSE] Attempt 5 failed: {e5}")
+        logger.warning("[JSON PARSE] Attempt 5 failed: %s", e5)
     
     # Attempt 6: Try to find largest valid JSON object
     try:
@@ -261,12 +265,12 @@ def parse_json_robust(text: str, max_attempts: int = 3) -> dict:
                 empty_fields = detect_empty_fields(parsed)
                 if empty_fields:
                     parsed["_empty_fields_detected"] = empty_fields
-                print(f"[JSON PARSE] Attempt 6 succeeded (progressive truncation)")
+                logger.info("[JSON PARSE] Attempt 6 succeeded (progressive truncation)")
                 return parsed
             except:
                 continue
     except Exception as e6:
-        print(f"[JSON PARSE] Attempt 6 failed: {e6}")
+        logger.warning("[JSON PARSE] Attempt 6 failed: %s", e6)
     
     # All attempts failed
     raise ValueError(f"Failed to parse JSON after {max_attempts} attempts. Text length: {len(text)}")
@@ -4,9 +4,12 @@ NO PLACEHOLDER GENERATION - only validation and self-repair triggers
 EVRENSEL (universal) quality rules: domain-agnostic, file-independent
 """
 from typing import Dict, Any, List, Tuple
+import logging
 import re
 import json
 
+logger = logging.getLogger(__name__)
+
 
 # Vague example patterns to detect
 VAGUE_EXAMPLE_PATTERNS = [
@@ -17,6 +20,29 @@ VAGUE_EXAMPLE_PATTERNS = [
     r'for\s+example\s*:?\s*$',  # "For example:" with nothing after
     r'e\.?g\.?,?\s*$',  # "e.g." or "e.g.," with nothing after
 ]
+# All vague patterns as one alternation: a single scan per example instead of one per pattern
+_VAGUE_EXAMPLE_RE = re.compile("|".join(f"(?:{pattern})" for pattern in VAGUE_EXAMPLE_PATTERNS))
+
+# detect_domain signals (compiled once; detect_domain runs for every concept)
+_QUANT_SIGNALS = re.compile(r"(O\(|=|\+|-|\*|/|%|≥|≤|∑|∂|theorem|lemma|proof|algorithm|km|kg|hz|ms|fps|complexity|runtime)", re.I)
+_QUAL_SIGNALS = re.compile(r"(treaty|dynasty|poem|stanza|chapter|author|movement|school|case law|amendment|ethics|philosophy|revolution|painting|novel|essay|speech)", re.I)
+_DIGIT = re.compile(r"\d")
+_SENTENCE_END = re.compile(r"[.!?]+")
+
+# Control flow keywords for algorithm detection
+CONTROL_FLOW_KEYWORDS = ('if', 'for', 'while', 'return', 'else', 'loop', 'repeat')
+# Substrings marking a formula expression as pseudocode (matched in the lowercased expression)
+PSEUDOCODE_KEYWORDS = ("function", "return", "for each", "if", "while", "loop", "procedure", "step")
+_CONTROL_WORD_RE = re.compile(r'\b(function|return|for each|if|while|loop)\b', re.IGNORECASE)
+_MATH_PART_RE = re.compile(r'[=+\-*/^∑∫∂≤≥<>]+|\b[a-z]\s*=\s*[^,;]+')
+
+# Hype number patterns to detect (applied in order)
+_HYPE_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'\d+\^\d+\s+to\s+\d+',  # e.g., "35^100 to 5"
+    r'from\s+\d+\^\d+',  # e.g., "from 35^100"
+    r'exponential.*manageable',
+    r'astronomical.*practical',
+))
 
 
 def detect_domain(sample_text: str) -> str:
@@ -29,16 +55,14 @@ def detect_domain(sample_text: str) -> str:
     """
     if not sample_text:
         return "semi"
-    quant_signals = r"(O\(|=|\+|-|\*|/|%|≥|≤|∑|∂|theorem|lemma|proof|algorithm|km|kg|hz|ms|fps|complexity|runtime)"
-    qual_signals  = r"(treaty|dynasty|poem|stanza|chapter|author|movement|school|case law|amendment|ethics|philosophy|revolution|painting|novel|essay|speech)"
-    has_digit = bool(re.search(r"\d", sample_text))
-    has_quant = bool(re.search(quant_signals, sample_text, re.I))
-    has_qual  = bool(re.search(qual_signals, sample_text, re.I))
-
-    if has_quant or (has_digit and not has_qual):
+    # Scan in decision order: a quant signal settles it, and digits only matter
+    # when there is no qualitative anchor
+    if _QUANT_SIGNALS.search(sample_text):
         return "quant"
-    if has_qual and not has_quant:
+    if _QUAL_SIGNALS.search(sample_text):
         return "qual"
+    if _DIGIT.search(sample_text):
+        return "quant"
     return "semi"
 
 
@@ -90,7 +114,7 @@ def enforce_exam_ready(payload: Dict[str, Any], detected_themes: List[str] = Non
     # Detect overall domain for the document
     sample_text = str(summary)[:2000]
     overall_domain = detect_domain(sample_text)
-    print(f"[ENFORCE] Detected domain: {overall_domain}")
+    logger.info("[ENFORCE] Detected domain: %s", overall_domain)
 
     # Store original source for signal detection (use first section's text as proxy)
     original_source_text = ""
@@ -182,12 +206,12 @@ def enforce_exam_ready(payload: Dict[str, Any], detected_themes: List[str] = Non
     # 11) Log quality validation issues (non-blocking)
     citation_issues = validate_citations_depth(cleaned)
     if citation_issues:
-        print(f"[QUALITY WARNING] Citation issues: {citation_issues}")
+        logger.warning("[QUALITY WARNING] Citation issues: %s", citation_issues)
     
     if detected_themes:
         additional_topics_issues = enforce_additional_topics_presence(summary, detected_themes)
         if additional_topics_issues:
-            print(f"[QUALITY WARNING] Coverage issues: {additional_topics_issues}")
+            logger.warning("[QUALITY WARNING] Coverage issues: %s", additional_topics_issues)
     
     return cleaned
 
@@ -340,27 +364,6 @@ def validate_and_enhance_quality(result: Dict[str, Any]) -> Tuple[Dict[str, Any]
     Returns:
         (enhanced_result, repair_prompts): Enhanced JSON and list of repair prompts if needed
     """
-    # Vague example patterns to detect
-    VAGUE_EXAMPLE_PATTERNS = [
-        r'consider\s+a\s+simple\s+case',
-        r'imagine\s+a\s+scenario',
-        r'suppose\s+we\s+have',
-        r'let\'?s\s+say',
-        r'for\s+example\s*:?\s*$',  # "For example:" with nothing after
-        r'e\.?g\.?,?\s*$',  # "e.g." or "e.g.," with nothing after
-    ]
-    
-    # Control flow keywords for algorithm detection
-    CONTROL_FLOW_KEYWORDS = ['if', 'for', 'while', 'return', 'else', 'loop', 'repeat']
-    
-    # Hype number patterns to detect
-    HYPE_PATTERNS = [
-        r'\d+\^\d+\s+to\s+\d+',  # e.g., "35^100 to 5"
-        r'from\s+\d+\^\d+',  # e.g., "from 35^100"
-        r'exponential.*manageable',
-        r'astronomical.*practical',
-    ]
-    
     repair_prompts = []
     
     if "summary" not in result:
@@ -376,7 +379,7 @@ def validate_and_enhance_quality(result: Dict[str, Any]) -> Tuple[Dict[str, Any]
             example = concept.get("example", "")
             if example:
                 # Check if example is vague
-                is_vague = any(re.search(pattern, example.lower()) for pattern in VAGUE_EXAMPLE_PATTERNS)
+                is_vague = bool(_VAGUE_EXAMPLE_RE.search(example.lower()))
                 # Check if example is too short (likely incomplete)
                 is_too_short = len(example.split()) < 10
                 
@@ -403,8 +406,9 @@ def validate_and_enhance_quality(result: Dict[str, Any]) -> Tuple[Dict[str, Any]
         if is_algorithm:
             for j, concept in enumerate(section.get("concepts", [])):
                 explanation = concept.get("explanation", "")
+                explanation_lower = explanation.lower()
                 # Check if pseudo-code is present
-                has_control_flow = any(keyword in explanation.lower() for keyword in CONTROL_FLOW_KEYWORDS)
+                has_control_flow = any(keyword in explanation_lower for keyword in CONTROL_FLOW_KEYWORDS)
                 has_code_structure = any(char in explanation for char in ['{', '}', '←', '→'])
                 
                 if not (has_control_flow or has_code_structure):
@@ -427,7 +431,8 @@ def validate_and_enhance_quality(result: Dict[str, Any]) -> Tuple[Dict[str, Any]
         worked_example = formula.get("worked_example", "")
         
         # Check if expression is actually control flow (should be in worked_example instead)
-        has_control_in_expr = any(keyword in expression.lower() for keyword in CONTROL_FLOW_KEYWORDS)
+        expression_lower = expression.lower()
+        has_control_in_expr = any(keyword in expression_lower for keyword in CONTROL_FLOW_KEYWORDS)
         if has_control_in_expr and len(expression) > 100:  # Long control flow text
             formula_issues.append(f"Formula '{formula.get('name', i+1)}' has control flow in expression (move to worked_example)")
         
@@ -470,10 +475,10 @@ def validate_and_enhance_quality(result: Dict[str, Any]) -> Tuple[Dict[str, Any]
     for section in sections:
         for concept in section.get("concepts", []):
             explanation = concept.get("explanation", "")
-            for pattern in HYPE_PATTERNS:
-                if re.search(pattern, explanation, re.IGNORECASE):
-                    # Replace with generic "asymptotically better" or similar
-                    explanation = re.sub(pattern, "asymptotically better", explanation, flags=re.IGNORECASE)
+            for pattern in _HYPE_PATTERNS:
+                # Replace with generic "asymptotically better" or similar
+                explanation, replaced = pattern.subn("asymptotically better", explanation)
+                if replaced:
                     concept["explanation"] = explanation
     
     # 6. Check glossary size
@@ -494,13 +499,14 @@ def has_concrete_example(example: str) -> bool:
         return False
     
     # Check for vague patterns
-    is_vague = any(re.search(pattern, example.lower()) for pattern in VAGUE_EXAMPLE_PATTERNS)
+    example_lower = example.lower()
+    is_vague = bool(_VAGUE_EXAMPLE_RE.search(example_lower))
     if is_vague:
         return False
     
     # Check for concrete indicators (numbers, specific terms, steps)
-    has_numbers = bool(re.search(r'\d+', example))
-    has_steps = any(word in example.lower() for word in ['step', 'first', 'then', 'finally', 'given', 'result'])
+    has_numbers = bool(_DIGIT.search(example))
+    has_steps = any(word in example_lower for word in ('step', 'first', 'then', 'finally', 'given', 'result'))
     
     return has_numbers or has_steps
 
@@ -562,8 +568,7 @@ def ensure_numeric_example_if_relevant(text: str, source_text: str) -> str:
 def fix_formula_vs_pseudocode(text: str) -> str:
     """Ensure formulas use math notation, not pseudocode keywords"""
     # If text has control flow keywords, it's likely pseudocode mixed with math
-    control_keywords = r'\b(function|return|for each|if|while|loop)\b'
-    if re.search(control_keywords, text, re.IGNORECASE):
+    if _CONTROL_WORD_RE.search(text):
         # Replace with math-friendly notation
         text = text.replace('function', 'f')
         text = text.replace('Function', 'f')
@@ -574,7 +579,8 @@ def fix_formula_vs_pseudocode(text: str) -> str:
 
 def enforce_alpha_beta_trace(text: str) -> str:
     """Ensure alpha-beta pruning examples show trace steps"""
-    if 'alpha' in text.lower() or 'beta' in text.lower() or 'α' in text or 'β' in text:
+    text_lower = text.lower()
+    if 'alpha' in text_lower or 'beta' in text_lower or 'α' in text or 'β' in text:
         # Check if trace exists
         if not re.search(r'(step|trace|α\s*=|β\s*=)', text, re.IGNORECASE):
             # Add minimal trace hint
@@ -584,7 +590,8 @@ def enforce_alpha_beta_trace(text: str) -> str:
 
 def add_stochastic_expectation_formula_if_needed(text: str) -> str:
     """Add expectation formula if stochastic games mentioned but formula missing"""
-    if 'stochastic' in text.lower() or 'expectation' in text.lower():
+    text_lower = text.lower()
+    if 'stochastic' in text_lower or 'expectation' in text_lower:
         if not re.search(r'E\[|𝔼\[|expected value', text, re.IGNORECASE):
             text += " Formula: E[V] = Σ P(s') × V(s')"
     return text
@@ -649,21 +656,20 @@ def coerce_pseudocode_fields(formula: Dict[str, Any]) -> Dict[str, Any]:
     """
     expression = formula.get("expression", "")
     
-    # Control flow keywords that indicate pseudocode
-    control_keywords = ["function", "return", "for each", "if", "while", "loop", "procedure", "step"]
+    # Only long control flow is moved; short expressions skip the keyword scan
+    if len(expression) <= 80:
+        return formula
+    expression_lower = expression.lower()
+    has_control = any(keyword in expression_lower for keyword in PSEUDOCODE_KEYWORDS)
     
-    # Check if expression contains control flow
-    has_control = any(keyword in expression.lower() for keyword in control_keywords)
-    
-    if has_control and len(expression) > 80:  # Long control flow
+    if has_control:  # Long control flow
         # Move to pseudocode field if not already there
         if not formula.get("pseudocode"):
             formula["pseudocode"] = expression
         
         # Create compact mathematical expression (placeholder for self-repair)
         # Extract any mathematical notation
-        math_pattern = r'[=+\-*/^∑∫∂≤≥<>]+|\b[a-z]\s*=\s*[^,;]+'
-        math_parts = re.findall(math_pattern, expression)
+        math_parts = _MATH_PART_RE.findall(expression)
         
         if math_parts:
             formula["expression"] = " ".join(math_parts[:3])  # Keep first 3 math expressions
@@ -698,7 +704,7 @@ def validate_citations_depth(result: Dict[str, Any]) -> List[str]:
     for citation in citations:
         # Skip if citation is not a dict (defensive programming)
         if not isinstance(citation, dict):
-            print(f"[QUALITY WARNING] Citation is not a dict: {type(citation)}")
+            logger.warning("[QUALITY WARNING] Citation is not a dict: %s", type(citation))
             continue
         has_detail = citation.get("page_range") or citation.get("section_or_heading") or citation.get("section")
         if not has_detail:
@@ -768,17 +774,21 @@ def calculate_comprehensive_quality_score(result: Dict[str, Any], detected_theme
         else:
             coverage_score = 1.0 if len(sections) >= 4 else len(sections) / 4
         
-        # 2. Numeric Density: % of examples with numbers (domain-aware)
+        # One pass over the concepts collects what scores 2 and 5 need
         total_examples = 0
         numeric_examples = 0
+        explanations = []
         
         for section in sections:
             for concept in section.get("concepts", []):
                 example = concept.get("example", "")
                 if example:
                     total_examples += 1
-                    if re.search(r'\d', example):
+                    if _DIGIT.search(example):
                         numeric_examples += 1
+                explanations.append(concept.get("explanation", ""))
+        
+        # 2. Numeric Density: % of examples with numbers (domain-aware)
         
         # Domain-aware target: quant domains need high numeric density
         sample_text = str(summary)[:2000]
@@ -825,16 +835,15 @@ def calculate_comprehensive_quality_score(result: Dict[str, Any], detected_theme
             citation_depth = 0.5  # Neutral if no citations
         
         # 5. Readability: Average sentence length (target: 18-28 tokens/sentence)
-        all_text = ""
-        for section in sections:
-            for concept in section.get("concepts", []):
-                all_text += concept.get("explanation", "") + " "
-        
-        sentences = re.split(r'[.!?]+', all_text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
-        
-        if sentences:
-            avg_tokens_per_sentence = sum(len(s.split()) for s in sentences) / len(sentences)
+        # Only the word count per sentence matters, so no stripped copies are kept
+        num_sentences = 0
+        sentence_tokens = 0
+        for sentence in _SENTENCE_END.split(" ".join(explanations)):
+            if len(sentence.strip()) > 10:
+                num_sentences += 1
+                sentence_tokens += len(sentence.split())
+        if num_sentences:
+            avg_tokens_per_sentence = sentence_tokens / num_sentences
             # Target: 18-28 tokens/sentence for density
             if 18 <= avg_tokens_per_sentence <= 28:
                 readability_score = 1.0
@@ -865,7 +874,7 @@ def calculate_comprehensive_quality_score(result: Dict[str, Any], detected_theme
             "formula_completeness": round(formula_completeness, 2),
             "citation_depth": round(citation_depth, 2),
             "readability_score": round(readability_score, 2),
-            "avg_tokens_per_sentence": round(avg_tokens_per_sentence, 1) if sentences else 0,
+            "avg_tokens_per_sentence": round(avg_tokens_per_sentence, 1) if num_sentences else 0,
             "glossary_score": round(glossary_score, 2),
             "final_ready_score": round(final_ready_score, 2),
             "is_final_ready": final_ready_score >= 0.90,
@@ -874,7 +883,7 @@ def calculate_comprehensive_quality_score(result: Dict[str, Any], detected_theme
         }
     
     except Exception as e:
-        print(f"[QUALITY METRICS] Error calculating: {e}")
+        logger.error("[QUALITY METRICS] Error calculating: %s", e)
         return {
             "final_ready_score": 0.5,
             "is_final_ready": False,
@@ -3,7 +3,7 @@ Structure-aware document parsing
 Extracts headings, sections, formulas, and examples from documents
 """
 import re
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Callable
 from dataclasses import dataclass
 
 
@@ -124,10 +124,12 @@ def chunk_by_headings(
     blocks: List[ContentBlock],
     target_tokens: int = 3500,
     min_chunk_tokens: int = 1000,
-    approx_chars_per_token: float = 4.0
+    approx_chars_per_token: float = 4.0,
+    token_counter: Optional[Callable[[str], int]] = None
 ) -> List[Tuple[List[ContentBlock], str]]:
     """
     Chunk blocks by heading boundaries, respecting structure
+    token_counter, if given, replaces the chars-per-token approximation
     
     Returns: List of (blocks_in_chunk, heading_path_str)
     """
@@ -137,7 +139,10 @@ def chunk_by_headings(
     current_heading_path = []
     
     for block in blocks:
-        block_tokens = len(block.content) / approx_chars_per_token
+        if token_counter is not None:
+            block_tokens = token_counter(block.content)
+        else:
+            block_tokens = len(block.content) / approx_chars_per_token
         
         # If adding this block exceeds target AND we have minimum chunk size
         if current_tokens + block_tokens > target_tokens and current_tokens > min_chunk_tokens:
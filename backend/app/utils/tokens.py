@@ -0,0 +1,150 @@
+"""
+Token counting and token-accurate text splitting
+Uses tiktoken when installed; falls back to a chars-per-token approximation
+that starts at TOKEN_PER_CHAR and is calibrated from the API's usage reports
+"""
+import logging
+from functools import lru_cache
+from typing import Iterator, List, Optional
+from app.config import (
+    OPENAI_MODEL, TOKEN_PER_CHAR, TOKEN_RATIO_EMA_ALPHA,
+    TOKENIZE_PARALLEL_MIN_CHARS, TOKENIZE_WINDOW_CHARS
+)
+from app.utils.chunking import iter_text_chunks_approx
+
+try:
+    import tiktoken
+except ImportError:  # Optional dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """
+    Return the tiktoken encoding for OPENAI_MODEL, or None if unavailable
+    Loaded once per process (the BPE tables are large)
+    """
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(OPENAI_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # e.g. BPE file download blocked; keep working with the approximation
+        logger.info("[TOKENS] tiktoken unavailable (%s), using character approximation", e)
+        return None
+
+
+_token_per_char = TOKEN_PER_CHAR
+
+
+def token_per_char() -> float:
+    """Current tokens-per-character estimate used by the approximation"""
+    return _token_per_char
+
+
+def observe_prompt_tokens(prompt_chars: int, prompt_tokens: int) -> None:
+    """
+    Fold one measured (characters sent, prompt_tokens billed) pair into the estimate
+    Short prompts are skipped: per-message framing tokens would skew the ratio
+    """
+    global _token_per_char
+    if prompt_chars < 1000 or prompt_tokens <= 0:
+        return
+    ratio = min(max(prompt_tokens / prompt_chars, 0.1), 1.0)
+    _token_per_char += TOKEN_RATIO_EMA_ALPHA * (ratio - _token_per_char)
+
+
+def encode(text: str) -> List[int]:
+    """
+    Encode text as plain content (special-token strings are treated as text)
+    Long texts are encoded as windows in parallel (tiktoken releases the GIL)
+    """
+    enc = get_encoding()
+    if len(text) < TOKENIZE_PARALLEL_MIN_CHARS:
+        return enc.encode(text, disallowed_special=())
+    tokens = []
+    for part in enc.encode_batch(split_at_word_starts(text, TOKENIZE_WINDOW_CHARS), disallowed_special=()):
+        tokens.extend(part)
+    return tokens
+
+
+def split_at_word_starts(text: str, window: int) -> List[str]:
+    """
+    Cut text into pieces of about `window` chars, only just before a " " + letter
+    that follows a non-space character. The BPE pre-tokenizer always starts a new
+    pre-token there, so encoding the pieces separately yields the same tokens
+    """
+    pieces = []
+    start = 0
+    while len(text) - start > window:
+        cut = text.find(" ", start + window)
+        while cut != -1 and not (
+            cut + 1 < len(text) and text[cut + 1].isalpha() and not text[cut - 1].isspace()
+        ):
+            cut = text.find(" ", cut + 1)
+        if cut == -1:
+            break
+        pieces.append(text[start:cut])
+        start = cut
+    pieces.append(text[start:])
+    return pieces
+
+
+def try_encode(text: str) -> Optional[List[int]]:
+    """Token ids for text, or None when no tokenizer is available"""
+    if get_encoding() is None:
+        return None
+    return encode(text) if text else []
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens in text (exact with tiktoken, approximate otherwise)
+    """
+    if not text:
+        return 0
+    if get_encoding() is None:
+        return int(len(text) * _token_per_char)
+    return len(encode(text))
+
+
+def split_text_by_tokens(text: str, chunk_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """
+    Split text into windows of exactly chunk_tokens tokens (last one may be shorter)
+    Tokenizes the whole text once and slices the token array
+    """
+    return list(iter_text_chunks(text, chunk_tokens, overlap_tokens))
+
+
+def iter_text_chunks(
+    text: str,
+    chunk_tokens: int,
+    overlap_tokens: int = 0,
+    tokens: Optional[List[int]] = None
+) -> Iterator[str]:
+    """
+    Lazily yield the windows split_text_by_tokens would return
+    Only one decoded chunk is alive at a time
+    Pass tokens (from try_encode) to reuse an encoding the caller already has
+    """
+    enc = get_encoding()
+    if enc is None:
+        yield from iter_text_chunks_approx(text, chunk_tokens, _token_per_char)
+        return
+    if not text:
+        return
+    
+    if tokens is None:
+        tokens = encode(text)
+    step = max(1, chunk_tokens - overlap_tokens)
+    for start in range(0, len(tokens), step):
+        chunk = enc.decode(tokens[start:start + chunk_tokens]).strip()
+        if chunk:
+            yield chunk
+        if start + chunk_tokens >= len(tokens):
+            break
@@ -2,9 +2,10 @@
 AI Study Assistant Backend - FastAPI Application
 Provides grounded document processing, exam generation, and AI tutoring
 """
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Header, Response
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Header, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Date, text, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
@@ -15,10 +16,10 @@ import bcrypt
 from jose import jwt, JWTError
 import os
 import re
-import requests
 from collections import defaultdict
 import stripe
 import time
+import threading
 from dotenv import load_dotenv
 import io
 from docx import Document
@@ -28,6 +29,10 @@ from PyPDF2 import PdfReader
 # Load environment variables from .env file
 load_dotenv()
 
+# Service logs (app.*) go through a queue-backed logger
+from app.logging_config import setup_logging
+setup_logging()
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -463,6 +468,10 @@ except Exception as e:
     traceback.print_exc()
     # Don't crash the app - migration can be run manually later
 
+# Open the first pooled OpenAI connection now rather than on the first user request
+from app.services.openai_client import warm_http_session
+warm_http_session(OPENAI_API_KEY)
+
 # ============================================================================
 # FASTAPI APP
 # ============================================================================
@@ -851,14 +860,15 @@ def extract_text_from_file(file_content: bytes, filename: str, mime: str) -> str
 
 def call_openai_with_context(file_contents: List[str], prompt: str, temperature: float = 0.0, model: str = "gpt-4o-mini", max_tokens: int = 4000, user_id: Optional[int] = None, endpoint: str = "unknown", db: Optional[Session] = None) -> str:
     """Call OpenAI API with file contents included in the prompt. Returns response text."""
+    from app.services.openai_client import get_http_session, json_headers, OPENAI_CHAT_URL
+    from app.utils import json_codec
+    
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OpenAI API key not configured")
     
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # Pooled keep-alive session: repeat calls skip the TCP+TLS handshake
+    url = OPENAI_CHAT_URL
+    headers = json_headers(OPENAI_API_KEY)
     
     # Build messages with system and user roles
     messages = []
@@ -894,12 +904,12 @@ def call_openai_with_context(file_contents: List[str], prompt: str, temperature:
         "max_tokens": max_tokens
     }
     
-    response = requests.post(url, headers=headers, json=payload, timeout=60)
+    response = get_http_session().post(url, headers=headers, data=json_codec.dumps(payload), timeout=60)
     
     if response.status_code != 200:
         raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {response.text}")
     
-    response_data = response.json()
+    response_data = json_codec.loads(response.content)
     content = response_data["choices"][0]["message"]["content"]
     usage = response_data.get("usage", {})
     
@@ -1386,10 +1396,369 @@ async def upload_files(
 # ============================================================================
 # GROUNDED ENDPOINTS
 # ============================================================================
+def _generate_file_summary(
+    merged_text: str,
+    language: str,
+    additional_instructions: str,
+    out_cap: int,
+    force_map_reduce: bool,
+    user_id: Optional[int],
+    plan: str,
+    cache_key: str,
+    estimated_tokens: int,
+    num_files: int,
+    db: Session,
+    map_mode: str = "interactive"
+) -> dict:
+    """
+    Generate, validate and self-repair a summary for merged file text,
+    then record telemetry and store it in the summary cache.
+    Shared by /summarize-from-files and background stale-cache refreshes.
+    map_mode is passed to map_reduce_summary ("bulk" = OpenAI Batch API).
+    """
+    from app.services.cache import set_cached
+    from app.services.summary import map_reduce_summary
+    import json
+    from app.utils.json_helpers import parse_json_robust, create_error_response
+    from app.utils.quality import enforce_exam_ready, validate_summary_completeness, calculate_comprehensive_quality_score
+    from app.services.summary import quality_score_legacy
+    
+    # Track generation start time
+    generation_start = time.time()
+    
+    # Use map-reduce pipeline; failed MAP calls leave it partial (not cached)
+    map_warnings = []
+    result_json = map_reduce_summary(
+        full_text=merged_text,
+        language=language,
+        additional_instructions=additional_instructions,
+        out_cap=out_cap,
+        force_chunking=force_map_reduce,
+        user_id=user_id,
+        db=db,
+        mode=map_mode,
+        warnings=map_warnings
+    )
+    
+    # Parse JSON with robust error handling
+    try:
+        result = parse_json_robust(result_json)
+        print("[SUMMARY] JSON parsed successfully")
+        
+        # Ensure result has the correct structure: {summary: {...}, citations: [...]}
+        # If result doesn't have 'summary' key, it might be the summary object itself
+        if "summary" not in result:
+            print("[SUMMARY] Result doesn't have 'summary' key, checking structure...")
+            print(f"[SUMMARY] Result keys: {list(result.keys())}")
+            
+            # Check if it has learning_objectives or core_concepts (common AI output formats)
+            has_learning_objectives = "learning_objectives" in result
+            has_core_concepts = "core_concepts" in result
+            has_title = "title" in result
+            has_sections = "sections" in result
+            
+            # PRIORITY 1: Transform core_concepts into sections if needed (most common issue)
+            if has_core_concepts and not has_sections:
+                print("[SUMMARY] Found core_concepts, transforming to sections structure...")
+                # Convert core_concepts to sections format
+                sections = []
+                for idx, concept in enumerate(result.get("core_concepts", [])):
+                    # If concept is a dict with 'concept' key (old format), transform it
+                    if isinstance(concept, dict):
+                        concept_term = concept.get("concept", concept.get("term", f"Concept {idx + 1}"))
+                        concept_explanation = concept.get("explanation", "")
+                        concept_examples = concept.get("examples", [])
+                        
+                        # Extract definition from explanation if not provided
+                        definition = concept.get("definition", "")
+                        if not definition and concept_explanation:
+                            # Use first sentence as definition
+                            sentences = concept_explanation.split(".")
+                            definition = sentences[0].strip() + "." if sentences[0].strip() else concept_explanation[:100]
+                        
+                        # Extract example
+                        example = ""
+                        if concept_examples:
+                            if isinstance(concept_examples[0], dict):
+                                example = concept_examples[0].get("example", "")
+                            elif isinstance(concept_examples[0], str):
+                                example = concept_examples[0]
+                        
+                        # Create a section for this concept
+                        section = {
+                            "heading": concept_term,
+                            "concepts": [{
+                                "term": concept_term,
+                                "definition": definition or concept_term,
+                                "explanation": concept_explanation or definition,
+                                "example": example,
+                                "key_points": concept.get("key_points", []) if isinstance(concept.get("key_points"), list) else []
+                            }]
+                        }
+                        sections.append(section)
+                    else:
+                        # If concept is a string or other format, create a basic section
+                        sections.append({
+                            "heading": f"Concept {idx + 1}",
+                            "concepts": [{
+                                "term": str(concept)[:50],
+                                "definition": str(concept),
+                                "explanation": str(concept),
+                                "key_points": []
+                            }]
+                        })
+                
+                # Create proper summary structure
+                result = {
+                    "summary": {
+                        "title": result.get("title", "Summary"),
+                        "overview": result.get("overview", ""),
+                        "learning_objectives": result.get("learning_objectives", []),
+                        "sections": sections,
+                        "formula_sheet": result.get("formula_sheet", []),
+                        "glossary": result.get("glossary", [])
+                    },
+                    "citations": result.get("citations", [])
+                }
+                print(f"[SUMMARY] Transformed to sections structure with {len(sections)} sections")
+            
+            # PRIORITY 2: Check if it looks like a summary object (has title or sections)
+            elif has_title or has_sections:
+                # It's the summary object itself, wrap it
+                print("[SUMMARY] Result is summary object, wrapping it")
+                result = {
+                    "summary": result,
+                    "citations": result.get("citations", [])
+                }
+            else:
+                # Unknown structure - check if it's a dict that might contain the summary
+                print(f"[SUMMARY] Unknown result structure: {list(result.keys())}")
+                # Try to see if it's a string representation of the summary
+                if len(result) == 1 and isinstance(list(result.values())[0], str):
+                    # Might be a stringified JSON
+                    try:
+                        import json
+                        parsed = json.loads(list(result.values())[0])
+                        if "summary" in parsed or "sections" in parsed or "learning_objectives" in parsed:
+                            result = parsed
+                            if "summary" not in result:
+                                result = {"summary": result, "citations": []}
+                    except:
+                        pass
+                
+                # If still not valid, create error response
+                if "summary" not in result:
+                    print(f"[SUMMARY] Creating error response for invalid structure")
+                    result = create_error_response(
+                        f"Unexpected response structure. Keys: {list(result.keys())}. Expected: summary with sections, or learning_objectives/core_concepts.",
+                        len(result_json)
+                    )
+        else:
+            # Ensure citations exist
+            if "citations" not in result:
+                result["citations"] = []
+                
+    except ValueError as e:
+        print(f"[SUMMARY] All JSON parse attempts failed: {e}")
+        result = create_error_response(
+            "Failed to parse AI response. This may be due to response format issues.",
+            len(result_json)
+        )
+    
+    # Calculate comprehensive quality score - ensure summary exists
+    if "summary" not in result:
+        print("[SUMMARY ERROR] Result still doesn't have 'summary' key after normalization")
+        result = create_error_response("Internal error: summary structure invalid", 0)
+    
+    quality_metrics = calculate_comprehensive_quality_score(result)
+    score = quality_metrics.get("final_ready_score", 0.5)
+    is_final_ready = quality_metrics.get("is_final_ready", False)
+    
+    print(f"[QUALITY METRICS] Final-ready score: {score}/1.0 (target: 0.90+)")
+    print(f"[QUALITY METRICS] Coverage: {quality_metrics.get('coverage_score', 0)}, " +
+          f"Numeric density: {quality_metrics.get('numeric_density', 0)}, " +
+          f"Formula completeness: {quality_metrics.get('formula_completeness', 0)}, " +
+          f"Citation depth: {quality_metrics.get('citation_depth', 0)}, " +
+          f"Readability: {quality_metrics.get('readability_score', 0)}")
+    print(f"[QUALITY METRICS] Domain: {quality_metrics.get('domain', 'unknown')}, " +
+          f"Is final-ready: {is_final_ready}")
+    
+    # Enforce exam-ready quality standards
+    result = enforce_exam_ready(result, detected_themes=None)
+    
+    # POST-PROCESSING VALIDATION
+    from app.utils.quality import create_self_repair_prompt, validate_summary_completeness, validate_and_enhance_quality
+    from app.services.summary import call_openai, SYSTEM_PROMPT, JSON_MODE
+    
+    # Step 1: Enhance and validate
+    result, repair_prompts = validate_and_enhance_quality(result)
+    print(f"[POST-PROCESSING] Auto-enhancements applied, {len(repair_prompts)} repair prompts generated")
+    
+    # Step 2: Completeness check
+    warnings, needs_repair = validate_summary_completeness(result)
+    
+    if warnings:
+        print(f"[SUMMARY QUALITY] Warnings ({len(warnings)}): {warnings}")
+    
+    # Track self-repair metrics
+    self_repair_triggered = False
+    self_repair_improvement = None
+    
+    # Step 3: Trigger self-repair if needed
+    if (repair_prompts or needs_repair) and score < 0.7:
+        self_repair_triggered = True
+        
+        # Combine all repair prompts
+        combined_repairs = []
+        if repair_prompts:
+            combined_repairs.extend(repair_prompts)
+        if needs_repair and warnings:
+            combined_repairs.append(create_self_repair_prompt(result, warnings, language))
+        
+        repair_instruction = "\n\n---\n\n".join(combined_repairs)
+        print(f"[SELF-REPAIR] Triggering repair (score: {score}, {len(combined_repairs)} issues)")
+        
+        try:
+            repaired_json = call_openai(
+                system_prompt=SYSTEM_PROMPT,
+                user_prompt=f"Fix the following issues in this summary:\n\n{repair_instruction}",
+                max_output_tokens=min(out_cap, 8000),
+                retry_on_length=False,
+                response_format=JSON_MODE
+            )
+            
+            # Try to parse repaired output
+            try:
+                repaired_result = parse_json_robust(repaired_json)
+                
+                # Ensure repaired_result has correct structure
+                if "summary" not in repaired_result:
+                    if "title" in repaired_result or "sections" in repaired_result:
+                        repaired_result = {
+                            "summary": repaired_result,
+                            "citations": repaired_result.get("citations", [])
+                        }
+                    else:
+                        print(f"[SELF-REPAIR] Repaired result has invalid structure, keeping original")
+                        repaired_result = result
+                elif "citations" not in repaired_result:
+                    repaired_result["citations"] = []
+                
+                # Check if repair improved quality
+                repaired_metrics = calculate_comprehensive_quality_score(repaired_result)
+                repaired_score = repaired_metrics.get("final_ready_score", 0.5)
+                print(f"[SELF-REPAIR] Score after repair: {repaired_score}/1.0")
+                
+                if repaired_score > score:
+                    self_repair_improvement = repaired_score - score
+                    print(f"[SELF-REPAIR] Accepted (improvement: +{self_repair_improvement:.2f})")
+                    result = repaired_result
+                    score = repaired_score
+                else:
+                    print(f"[SELF-REPAIR] Rejected (no improvement)")
+            except Exception as e:
+                print(f"[SELF-REPAIR] Parse failed: {e}, keeping original")
+        except Exception as e:
+            print(f"[SELF-REPAIR] Failed: {e}, keeping original")
+    
+    # Calculate generation time and metrics
+    generation_time = time.time() - generation_start
+    
+    # Extract quality metrics for telemetry
+    summary = result.get("summary", {})
+    num_concepts = sum(len(sec.get("concepts", [])) for sec in summary.get("sections", []))
+    num_formulas = len(summary.get("formula_sheet", []))
+    num_exam_questions = 0
+    num_glossary = len(summary.get("glossary", []))
+    
+    # Record telemetry (non-blocking)
+    try:
+        from app.services.telemetry import record_summary_quality
+        from app.services.summary import detect_domain
+        
+        # Detect domain from original text
+        domain = detect_domain(merged_text)
+        
+        # Estimate total tokens used
+        total_tokens_used = estimated_tokens + out_cap
+        
+        record_summary_quality(
+            db=db,
+            request_hash=cache_key,
+            user_id=user_id,
+            plan=plan,
+            domain=domain,
+            language=language,
+            input_tokens=estimated_tokens,
+            num_chunks=num_files,
+            quality_score=score,
+            num_concepts=num_concepts,
+            num_formulas=num_formulas,
+            num_exam_questions=num_exam_questions,
+            num_glossary_terms=num_glossary,
+            self_repair_triggered=self_repair_triggered,
+            self_repair_improvement=self_repair_improvement,
+            total_tokens_used=total_tokens_used,
+            generation_time_seconds=generation_time,
+            warnings=map_warnings + warnings,
+            coverage_score=quality_metrics.get('coverage_score'),
+            numeric_density=quality_metrics.get('numeric_density'),
+            formula_completeness=quality_metrics.get('formula_completeness'),
+            citation_depth=quality_metrics.get('citation_depth'),
+            readability_score=quality_metrics.get('readability_score'),
+            is_final_ready=is_final_ready
+        )
+    except Exception as telemetry_error:
+        print(f"[TELEMETRY WARNING] Failed to record: {telemetry_error}")
+    
+    # Final validation: ensure result has correct structure before returning
+    if "summary" not in result:
+        print("[SUMMARY ERROR] Final validation failed: result missing 'summary' key")
+        result = create_error_response("Internal error: invalid summary structure", 0)
+    elif "citations" not in result:
+        result["citations"] = []
+    
+    if map_warnings:
+        result["warnings"] = map_warnings
+        print(f"[SUMMARY] Partial result, not caching: {map_warnings}")
+    # Cache the result (only if complete and not an error)
+    elif "error" not in result.get("summary", {}).get("title", "").lower():
+        set_cached(cache_key, json.dumps(result), db)
+    
+    print(f"[SUMMARY] Result structure: summary={bool(result.get('summary'))}, citations={bool(result.get('citations'))}")
+    return result
+
+
+# Cache keys with a background refresh in progress (avoids duplicate regenerations)
+_revalidating_keys = set()
+_revalidating_lock = threading.Lock()
+
+
+def _revalidate_summary(cache_key: str, **generate_kwargs) -> None:
+    """Regenerate a stale cached summary in the background with its own DB session"""
+    with _revalidating_lock:
+        if cache_key in _revalidating_keys:
+            return
+        _revalidating_keys.add(cache_key)
+    
+    from app.config import CACHE_REVALIDATE_MAP_MODE
+    
+    db = SessionLocal()
+    try:
+        print(f"[CACHE REVALIDATE] Refreshing stale summary {cache_key[:12]}...")
+        _generate_file_summary(cache_key=cache_key, db=db, map_mode=CACHE_REVALIDATE_MAP_MODE, **generate_kwargs)
+    except Exception as e:
+        print(f"[CACHE REVALIDATE] Refresh failed for {cache_key[:12]}: {e}")
+    finally:
+        db.close()
+        with _revalidating_lock:
+            _revalidating_keys.discard(cache_key)
+
 @app.post("/summarize-from-files")
 async def summarize_from_files(
     request: Request,
     req: SummarizeRequest,
+    background_tasks: BackgroundTasks,
     current_user: Optional[User] = Depends(get_optional_user),
     db: Session = Depends(get_db)
 ):
@@ -1403,15 +1772,15 @@ async def summarize_from_files(
     rate_limit(request)
     
     # Import new modular services
-    from app.config import PLAN_LIMITS, ALLOWED_EXTS, TOKEN_PER_CHAR
+    from app.config import PLAN_LIMITS, ALLOWED_EXTS
     from app.utils.files import (
-        ext_ok, pdf_page_count, approx_tokens_from_text_len,
-        sha256_bytes, choose_max_output_tokens, validate_mime_type, basic_antivirus_check
+        ext_ok, pdf_page_count,
+        sha256_bytes_memo, request_hash, choose_max_output_tokens, validate_mime_type, basic_antivirus_check
     )
-    from app.services.cache import get_cached, set_cached
-    from app.services.summary import map_reduce_summary, summarize_no_files
+    from app.services.cache import get_cached_entry
+    from app.services.summary import summarize_no_files
+    from app.utils.tokens import count_tokens
     import json
-    import hashlib
     
     # Determine user's plan
     plan = getattr(current_user, "tier", "free") if current_user else "free"
@@ -1428,7 +1797,8 @@ async def summarize_from_files(
     if not req.file_ids:
         try:
             language = req.language or "en"
-            result_json = summarize_no_files(
+            result_json = await run_in_threadpool(
+                summarize_no_files,
                 topic=req.prompt,
                 language=language,
                 out_cap=limits.max_output_cap,
@@ -1545,6 +1915,7 @@ async def summarize_from_files(
     
     # Fetch and validate files
     files_data = []  # [(filename, content_bytes, text_content)]
+    file_hashes = []  # Content SHA256 per file (memoized per file_id)
     total_mb = 0.0
     total_pages = 0
     pdf_count = 0
@@ -1587,6 +1958,7 @@ async def summarize_from_files(
             raise HTTPException(status_code=400, detail=f"File failed security check: {filename}")
         
         files_data.append((filename, content_bytes, text_content))
+        file_hashes.append(sha256_bytes_memo(file_id, content_bytes))
     
     # ========== LIMIT CHECKS ==========
     if len(files_data) > limits.max_files_total:
@@ -1610,8 +1982,9 @@ async def summarize_from_files(
     # Merge all text content
     merged_text = "\n\n".join([text for _, _, text in files_data if text])
     
-    # Token estimation
-    estimated_tokens = approx_tokens_from_text_len(len(merged_text), TOKEN_PER_CHAR)
+    # Token count (exact with tiktoken): decides the hard cap and whether to force map-reduce,
+    # where a ±30% char-based guess picks the wrong path for documents near the thresholds
+    estimated_tokens = count_tokens(merged_text)
     
     # Hard cap to prevent abuse (5x plan limit)
     HARD_CAP = limits.max_input_tokens * 5
@@ -1633,332 +2006,49 @@ async def summarize_from_files(
     # ========== CACHE CHECK ==========
     # Create cache key from: plan, language, prompt, file hashes, out_cap, model
     from app.config import OPENAI_MODEL
-    cache_key_data = {
-        "plan": plan,
-        "language": req.language or "en",
-        "prompt": (req.prompt or "")[:1000],  # Limit prompt length in cache key
-        "out_cap": out_cap,
-        "model": OPENAI_MODEL,
-        "file_hashes": [sha256_bytes(content) for _, content, _ in files_data]
-    }
-    cache_key = hashlib.sha256(
-        json.dumps(cache_key_data, sort_keys=True).encode()
-    ).hexdigest()
+    cache_key = request_hash(
+        (
+            plan,
+            req.language or "en",
+            (req.prompt or "")[:1000],  # Limit prompt length in cache key
+            str(out_cap),
+            OPENAI_MODEL,
+        ),
+        file_hashes
+    )
     
-    # Check cache
-    cached_result = get_cached(cache_key, db)
-    if cached_result:
-        print(f"[CACHE HIT] Returning cached summary for {cache_key[:12]}...")
-        return json.loads(cached_result)
+    generate_kwargs = dict(
+        merged_text=merged_text,
+        language=req.language or "en",
+        additional_instructions=req.prompt or "",
+        out_cap=out_cap,
+        force_map_reduce=force_map_reduce,
+        user_id=current_user.id if current_user else None,
+        plan=plan,
+        estimated_tokens=estimated_tokens,
+        num_files=len(files_data)
+    )
+    
+    # Check cache (stale-while-revalidate: expired entries within the grace
+    # window are served immediately and refreshed in the background)
+    cached = get_cached_entry(cache_key, db)
+    if cached:
+        cached_result, is_stale = cached
+        if is_stale:
+            print(f"[CACHE STALE] Serving stale summary for {cache_key[:12]}, refreshing in background")
+            background_tasks.add_task(_revalidate_summary, cache_key, **generate_kwargs)
+        else:
+            print(f"[CACHE HIT] Returning cached summary for {cache_key[:12]}...")
+        # Stored bytes are already the JSON body: no parse/re-serialize round-trip
+        return Response(content=cached_result, media_type="application/json")
     
     # ========== GENERATE SUMMARY ==========
     print(f"[CACHE MISS] Generating new summary (estimated={estimated_tokens} tokens, out_cap={out_cap}, force_map_reduce={force_map_reduce})...")
     
     try:
-        from app.utils.json_helpers import parse_json_robust, create_error_response
-        from app.utils.quality import enforce_exam_ready, validate_summary_completeness, calculate_comprehensive_quality_score
-        from app.services.summary import quality_score_legacy
-        
-        language = req.language or "en"
-        additional_instructions = req.prompt or ""
-        
-        # Track generation start time
-        generation_start = time.time()
-        
-        # Use map-reduce pipeline
-        result_json = map_reduce_summary(
-            full_text=merged_text,
-            language=language,
-            additional_instructions=additional_instructions,
-            out_cap=out_cap,
-            force_chunking=force_map_reduce,
-            user_id=current_user.id if current_user else None,
-            db=db
-        )
-        
-        # Parse JSON with robust error handling
-        try:
-            result = parse_json_robust(result_json)
-            print("[SUMMARY] JSON parsed successfully")
-            
-            # Ensure result has the correct structure: {summary: {...}, citations: [...]}
-            # If result doesn't have 'summary' key, it might be the summary object itself
-            if "summary" not in result:
-                print("[SUMMARY] Result doesn't have 'summary' key, checking structure...")
-                print(f"[SUMMARY] Result keys: {list(result.keys())}")
-                
-                # Check if it has learning_objectives or core_concepts (common AI output formats)
-                has_learning_objectives = "learning_objectives" in result
-                has_core_concepts = "core_concepts" in result
-                has_title = "title" in result
-                has_sections = "sections" in result
-                
-                # PRIORITY 1: Transform core_concepts into sections if needed (most common issue)
-                if has_core_concepts and not has_sections:
-                    print("[SUMMARY] Found core_concepts, transforming to sections structure...")
-                    # Convert core_concepts to sections format
-                    sections = []
-                    for idx, concept in enumerate(result.get("core_concepts", [])):
-                        # If concept is a dict with 'concept' key (old format), transform it
-                        if isinstance(concept, dict):
-                            concept_term = concept.get("concept", concept.get("term", f"Concept {idx + 1}"))
-                            concept_explanation = concept.get("explanation", "")
-                            concept_examples = concept.get("examples", [])
-                            
-                            # Extract definition from explanation if not provided
-                            definition = concept.get("definition", "")
-                            if not definition and concept_explanation:
-                                # Use first sentence as definition
-                                sentences = concept_explanation.split(".")
-                                definition = sentences[0].strip() + "." if sentences[0].strip() else concept_explanation[:100]
-                            
-                            # Extract example
-                            example = ""
-                            if concept_examples:
-                                if isinstance(concept_examples[0], dict):
-                                    example = concept_examples[0].get("example", "")
-                                elif isinstance(concept_examples[0], str):
-                                    example = concept_examples[0]
-                            
-                            # Create a section for this concept
-                            section = {
-                                "heading": concept_term,
-                                "concepts": [{
-                                    "term": concept_term,
-                                    "definition": definition or concept_term,
-                                    "explanation": concept_explanation or definition,
-                                    "example": example,
-                                    "key_points": concept.get("key_points", []) if isinstance(concept.get("key_points"), list) else []
-                                }]
-                            }
-                            sections.append(section)
-                        else:
-                            # If concept is a string or other format, create a basic section
-                            sections.append({
-                                "heading": f"Concept {idx + 1}",
-                                "concepts": [{
-                                    "term": str(concept)[:50],
-                                    "definition": str(concept),
-                                    "explanation": str(concept),
-                                    "key_points": []
-                                }]
-                            })
-                    
-                    # Create proper summary structure
-                    result = {
-                        "summary": {
-                            "title": result.get("title", "Summary"),
-                            "overview": result.get("overview", ""),
-                            "learning_objectives": result.get("learning_objectives", []),
-                            "sections": sections,
-                            "formula_sheet": result.get("formula_sheet", []),
-                            "glossary": result.get("glossary", [])
-                        },
-                        "citations": result.get("citations", [])
-                    }
-                    print(f"[SUMMARY] Transformed to sections structure with {len(sections)} sections")
-                
-                # PRIORITY 2: Check if it looks like a summary object (has title or sections)
-                elif has_title or has_sections:
-                    # It's the summary object itself, wrap it
-                    print("[SUMMARY] Result is summary object, wrapping it")
-                    result = {
-                        "summary": result,
-                        "citations": result.get("citations", [])
-                    }
-                else:
-                    # Unknown structure - check if it's a dict that might contain the summary
-                    print(f"[SUMMARY] Unknown result structure: {list(result.keys())}")
-                    # Try to see if it's a string representation of the summary
-                    if len(result) == 1 and isinstance(list(result.values())[0], str):
-                        # Might be a stringified JSON
-                        try:
-                            import json
-                            parsed = json.loads(list(result.values())[0])
-                            if "summary" in parsed or "sections" in parsed or "learning_objectives" in parsed:
-                                result = parsed
-                                if "summary" not in result:
-                                    result = {"summary": result, "citations": []}
-                        except:
-                            pass
-                    
-                    # If still not valid, create error response
-                    if "summary" not in result:
-                        print(f"[SUMMARY] Creating error response for invalid structure")
-                        result = create_error_response(
-                            f"Unexpected response structure. Keys: {list(result.keys())}. Expected: summary with sections, or learning_objectives/core_concepts.",
-                            len(result_json)
-                        )
-            else:
-                # Ensure citations exist
-                if "citations" not in result:
-                    result["citations"] = []
-                    
-        except ValueError as e:
-            print(f"[SUMMARY] All JSON parse attempts failed: {e}")
-            result = create_error_response(
-                "Failed to parse AI response. This may be due to response format issues.",
-                len(result_json)
-            )
-        
-        # Calculate comprehensive quality score - ensure summary exists
-        if "summary" not in result:
-            print("[SUMMARY ERROR] Result still doesn't have 'summary' key after normalization")
-            result = create_error_response("Internal error: summary structure invalid", 0)
-        
-        quality_metrics = calculate_comprehensive_quality_score(result)
-        score = quality_metrics.get("final_ready_score", 0.5)
-        is_final_ready = quality_metrics.get("is_final_ready", False)
-        
-        print(f"[QUALITY METRICS] Final-ready score: {score}/1.0 (target: 0.90+)")
-        print(f"[QUALITY METRICS] Coverage: {quality_metrics.get('coverage_score', 0)}, " +
-              f"Numeric density: {quality_metrics.get('numeric_density', 0)}, " +
-              f"Formula completeness: {quality_metrics.get('formula_completeness', 0)}, " +
-              f"Citation depth: {quality_metrics.get('citation_depth', 0)}, " +
-              f"Readability: {quality_metrics.get('readability_score', 0)}")
-        print(f"[QUALITY METRICS] Domain: {quality_metrics.get('domain', 'unknown')}, " +
-              f"Is final-ready: {is_final_ready}")
-        
-        # Enforce exam-ready quality standards
-        result = enforce_exam_ready(result, detected_themes=None)
-        
-        # POST-PROCESSING VALIDATION
-        from app.utils.quality import create_self_repair_prompt, validate_summary_completeness, validate_and_enhance_quality
-        from app.services.summary import call_openai, SYSTEM_PROMPT
-        
-        # Step 1: Enhance and validate
-        result, repair_prompts = validate_and_enhance_quality(result)
-        print(f"[POST-PROCESSING] Auto-enhancements applied, {len(repair_prompts)} repair prompts generated")
-        
-        # Step 2: Completeness check
-        warnings, needs_repair = validate_summary_completeness(result)
-        
-        if warnings:
-            print(f"[SUMMARY QUALITY] Warnings ({len(warnings)}): {warnings}")
-        
-        # Track self-repair metrics
-        self_repair_triggered = False
-        self_repair_improvement = None
-        
-        # Step 3: Trigger self-repair if needed
-        if (repair_prompts or needs_repair) and score < 0.7:
-            self_repair_triggered = True
-            
-            # Combine all repair prompts
-            combined_repairs = []
-            if repair_prompts:
-                combined_repairs.extend(repair_prompts)
-            if needs_repair and warnings:
-                combined_repairs.append(create_self_repair_prompt(result, warnings, language))
-            
-            repair_instruction = "\n\n---\n\n".join(combined_repairs)
-            print(f"[SELF-REPAIR] Triggering repair (score: {score}, {len(combined_repairs)} issues)")
-            
-            try:
-                repaired_json = call_openai(
-                    system_prompt=SYSTEM_PROMPT,
-                    user_prompt=f"Fix the following issues in this summary:\n\n{repair_instruction}",
-                    max_output_tokens=min(out_cap, 8000),
-                    retry_on_length=False
-                )
-                
-                # Try to parse repaired output
-                try:
-                    repaired_result = parse_json_robust(repaired_json)
-                    
-                    # Ensure repaired_result has correct structure
-                    if "summary" not in repaired_result:
-                        if "title" in repaired_result or "sections" in repaired_result:
-                            repaired_result = {
-                                "summary": repaired_result,
-                                "citations": repaired_result.get("citations", [])
-                            }
-                        else:
-                            print(f"[SELF-REPAIR] Repaired result has invalid structure, keeping original")
-                            repaired_result = result
-                    elif "citations" not in repaired_result:
-                        repaired_result["citations"] = []
-                    
-                    # Check if repair improved quality
-                    repaired_metrics = calculate_comprehensive_quality_score(repaired_result)
-                    repaired_score = repaired_metrics.get("final_ready_score", 0.5)
-                    print(f"[SELF-REPAIR] Score after repair: {repaired_score}/1.0")
-                    
-                    if repaired_score > score:
-                        self_repair_improvement = repaired_score - score
-                        print(f"[SELF-REPAIR] Accepted (improvement: +{self_repair_improvement:.2f})")
-                        result = repaired_result
-                        score = repaired_score
-                    else:
-                        print(f"[SELF-REPAIR] Rejected (no improvement)")
-                except Exception as e:
-                    print(f"[SELF-REPAIR] Parse failed: {e}, keeping original")
-            except Exception as e:
-                print(f"[SELF-REPAIR] Failed: {e}, keeping original")
-        
-        # Calculate generation time and metrics
-        generation_time = time.time() - generation_start
-        
-        # Extract quality metrics for telemetry
-        summary = result.get("summary", {})
-        num_concepts = sum(len(sec.get("concepts", [])) for sec in summary.get("sections", []))
-        num_formulas = len(summary.get("formula_sheet", []))
-        num_exam_questions = 0
-        num_glossary = len(summary.get("glossary", []))
-        
-        # Record telemetry (non-blocking)
-        try:
-            from app.services.telemetry import record_summary_quality
-            from app.services.summary import detect_domain
-            
-            # Detect domain from original text
-            domain = detect_domain(merged_text)
-            
-            # Estimate total tokens used
-            total_tokens_used = estimated_tokens + out_cap
-            
-            record_summary_quality(
-                db=db,
-                request_hash=cache_key,
-                user_id=current_user.id if current_user else None,
-                plan=plan,
-                domain=domain,
-                language=language,
-                input_tokens=estimated_tokens,
-                num_chunks=len(files_data),
-                quality_score=score,
-                num_concepts=num_concepts,
-                num_formulas=num_formulas,
-                num_exam_questions=num_exam_questions,
-                num_glossary_terms=num_glossary,
-                self_repair_triggered=self_repair_triggered,
-                self_repair_improvement=self_repair_improvement,
-                total_tokens_used=total_tokens_used,
-                generation_time_seconds=generation_time,
-                warnings=warnings,
-                coverage_score=quality_metrics.get('coverage_score'),
-                numeric_density=quality_metrics.get('numeric_density'),
-                formula_completeness=quality_metrics.get('formula_completeness'),
-                citation_depth=quality_metrics.get('citation_depth'),
-                readability_score=quality_metrics.get('readability_score'),
-                is_final_ready=is_final_ready
-            )
-        except Exception as telemetry_error:
-            print(f"[TELEMETRY WARNING] Failed to record: {telemetry_error}")
-        
-        # Final validation: ensure result has correct structure before returning
-        if "summary" not in result:
-            print("[SUMMARY ERROR] Final validation failed: result missing 'summary' key")
-            result = create_error_response("Internal error: invalid summary structure", 0)
-        elif "citations" not in result:
-            result["citations"] = []
-        
-        # Cache the result (only if not error)
-        if "error" not in result.get("summary", {}).get("title", "").lower():
-            set_cached(cache_key, json.dumps(result), db)
-        
-        print(f"[SUMMARY] Returning result with structure: summary={bool(result.get('summary'))}, citations={bool(result.get('citations'))}")
-        return result
+        # The MAP/REDUCE pipeline blocks for tens of seconds; keep it off the event loop
+        # so other requests are served while this document is summarized
+        return await run_in_threadpool(_generate_file_summary, cache_key=cache_key, db=db, **generate_kwargs)
         
     except Exception as e:
         import traceback
@@ -2033,7 +2123,8 @@ Output as JSON:
     
     try:
         user_id = current_user.id if current_user else None
-        response_text = call_openai_with_context(
+        response_text = await run_in_threadpool(
+            call_openai_with_context,
             file_contents, 
             f"{system_prompt}\n\n{user_prompt}", 
             temperature=0.0,
@@ -2156,7 +2247,8 @@ Return ONLY valid JSON, no markdown code blocks, no extra text."""
     
     try:
         user_id = current_user.id if current_user else None
-        response_text = call_openai_with_context(
+        response_text = await run_in_threadpool(
+            call_openai_with_context,
             file_contents, 
             f"{system_prompt}\n\n{user_prompt}", 
             temperature=0.0,
@@ -2320,7 +2412,8 @@ Cevap Anahtarı:
     
     try:
         user_id = current_user.id if current_user else None
-        response_text = call_openai_with_context(
+        response_text = await run_in_threadpool(
+            call_openai_with_context,
             file_contents, 
             f"{system_prompt}\n\n{user_prompt}", 
             temperature=0.0,
@@ -2415,7 +2508,8 @@ Cevap Anahtarı:
     
     try:
         user_id = current_user.id if current_user else None
-        response_text = call_openai_with_context(
+        response_text = await run_in_threadpool(
+            call_openai_with_context,
             [], 
             prompt, 
             temperature=0.0,
@@ -2499,7 +2593,8 @@ If it's study material, reference specific information from it.
     
     try:
         user_id = current_user.id if current_user else None
-        response_text = call_openai_with_context(
+        response_text = await run_in_threadpool(
+            call_openai_with_context,
             file_contents, 
             prompt, 
             temperature=0.2,
@@ -2559,7 +2654,8 @@ async def chat(
     
     try:
         user_id = current_user.id if current_user else None
-        response_text = call_openai_with_context(
+        response_text = await run_in_threadpool(
+            call_openai_with_context,
             file_contents, 
             conversation, 
             temperature=0.7,
@@ -3344,9 +3440,10 @@ async def clear_cache(
 ):
     """Clear all summary cache (admin only)"""
     try:
-        from app.services.cache import SummaryCache
+        from app.services.cache import SummaryCache, clear_memory_cache
         deleted = db.query(SummaryCache).delete()
         db.commit()
+        clear_memory_cache()
         return {"status": "success", "deleted": deleted, "message": "Cache cleared successfully"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
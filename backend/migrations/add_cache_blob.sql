@@ -0,0 +1,10 @@
+-- Migration: Store cached summaries compressed
+-- Purpose: summary_cache.result_blob holds zlib-compressed JSON; result_json is kept
+--          only so rows written before this change can still be read.
+-- Note: app/services/cache.py applies this automatically at import if the column is missing.
+
+-- For PostgreSQL (Railway/Supabase)
+ALTER TABLE summary_cache ADD COLUMN IF NOT EXISTS result_blob BYTEA;
+
+-- For SQLite (development)
+-- ALTER TABLE summary_cache ADD COLUMN result_blob BLOB;
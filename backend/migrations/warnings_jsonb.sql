@@ -0,0 +1,10 @@
+-- Migration: Store summary_quality.warnings as JSONB on PostgreSQL
+-- Purpose: binary JSON is decomposed once on write, cheaper to query, and GIN-indexable
+--          for warning-pattern reports (get_low_quality_patterns).
+
+-- For PostgreSQL (Railway/Supabase)
+ALTER TABLE summary_quality ALTER COLUMN warnings TYPE JSONB USING warnings::jsonb;
+CREATE INDEX IF NOT EXISTS ix_summary_quality_warnings ON summary_quality USING GIN (warnings);
+
+-- For SQLite (development)
+-- No change: SQLite stores JSON as TEXT regardless of the declared type.
@@ -0,0 +1,10 @@
+"""
+Shared test setup: point the database-backed services at a throwaway SQLite file
+"""
+import os
+import tempfile
+
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="studywithai-tests-"), "test.db")
+)
@@ -0,0 +1,34 @@
+"""
+Tests for input-size-aware MAP and REDUCE output budgets
+"""
+from app.config import CHUNK_OUTPUT_MIN, CHUNK_OUTPUT_MAX, MERGE_OUTPUT_BUDGET
+from app.utils.adaptive_budget import calculate_chunk_budget, calculate_merge_budget, max_reduce_inputs
+
+
+def test_short_chunks_get_proportional_budget():
+    assert calculate_chunk_budget("A tiny heading section.") == CHUNK_OUTPUT_MIN
+    long_chunk = "The theorem states that the equation holds for every n. " * 400
+    assert calculate_chunk_budget(long_chunk) == CHUNK_OUTPUT_MAX
+
+
+def test_chunk_budget_boosts_for_formulas_and_theorems():
+    from app.config import CHUNK_OUTPUT_BASE, CHUNK_OUTPUT_THEOREM_BOOST
+
+    filler = "Plain prose about the subject at hand. " * 600
+    assert calculate_chunk_budget(filler) == CHUNK_OUTPUT_BASE
+    assert calculate_chunk_budget(filler + "A Lemma follows.") == min(CHUNK_OUTPUT_BASE + CHUNK_OUTPUT_THEOREM_BOOST, CHUNK_OUTPUT_MAX)
+    assert calculate_chunk_budget(filler + "Solve x = 2. The proof is short.") == CHUNK_OUTPUT_MAX
+
+
+def test_merge_budget_scales_with_chunks_and_respects_caps():
+    assert calculate_merge_budget(1, 12000) == MERGE_OUTPUT_BUDGET[0]
+    assert calculate_merge_budget(10, 20000) == 8000
+    assert calculate_merge_budget(100, 20000) == MERGE_OUTPUT_BUDGET[1]
+    assert calculate_merge_budget(100, 6000) == 6000
+
+
+def test_reduce_capacity_reserves_prompt_and_output():
+    context = MERGE_OUTPUT_BUDGET[1] + 3000 + 10 * CHUNK_OUTPUT_MAX
+    assert max_reduce_inputs(3000, model_context=context) == 10
+    assert max_reduce_inputs(3000, model_context=context - 1) == 9
+    assert max_reduce_inputs(3000, model_context=MERGE_OUTPUT_BUDGET[1]) == 2
@@ -0,0 +1,197 @@
+"""
+Tests for the summary result cache
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from app.services import cache
+from app.services.cache import SummaryCache, get_cached, set_cached, cache_engine
+
+SessionLocal = sessionmaker(bind=cache_engine)
+
+
+def test_set_then_get_roundtrip():
+    db = SessionLocal()
+    try:
+        set_cached("hash-roundtrip", '{"summary": {}}', db)
+        assert get_cached("hash-roundtrip", db) == '{"summary": {}}'
+        assert get_cached("hash-missing", db) is None
+    finally:
+        db.close()
+
+
+def test_hits_are_batched_into_access_stats():
+    db = SessionLocal()
+    try:
+        set_cached("hash-hits", "{}", db)
+        for _ in range(3):
+            assert get_cached("hash-hits", db) == "{}"
+        cache._flush_hits()
+        db.expire_all()
+        entry = db.query(SummaryCache).filter_by(request_hash="hash-hits").one()
+        assert entry.access_count == 3
+    finally:
+        db.close()
+
+
+def test_expired_entries_are_not_returned():
+    db = SessionLocal()
+    try:
+        set_cached("hash-old", "{}", db)
+        entry = db.query(SummaryCache).filter_by(request_hash="hash-old").one()
+        entry.created_at = datetime.utcnow() - timedelta(days=30)
+        db.commit()
+        cache.clear_memory_cache()  # row was aged behind the in-process cache
+        assert get_cached("hash-old", db, ttl_seconds=60) is None
+    finally:
+        db.close()
+
+
+def test_hot_keys_are_served_from_memory(monkeypatch):
+    db = SessionLocal()
+    try:
+        set_cached("hash-hot", '{"hot": true}', db)
+        # Any DB access now would fail loudly; the in-process cache must answer
+        monkeypatch.setattr(cache, "_db_get", lambda *a, **k: (_ for _ in ()).throw(AssertionError("hit DB")))
+        assert get_cached("hash-hot", db) == '{"hot": true}'
+    finally:
+        db.close()
+
+
+def test_memory_cache_falls_back_to_db_after_clear():
+    db = SessionLocal()
+    try:
+        set_cached("hash-cold", "{}", db)
+        cache.clear_memory_cache()
+        assert get_cached("hash-cold", db) == "{}"
+        assert "hash-cold" in cache._mem_cache
+    finally:
+        db.close()
+
+
+def test_sweep_removes_only_expired_rows():
+    db = SessionLocal()
+    try:
+        set_cached("hash-sweep-old", "{}", db)
+        set_cached("hash-sweep-new", "{}", db)
+        entry = db.query(SummaryCache).filter_by(request_hash="hash-sweep-old").one()
+        entry.created_at = datetime.utcnow() - timedelta(days=30)
+        db.commit()
+        assert cache.delete_expired_entries(ttl_seconds=60) >= 1
+        remaining = {e.request_hash for e in db.query(SummaryCache).all()}
+        assert "hash-sweep-old" not in remaining
+        assert "hash-sweep-new" in remaining
+    finally:
+        db.close()
+
+
+def test_sweep_keeps_model_replies_for_their_longer_ttl():
+    db = SessionLocal()
+    try:
+        for key in ("hash-sweep-summary", "chunk:sweep-recent", "llm:sweep-ancient"):
+            set_cached(key, "{}", db)
+        ages = {"hash-sweep-summary": 20, "chunk:sweep-recent": 20, "llm:sweep-ancient": 40}
+        for key, days in ages.items():
+            entry = db.query(SummaryCache).filter_by(request_hash=key).one()
+            entry.created_at = datetime.utcnow() - timedelta(days=days)
+        db.commit()
+        cache.delete_expired_entries(ttl_seconds=14 * 86400, reply_ttl_seconds=30 * 86400)
+        remaining = {e.request_hash for e in db.query(SummaryCache).all()}
+        assert "chunk:sweep-recent" in remaining
+        assert "hash-sweep-summary" not in remaining
+        assert "llm:sweep-ancient" not in remaining
+    finally:
+        db.close()
+
+
+def test_results_are_stored_compressed_and_legacy_rows_still_read():
+    db = SessionLocal()
+    try:
+        payload = '{"summary": {"sections": [' + ",".join(['{"heading": "x"}'] * 200) + "]}}"
+        set_cached("hash-blob", payload, db)
+        entry = db.query(SummaryCache).filter_by(request_hash="hash-blob").one()
+        assert entry.result_json is None
+        assert len(entry.result_blob) < len(payload)
+
+        db.add(SummaryCache(request_hash="hash-legacy", result_json='{"legacy": 1}'))
+        db.commit()
+        cache.clear_memory_cache()
+        assert get_cached("hash-blob", db) == payload
+        assert get_cached("hash-legacy", db) == '{"legacy": 1}'
+    finally:
+        db.close()
+
+
+def test_set_cached_overwrites_existing_entry():
+    db = SessionLocal()
+    try:
+        set_cached("hash-upsert", '{"v": 1}', db)
+        get_cached("hash-upsert", db)
+        cache._flush_hits()
+        set_cached("hash-upsert", '{"v": 2}', db)
+        cache.clear_memory_cache()
+
+        assert get_cached("hash-upsert", db) == '{"v": 2}'
+        db.expire_all()
+        entries = db.query(SummaryCache).filter_by(request_hash="hash-upsert").all()
+        assert len(entries) == 1
+        assert cache._decompress(entries[0].result_blob) == b'{"v": 2}'
+    finally:
+        db.close()
+
+
+def test_sqlite_connections_use_wal():
+    with cache_engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar().lower() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+    cache._checkpoint_wal()
+
+
+def test_bytes_getter_returns_stored_json_bytes():
+    db = SessionLocal()
+    try:
+        set_cached("hash-bytes", '{"title": "Özet"}', db)
+        assert cache.get_cached_bytes("hash-bytes", db) == '{"title": "Özet"}'.encode("utf-8")
+        cache.clear_memory_cache()
+        assert cache.get_cached_bytes("hash-bytes", db) == '{"title": "Özet"}'.encode("utf-8")
+        assert get_cached("hash-bytes", db) == '{"title": "Özet"}'
+    finally:
+        db.close()
+
+
+def test_stale_entries_are_served_within_grace_window():
+    db = SessionLocal()
+    try:
+        set_cached("hash-stale", "{}", db)
+        entry = db.query(SummaryCache).filter_by(request_hash="hash-stale").one()
+        entry.created_at = datetime.utcnow() - timedelta(hours=2)
+        db.commit()
+        cache.clear_memory_cache()
+
+        assert cache.get_cached_entry("hash-stale", db, ttl_seconds=3600, stale_grace_seconds=7200) == (b"{}", True)
+        assert cache.get_cached_entry("hash-stale", db, ttl_seconds=3600, stale_grace_seconds=60) is None
+        assert cache.get_cached_entry("hash-stale", db, ttl_seconds=86400) == (b"{}", False)
+    finally:
+        db.close()
+
+
+def test_memory_cache_is_bounded_by_bytes_and_keeps_replies_apart(monkeypatch):
+    monkeypatch.setattr(cache, "_mem_cache", cache._MemoryLRU(max_entries=100, max_bytes=10))
+    monkeypatch.setattr(cache, "_reply_mem_cache", cache._MemoryLRU(max_entries=100, max_bytes=10))
+    now = datetime.utcnow()
+
+    cache._mem_put("summary-a", b"12345", now)
+    cache._mem_put("summary-b", b"12345", now)
+    cache._mem_put("summary-c", b"1234", now)  # Over 10 bytes: the oldest goes
+    assert "summary-a" not in cache._mem_cache and "summary-b" in cache._mem_cache
+    assert cache._mem_cache.size == 9
+
+    cache._mem_put("summary-big", b"x" * 11, now)  # Larger than the whole cap: DB only
+    assert "summary-big" not in cache._mem_cache and "summary-b" in cache._mem_cache
+
+    # A burst of MAP replies evicts other replies, never the full summaries
+    for n in range(5):
+        cache._mem_put("chunk:%d" % n, b"12345", now)
+    assert "chunk:4" in cache._reply_mem_cache and "chunk:0" not in cache._reply_mem_cache
+    assert "summary-b" in cache._mem_cache and "summary-c" in cache._mem_cache
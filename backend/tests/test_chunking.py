@@ -0,0 +1,34 @@
+"""
+Tests for text chunking utilities
+"""
+from app.utils.chunking import find_duplicate_chunks
+
+
+def test_exact_duplicates_ignore_case_and_whitespace():
+    chunks = ["Intro to graphs.\n\nNodes and edges.", "Other text here", "intro to  graphs. nodes AND edges."]
+    assert find_duplicate_chunks(chunks) == [None, None, 0]
+
+
+def test_near_duplicates_match_above_threshold():
+    base = " ".join(f"word{i}" for i in range(300))
+    near = base.replace("word150", "changed")  # one edit among 300 words
+    different = " ".join(f"other{i}" for i in range(300))
+
+    assert find_duplicate_chunks([base, near, different]) == [None, 0, None]
+    # Exact-only mode keeps the edited chunk
+    assert find_duplicate_chunks([base, near], threshold=1.0) == [None, None]
+
+
+def test_merge_texts_strips_and_skips_blank_entries():
+    from app.utils.chunking import merge_texts
+
+    assert merge_texts(["  a  ", "", "   ", "\nb\n"], separator="|") == "a|b"
+
+
+def test_duplicate_index_matches_batch_detection():
+    from app.utils.chunking import DuplicateChunkIndex, find_duplicate_chunks
+
+    chunks = ["alpha beta gamma delta epsilon zeta", "other text entirely here now", "Alpha  beta gamma delta epsilon ZETA"]
+    index = DuplicateChunkIndex(threshold=0.9)
+
+    assert [index.add(c) for c in chunks] == find_duplicate_chunks(chunks, threshold=0.9) == [None, None, 0]
@@ -0,0 +1,33 @@
+"""
+Tests for source-topic coverage validation
+"""
+from difflib import SequenceMatcher
+
+from app.utils import coverage_validator
+
+
+def test_topic_matching_agrees_with_pairwise_similarity():
+    source = ["Decision Trees", "Information Gain", "Markov chains", "Bayes Networks", "Pruning"]
+    summary = ["decision tree", "Information gain (IG)", "Bayesian networks"]
+
+    expected = [
+        any(SequenceMatcher(None, s.lower(), t.lower()).ratio() >= 0.7 for t in summary)
+        for s in source
+    ]
+    assert coverage_validator.match_source_topics(source, summary) == expected
+    assert coverage_validator.find_missing_topics(source, summary) == [
+        s for s, hit in zip(source, expected) if not hit
+    ]
+
+
+def test_validate_coverage_counts_each_topic_once():
+    text = "# Decision Trees\n\n# Markov Chains\n\n# Pruning Strategies\n"
+    summary = {"summary": {"sections": [{"heading": "Decision trees", "concepts": [{"term": "Markov chain"}]}]}}
+
+    result = coverage_validator.validate_coverage(text, summary)
+
+    assert result["total_source_topics"] == 3
+    assert result["matched_topics"] == 2
+    assert result["missing_topics"] == ["Pruning Strategies"]
+    assert abs(result["coverage_score"] - 2 / 3) < 1e-9
+    assert coverage_validator.calculate_coverage_score([], ["anything"]) == 1.0
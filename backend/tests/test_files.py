@@ -0,0 +1,21 @@
+"""
+Tests for file hashing helpers used to build summary cache keys
+"""
+from app.utils import files
+from app.utils.files import request_hash, sha256_bytes, sha256_bytes_memo
+
+
+def test_content_hash_is_memoized_per_file_id(monkeypatch):
+    data = b"lecture notes" * 1000
+    assert sha256_bytes_memo("file-memo", data) == sha256_bytes(data)
+
+    monkeypatch.setattr(files, "sha256_bytes", lambda d: (_ for _ in ()).throw(AssertionError("re-hashed")))
+    assert sha256_bytes_memo("file-memo", data) == files.hashlib.sha256(data).hexdigest()
+
+
+def test_request_hash_separates_fields():
+    base = request_hash(("pro", "en", "", "8000", "gpt-4o"), ["abc"])
+    assert base == request_hash(("pro", "en", "", "8000", "gpt-4o"), ["abc"])
+    # Field boundaries matter: moving characters between fields changes the key
+    assert base != request_hash(("pro", "en", "8", "000", "gpt-4o"), ["abc"])
+    assert base != request_hash(("pro", "en", "", "8000", "gpt-4o"), ["abd"])
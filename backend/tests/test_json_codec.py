@@ -0,0 +1,40 @@
+"""
+Tests for the orjson-backed JSON codec and its stdlib fallback
+"""
+import json
+
+import pytest
+
+from app.utils import json_codec
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_round_trip_keeps_unicode(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(json_codec, "orjson", None)
+    payload = {"messages": [{"role": "user", "content": "Özet: ∫ f(x) dx"}], "max_tokens": 10}
+
+    encoded = json_codec.dumps(payload)
+
+    assert isinstance(encoded, bytes)
+    assert "Özet".encode("utf-8") in encoded
+    assert json_codec.loads(encoded) == payload
+    assert json_codec.loads(encoded.decode("utf-8")) == payload
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_decode_errors_are_json_decode_errors(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(json_codec, "orjson", None)
+    with pytest.raises(json.JSONDecodeError):
+        json_codec.loads('{"unterminated": ')
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_text_matches_stdlib_layout(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(json_codec, "orjson", None)
+    payload = {"concepts": [{"term": "Özet", "n": 2}], "formulas": []}
+
+    assert json_codec.dumps_text(payload) == json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    assert json_codec.dumps_text(payload, indent=True) == json.dumps(payload, ensure_ascii=False, indent=2)
@@ -0,0 +1,32 @@
+"""
+Tests for the queue-backed logging setup
+"""
+import logging
+
+import pytest
+
+from app import logging_config
+
+
+@pytest.fixture
+def fresh_logging():
+    app_logger = logging.getLogger("app")
+    saved = (app_logger.handlers[:], app_logger.level, app_logger.propagate)
+    yield
+    logging_config._stop_listener()
+    logging_config._listener = None
+    app_logger.handlers[:], app_logger.level, app_logger.propagate = saved[0], saved[1], saved[2]
+
+
+def test_app_loggers_write_through_queue_listener(fresh_logging, capsys):
+    logging_config.setup_logging("INFO")
+    logging_config.setup_logging("DEBUG")  # Second call is a no-op
+
+    logger = logging.getLogger("app.services.summary")
+    logger.info("[MAP-REDUCE] Processing %s chunks", 3)
+    logger.debug("hidden")
+    logging_config._stop_listener()  # Drains the queue
+
+    out = capsys.readouterr().out
+    assert "[MAP-REDUCE] Processing 3 chunks\n" in out
+    assert "hidden" not in out
@@ -0,0 +1,714 @@
+"""
+Tests for the map-reduce summary pipeline (no network: OpenAI calls are stubbed)
+"""
+import re
+import threading
+import time
+
+import pytest
+
+from app.services import summary
+
+
+def _long_text(sections: int = 12) -> str:
+    """Build a document large enough to force several MAP chunks"""
+    parts = []
+    for i in range(sections):
+        parts.append(f"SECTION NUMBER {i}\n")
+        parts.append(("Sentence about topic %d with some detail. " % i) * 400)
+        parts.append("\n\n")
+    return "".join(parts)
+
+
+@pytest.fixture
+def capture_merge(monkeypatch):
+    """Stub the REDUCE entry point; returns what it was called with ("summaries" + kwargs)"""
+    captured = {}
+
+    def fake_merge_summaries(chunk_summaries, **kwargs):
+        captured.update(kwargs, summaries=chunk_summaries)
+        return "{}"
+
+    monkeypatch.setattr(summary, "merge_summaries", fake_merge_summaries)
+    return captured
+
+
+@pytest.fixture
+def capture_reduce(monkeypatch):
+    """Stub the two-stage REDUCE; returns the aggregated knowledge it received ("knowledge")"""
+    captured = {}
+
+    def fake_reduce_two_stage(aggregated_knowledge, **kwargs):
+        captured["knowledge"] = aggregated_knowledge
+        return {"summary": {}}
+
+    monkeypatch.setattr(summary, "reduce_two_stage", fake_reduce_two_stage)
+    return captured
+
+
+def test_map_phase_runs_in_parallel_and_keeps_order(monkeypatch, capture_merge):
+    """MAP calls overlap in time but summaries stay in chunk order"""
+    active = {"now": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def fake_summarize_chunk(chunk_text, **kwargs):
+        section = int(re.search(r"topic (\d+)", chunk_text).group(1))
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+        # Early chunks finish last so completion order differs from input order
+        time.sleep(0.1 / (section + 1))
+        with lock:
+            active["now"] -= 1
+        return str(section)
+
+    monkeypatch.setattr(summary, "summarize_chunk", fake_summarize_chunk)
+
+    text = _long_text()
+    summary.map_reduce_summary(text, force_chunking=True)
+
+    summaries = capture_merge["summaries"]
+    citations = capture_merge["chunk_citations"]
+    assert len(summaries) > 1
+    assert active["peak"] > 1
+    assert [int(s) for s in summaries] == sorted(int(s) for s in summaries)
+    assert [c["chunk_id"] for c in citations] == list(range(1, len(summaries) + 1))
+    assert citations[0]["char_start"] == 0
+    for prev, cur in zip(citations, citations[1:]):
+        assert cur["char_start"] == prev["char_end"]
+
+
+def test_failed_map_call_does_not_abort_reduce(monkeypatch, capture_merge):
+    """A chunk whose MAP call fails is reduced as empty; the rest still merge"""
+    def flaky_summarize_chunk(chunk_text, **kwargs):
+        section = int(re.search(r"topic (\d+)", chunk_text).group(1))
+        if section == 2:
+            raise RuntimeError("upstream 500")
+        return str(section)
+
+    monkeypatch.setattr(summary, "summarize_chunk", flaky_summarize_chunk)
+    warnings = []
+    summary.map_reduce_summary(_long_text(12), force_chunking=True, warnings=warnings)
+
+    summaries = capture_merge["summaries"]
+    assert summary._EMPTY_MAP_SUMMARY in summaries
+    assert "3" in summaries
+    # The caller learns the summary is partial (and must not cache it)
+    assert warnings == ["Partial summary: chunks [3] could not be summarized"]
+
+
+def test_map_phase_raises_when_too_many_calls_fail(monkeypatch):
+    def flaky_summarize_chunk(chunk_text, **kwargs):
+        if int(re.search(r"topic (\d+)", chunk_text).group(1)) in (2, 5):
+            raise RuntimeError("upstream 500")
+        return "{}"
+
+    monkeypatch.setattr(summary, "summarize_chunk", flaky_summarize_chunk)
+    monkeypatch.setattr(summary, "merge_summaries", lambda chunk_summaries, **kwargs: "{}")
+    with pytest.raises(RuntimeError):
+        summary.map_reduce_summary(_long_text(12), force_chunking=True)
+
+
+def test_map_phase_raises_when_every_call_fails(monkeypatch):
+    def failing_summarize_chunk(chunk_text, **kwargs):
+        raise RuntimeError("upstream 500")
+
+    monkeypatch.setattr(summary, "summarize_chunk", failing_summarize_chunk)
+    monkeypatch.setattr(summary, "merge_summaries", lambda chunk_summaries, **kwargs: "{}")
+    with pytest.raises(RuntimeError):
+        summary.map_reduce_summary(_long_text(4), force_chunking=True)
+
+
+def test_bulk_mode_sends_map_phase_through_batch_api(monkeypatch, capture_merge):
+    def fake_batch(chunks, **kwargs):
+        return ['{"concepts": [{"term": "batched %d"}]}' % i for i in range(len(chunks))]
+
+    def unexpected_sync_call(chunk_text, **kwargs):
+        raise AssertionError("bulk mode must not make per-chunk calls")
+
+    monkeypatch.setattr(summary, "summarize_chunks_batch", fake_batch)
+    monkeypatch.setattr(summary, "summarize_chunk", unexpected_sync_call)
+    summary.map_reduce_summary(_long_text(4), force_chunking=True, mode="bulk")
+
+    assert capture_merge["summaries"][0] == '{"concepts": [{"term": "batched 0"}]}'
+    with pytest.raises(ValueError):
+        summary.map_reduce_summary(_long_text(4), force_chunking=True, mode="offline")
+
+
+def test_map_replies_reach_reduce_already_parsed(monkeypatch, capture_merge):
+    """MAP replies are parsed as they arrive and handed to the REDUCE in chunk order"""
+    def fake_summarize_chunk(chunk_text, **kwargs):
+        section = int(re.search(r"topic (\d+)", chunk_text).group(1))
+        time.sleep(0.05 / (section + 1))
+        return '{"concepts": [{"term": "topic %d"}]}' % section if section != 1 else "not json"
+
+    monkeypatch.setattr(summary, "summarize_chunk", fake_summarize_chunk)
+    summary.map_reduce_summary(_long_text(4), force_chunking=True)
+
+    parsed = capture_merge["parsed_summaries"]
+    assert len(parsed) == len(capture_merge["summaries"])
+    for chunk_json, data in zip(capture_merge["summaries"], parsed):
+        if chunk_json == "not json":
+            assert data is None
+        else:
+            assert data == summary.json_codec.loads(chunk_json)
+
+
+def test_duplicate_chunks_are_summarized_once(monkeypatch, capture_merge):
+    """Repeated chunks reuse the first chunk's summary instead of another API call"""
+    calls = []
+
+    def fake_summarize_chunk(chunk_text, **kwargs):
+        calls.append(chunk_text)
+        return f"summary {len(calls)}"
+
+    monkeypatch.setattr(summary, "summarize_chunk", fake_summarize_chunk)
+    sections = _long_text(3).split("SECTION NUMBER ")[1:]
+    repeated = "".join("SECTION NUMBER " + s for s in sections + sections[:2])
+    summary.map_reduce_summary(repeated, force_chunking=True)
+
+    summaries = capture_merge["summaries"]
+    assert len(calls) < len(summaries)
+    assert len(set(summaries)) == len(calls)
+
+
+def test_map_chunks_are_tokenized_once(monkeypatch):
+    """The count taken while grouping also sizes each chunk's output budget"""
+    from app.utils.adaptive_budget import calculate_chunk_budget
+
+    budgets = []
+
+    def fake_summarize_chunk(chunk_text, **kwargs):
+        budgets.append((chunk_text, kwargs["out_budget"]))
+        return "{}"
+
+    counted = []
+    real_count_tokens = summary.count_tokens
+
+    def counting_count_tokens(text):
+        counted.append(text)
+        return real_count_tokens(text)
+
+    monkeypatch.setattr(summary, "summarize_chunk", fake_summarize_chunk)
+    monkeypatch.setattr(summary, "merge_summaries", lambda chunk_summaries, **kwargs: "{}")
+    monkeypatch.setattr(summary, "count_tokens", counting_count_tokens)
+    monkeypatch.setattr("app.utils.adaptive_budget.count_tokens", counting_count_tokens)
+    summary.map_reduce_summary(_long_text(4), force_chunking=True)
+
+    chunk_texts = [text for text, _ in budgets]
+    assert len(chunk_texts) > 1
+    assert all(counted.count(text) == 1 for text in chunk_texts)
+    assert all(budget == calculate_chunk_budget(text) for text, budget in budgets)
+
+
+def test_map_executor_is_shared_across_calls():
+    """MAP work reuses one bounded pool instead of creating threads per request"""
+    first = summary.get_map_executor()
+    assert summary.get_map_executor() is first
+    assert first._max_workers == summary.MAP_CONCURRENCY
+
+
+def test_small_chunks_are_marshaled_into_one_call(monkeypatch):
+    """Short chunks share one MAP call and the reply is split back per chunk"""
+    prompts = []
+
+    def fake_call_openai(system_prompt, user_prompt, max_output_tokens, **kwargs):
+        prompts.append(user_prompt)
+        count = user_prompt.count("=== EXCERPT ")
+        return f"\n{summary._SUMMARY_BREAK}\n".join(f'{{"n": {n}}}' for n in range(count))
+
+    monkeypatch.setattr(summary, "call_openai", fake_call_openai)
+    results = summary.summarize_chunk_group(["alpha text", "beta text", "gamma text"])
+
+    assert len(prompts) == 1
+    assert results == ['{"n": 0}', '{"n": 1}', '{"n": 2}']
+    assert summary._group_small_chunks([0, 1, 2, 3, 4], [100, 100, 3400, 50, 60]) == [[0, 1], [2, 3], [4]]
+
+
+def test_marshaled_reply_is_not_cached_whole(monkeypatch):
+    """A bad split is never replayed: only the per-chunk summaries are cached"""
+    marshaled = []
+
+    def fake_call_openai(system_prompt, user_prompt, max_output_tokens, **kwargs):
+        if "=== EXCERPT " in user_prompt:
+            marshaled.append(kwargs.get("cache", False))
+            return '{"n": 0}'  # One block for several excerpts
+        return '{"single": true}'
+
+    monkeypatch.setattr(summary, "call_openai", fake_call_openai)
+    texts = ["Short excerpt %d about split replies. " % n * 5 for n in range(3)]
+
+    assert summary.summarize_chunk_group(texts) == ['{"single": true}'] * 3
+    assert summary.summarize_chunk_group(texts) == ['{"single": true}'] * 3
+    assert marshaled == [False]  # The rerun is served from the per-chunk cache
+
+
+def test_identical_chunk_summaries_are_cached(monkeypatch):
+    """Re-summarizing the same chunk with the same settings skips the API call"""
+    calls = []
+
+    def fake_call_openai(system_prompt, user_prompt, max_output_tokens, **kwargs):
+        calls.append(user_prompt)
+        return '{"concepts": []}'
+
+    monkeypatch.setattr(summary, "call_openai", fake_call_openai)
+    text = "A chunk about caching that is uploaded twice. " * 20
+
+    first = summary.summarize_chunk(text, language="en")
+    second = summary.summarize_chunk(text, language="en")
+    summary.summarize_chunk(text, language="tr")
+
+    assert first == second == '{"concepts": []}'
+    assert len(calls) == 2
+
+
+def test_merge_drops_duplicate_chunk_summaries(capture_reduce):
+    """Identical MAP outputs contribute their items to REDUCE only once"""
+    repeated = '{"concepts": [{"term": "Review slide", "definition": "Chapter recap of earlier material"}]}'
+    unique = '{"concepts": [{"term": "Entropy", "definition": "Expected information content"}]}'
+
+    summary.merge_summaries([repeated, unique, repeated])
+
+    terms = [c["term"] for c in capture_reduce["knowledge"]["concepts"]]
+    assert terms == ["Review slide", "Entropy"]
+
+
+def test_fix_mermaid_syntax_brackets_nodes_and_quotes_labels():
+    fixed = summary.fix_mermaid_syntax("graph TD\n  Producer -->|put(x)| Buffer\n  A[A] --> B[B] C[C] --> D[D]")
+    lines = fixed.split("\n")
+
+    assert lines[0] == "graph TD"
+    assert lines[1].startswith("  Producer[Producer] -->|\"put(x)\"|")
+    assert "B[B]\n  C[C]" in fixed
+
+
+def test_should_map_reduce_skips_tiny_chunk_counts():
+    assert not summary.should_map_reduce(1, 50_000)
+    assert not summary.should_map_reduce(2, 12_000, model_context=128_000)
+    assert summary.should_map_reduce(2, 100_000, model_context=128_000)
+    assert summary.should_map_reduce(3, 12_000)
+
+
+def test_map_dispatch_overlaps_chunk_preparation(monkeypatch):
+    """The first MAP call starts before the last chunk has been counted"""
+    events = []
+    lock = threading.Lock()
+    real_count_tokens = summary.count_tokens
+
+    def slow_count_tokens(text):
+        if "topic" in text and len(text) < 50_000:  # Chunks and blocks, not the whole document
+            time.sleep(0.02)
+            with lock:
+                events.append("count")
+        return real_count_tokens(text)
+
+    def fake_summarize_chunk(chunk_text, **kwargs):
+        with lock:
+            events.append("map")
+        return "{}"
+
+    monkeypatch.setattr(summary, "count_tokens", slow_count_tokens)
+    monkeypatch.setattr(summary, "summarize_chunk", fake_summarize_chunk)
+    monkeypatch.setattr(summary, "merge_summaries", lambda chunk_summaries, **kwargs: "{}")
+
+    summary.map_reduce_summary(_long_text(), force_chunking=True)
+
+    last_count = len(events) - 1 - events[::-1].index("count")
+    assert events.index("map") < last_count
+
+
+def test_detect_domain_counts_distinct_overlapping_keywords():
+    assert summary.detect_domain("The THEOREM's proof uses a matrix.") == "technical"
+    # "functional" contains "function"; repeats of one keyword count once
+    assert summary.detect_domain("functional variable solve solve") == "technical"
+    assert summary.detect_domain("proof proof proof") == "general"
+    assert summary.detect_domain("Social history and culture of a society") == "social"
+    assert summary.detect_domain("Step one of the install guide") == "procedural"
+    assert summary.detect_domain("") == "general"
+
+
+def test_detect_domain_keeps_priority_in_single_pass():
+    # Social keywords come first in the text, but technical outranks social
+    assert summary.detect_domain("History, policy and culture; a theorem, its proof and a matrix") == "technical"
+    assert summary.detect_domain("History, policy and culture; one theorem") == "social"
+
+
+def test_detect_domain_skips_domains_that_cannot_reach_threshold():
+    class _Sample(str):
+        tested = []
+
+        def __contains__(self, keyword):
+            self.tested.append(keyword)
+            return str.__contains__(self, keyword)
+
+    class _Prefix(str):
+        def lower(self):
+            return _Sample(str.lower(self))
+
+    assert summary._detect_domain_sample.__wrapped__(_Prefix("nothing relevant")) == "general"
+    # With no hits, only the first len - 2 keywords of each domain are worth testing
+    expected = sum(len(keywords) - summary._DOMAIN_MIN_HITS + 1 for keywords in summary._DOMAIN_KEYWORDS.values())
+    assert len(_Sample.tested) == expected
+
+
+def test_probabilistic_diagram_needs_edge_probabilities():
+    result = {"summary": {"diagrams": [
+        {"title": "Bayesian Network", "type": "graph", "content": "graph TD\n  A --> B\n  B -->|P=0.3| C"},
+        {"title": "Class tree", "type": "tree", "content": "graph TD\n  A --> B"},
+    ]}}
+    issues = summary.validate_reduce_output(result)
+    flagged = [issue for issue in issues if "probabilistic network" in issue]
+    assert len(flagged) == 1 and "Bayesian Network" in flagged[0]
+
+
+def test_detect_domain_classifies_each_prefix_once():
+    text = "Proof of the theorem via the matrix equation. " * 200
+    summary._detect_domain_sample.cache_clear()
+    assert summary.detect_domain(text) == "technical"
+    assert summary.detect_domain(text + "unrelated tail") == "technical"
+    info = summary._detect_domain_sample.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def test_quality_score_legacy_weights_and_caps():
+    full = {"summary": {
+        "sections": [{"concepts": [{"explanation": "x" * 500, "examples": ["a", "b", "c"]}]}],
+        "formula_sheet": [{"worked_example": "1 + 1 = 2"}],
+        "diagrams": [{}] * 5, "pseudocode": [{}] * 2, "practice_problems": [{}] * 4,
+    }}
+    assert summary.quality_score_legacy(full) == 1.0
+    # Only the neutral formula share (0.5 * 0.15) scores on an empty summary
+    assert summary.quality_score_legacy({"summary": {}}) == 0.07
+    assert summary.quality_score_legacy(None) == 0.5
+    assert summary.quality_score_legacy({"summary": {"sections": [None]}}) == 0.5
+
+
+def test_small_document_takes_single_pass_without_domain_scan(monkeypatch):
+    prompts = []
+
+    def fake_call_openai(system_prompt, user_prompt, max_output_tokens, **kwargs):
+        prompts.append(user_prompt)
+        return "{}"
+
+    def fail_detect_domain(text):
+        raise AssertionError("domain detection should be skipped for tiny inputs")
+
+    monkeypatch.setattr(summary, "call_openai", fake_call_openai)
+    monkeypatch.setattr(summary, "detect_domain", fail_detect_domain)
+
+    assert summary.map_reduce_summary("Theorem: every proof uses an equation.") == "{}"
+    assert len(prompts) == 1
+    assert "Content domain: general." in prompts[0]
+
+
+def test_chunked_document_detects_domain_off_the_request_thread(monkeypatch, capture_merge):
+    """Domain detection overlaps structure parsing and MAP; only the REDUCE waits for it"""
+    detected_on = []
+
+    def fake_detect_domain(text):
+        detected_on.append(threading.current_thread())
+        return "technical"
+
+    monkeypatch.setattr(summary, "detect_domain", fake_detect_domain)
+    monkeypatch.setattr(summary, "summarize_chunk", lambda chunk_text, **kwargs: "{}")
+    summary.map_reduce_summary(_long_text(4), additional_instructions="Focus on proofs", force_chunking=True)
+
+    assert len(detected_on) == 1 and detected_on[0] is not threading.current_thread()
+    assert capture_merge["domain"] == "technical"
+    assert capture_merge["additional_instructions"].endswith("Content domain: technical. Adjust depth and style accordingly.")
+
+
+def test_concurrent_identical_chunks_share_one_call(monkeypatch):
+    """Two uploads of the same chunk at once pay for a single MAP call"""
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def fake_call_openai(system_prompt, user_prompt, max_output_tokens, **kwargs):
+        calls.append(user_prompt)
+        started.set()
+        release.wait(5)
+        return '{"concepts": ["shared"]}'
+
+    monkeypatch.setattr(summary, "call_openai", fake_call_openai)
+    text = "A lecture slide uploaded by two students at the same time. " * 20
+    results = []
+    workers = [
+        threading.Thread(target=lambda: results.append(summary.summarize_chunk(text, language="en")))
+        for _ in range(2)
+    ]
+    workers[0].start()
+    started.wait(5)
+    workers[1].start()
+    time.sleep(0.05)
+    release.set()
+    for worker in workers:
+        worker.join(5)
+
+    assert len(calls) == 1
+    assert results == ['{"concepts": ["shared"]}'] * 2
+    assert not summary._inflight_chunks
+
+
+def test_merge_drops_items_repeated_across_chunks(capture_reduce):
+    """The same definition restated by two chunks reaches REDUCE once"""
+    first = '{"concepts": [{"term": "Entropy", "definition": "Expected  information"}], "examples": ["H = 1 bit"]}'
+    second = '{"concepts": [{"term": "entropy", "definition": "expected information"}, {"term": "Thermodynamic entropy", "definition": "Disorder"}], "examples": ["h = 1  bit", "Coin toss"]}'
+
+    summary.merge_summaries([first, second])
+
+    knowledge = capture_reduce["knowledge"]
+    assert [c["definition"] for c in knowledge["concepts"]] == ["Expected  information", "Disorder"]
+    assert knowledge["examples"] == ["H = 1 bit", "Coin toss"]
+    assert knowledge["total_concepts"] == 2
+
+
+def test_merge_tags_sources_while_parsing_each_chunk_once(monkeypatch, capture_reduce):
+    """Citations land on the aggregated items and every chunk is decoded a single time"""
+    decoded = []
+    real_loads = summary.json_codec.loads
+
+    def counting_loads(data):
+        decoded.append(data)
+        return real_loads(data)
+
+    monkeypatch.setattr(summary.json_codec, "loads", counting_loads)
+    chunks = [
+        '{"concepts": [{"term": "Entropy"}], "formulas": [{"expression": "H = -sum p log p"}]}',
+        '{"concepts": [{"term": "Mutual information"}]}',
+    ]
+    citations = [{"heading_path": "Information > Entropy"}, {"heading_path": "Information > MI"}]
+
+    summary.merge_summaries(chunks, chunk_citations=citations)
+
+    knowledge = capture_reduce["knowledge"]
+    assert [c["_source"] for c in knowledge["concepts"]] == [
+        {"chunk": 1, "heading": "Information > Entropy"},
+        {"chunk": 2, "heading": "Information > MI"},
+    ]
+    assert knowledge["formulas"][0]["_source"]["chunk"] == 1
+    assert sum(data in chunks for data in decoded) == len(chunks)
+
+
+def test_merge_keeps_only_well_formed_item_lists(capture_reduce):
+    """Non-object replies fall back to raw text; non-list fields are dropped"""
+    chunks = [
+        '{"concepts": "Entropy is disorder", "formulas": [{"expression": "S = k ln W"}], "notes": "x"}',
+        '["not", "an", "object"]',
+    ]
+
+    summary.merge_summaries(chunks)
+
+    knowledge = capture_reduce["knowledge"]
+    assert knowledge["formulas"] == [{"expression": "S = k ln W"}]
+    assert [c["term"] for c in knowledge["concepts"]] == ["Content from chunk 2"]
+
+
+def test_merge_returns_compact_json_with_coverage(monkeypatch):
+    monkeypatch.setattr(
+        summary, "reduce_two_stage",
+        lambda aggregated_knowledge, **kwargs: {"summary": {"sections": [{"heading": "Entropy", "concepts": []}]}}
+    )
+
+    result = summary.merge_summaries(['{"concepts": [{"term": "Entropy"}]}'], original_text="# Entropy\n")
+
+    assert "\n" not in result
+    assert summary.json_codec.loads(result)["coverage"] == {"score": 1.0, "missing_topics": []}
+
+
+def test_merge_collapses_concepts_with_the_same_name(capture_reduce):
+    """Restated concepts (case, punctuation, plural) keep the most detailed entry"""
+    first = '{"concepts": [{"term": "Neural Network", "explanation": "Layers.", "example": "MNIST digits"}, {"term": "Loss"}]}'
+    second = '{"concepts": [{"term": "neural networks.", "explanation": "Stacked layers of weighted sums.", "example": ""}]}'
+    third = '{"theorems": [{"name": "Bayes\' rule", "proof_sketch": "short"}, {"name": "bayes rule", "proof_sketch": "longer sketch"}]}'
+
+    summary.merge_summaries([first, second, third])
+
+    knowledge = capture_reduce["knowledge"]
+    assert knowledge["concepts"] == [
+        {"term": "neural networks.", "explanation": "Stacked layers of weighted sums.", "example": "MNIST digits"},
+        {"term": "Loss"},
+    ]
+    assert knowledge["theorems"] == [{"name": "bayes rule", "proof_sketch": "longer sketch"}]
+
+
+def test_fuzzy_merge_keeps_names_that_differ_in_numbering():
+    pairs = [("Type I error", "Type II error"), ("Type 1 diabetes", "Type 2 diabetes"), ("Layer 2 switch", "Layer 3 switch")]
+    for first, second in pairs:
+        items = [{"term": first, "explanation": "a"}, {"term": second, "explanation": "b"}]
+        assert summary._merge_same_named_items(items, "term", "explanation") == items
+    # Plural/suffix variants still collapse
+    merged = summary._merge_same_named_items(
+        [{"term": "Gradient descent"}, {"term": "gradient descents"}], "term", "explanation"
+    )
+    assert len(merged) == 1
+
+
+def test_merged_duplicates_keep_every_example():
+    items = [
+        {"term": "Entropy", "explanation": "Average surprise.", "example": "Fair coin: 1 bit", "examples": ["coin"]},
+        {"term": "entropy", "explanation": "Short.", "example": "Fair die: 2.58 bits", "examples": ["die", "coin"]},
+        {"term": "ENTROPY", "explanation": "", "example": "Fair coin: 1 bit"},
+    ]
+    assert summary._merge_same_named_items(items, "term", "explanation") == [{
+        "term": "Entropy",
+        "explanation": "Average surprise.",
+        "example": "Fair coin: 1 bit\nFair die: 2.58 bits",
+        "examples": ["coin", "die"],
+    }]
+
+
+def test_merge_collapses_formulas_with_the_same_expression(capture_reduce):
+    """Formulas match on the expression (spacing/delimiters ignored, symbols and case kept)"""
+    first = '{"formulas": [{"name": "Mass-energy", "expression": "\\\\(E = mc^2\\\\)"}, {"name": "Sum", "expression": "a + b"}]}'
+    second = '{"formulas": [{"name": "Einstein", "expression": "E=mc^2", "worked_example": "m = 1 kg gives 9e16 J"}, {"name": "Difference", "expression": "a - b"}]}'
+
+    summary.merge_summaries([first, second])
+
+    formulas = capture_reduce["knowledge"]["formulas"]
+    assert [f["expression"] for f in formulas] == ["E=mc^2", "a + b", "a - b"]
+    assert formulas[0]["worked_example"] == "m = 1 kg gives 9e16 J"
+    assert capture_reduce["knowledge"]["total_formulas"] == 3
+
+
+def test_tree_reduce_merges_groups_until_fanout(monkeypatch):
+    calls = []
+
+    def fake_call_openai(system_prompt, user_prompt, max_output_tokens, **kwargs):
+        count = user_prompt.count("=== EXTRACTION ")
+        calls.append(count)
+        return '{"concepts": [{"term": "merged %d"}]}' % count
+
+    monkeypatch.setattr(summary, "call_openai", fake_call_openai)
+    summaries = ['{"concepts": [{"term": "c%d"}]}' % i for i in range(14)]
+
+    reduced = summary.tree_reduce(summaries, fanout=6)
+
+    assert sorted(calls) == [2, 6, 6]
+    assert reduced == ['{"concepts": [{"term": "merged %d"}]}' % n for n in (6, 6, 2)]
+
+
+def test_failed_group_merge_concatenates_items(monkeypatch):
+    def failing_call_openai(*args, **kwargs):
+        raise RuntimeError("503")
+
+    monkeypatch.setattr(summary, "call_openai", failing_call_openai)
+    merged = summary.merge_summary_group(['{"concepts": [1], "formulas": [2]}', "not json", '{"concepts": [3]}'])
+
+    assert summary.json_codec.loads(merged) == {"concepts": [1, 3], "formulas": [2], "theorems": [], "examples": []}
+
+
+def test_reduce_capacity_forces_tree_reduce(monkeypatch, capture_merge):
+    """When the summaries can't fit one REDUCE prompt they are merged in groups first"""
+    monkeypatch.setattr(summary, "max_reduce_inputs", lambda prompt_tokens, **kwargs: 3)
+    monkeypatch.setattr(summary, "summarize_chunk", lambda chunk_text, **kwargs: '{"concepts": ["%s"]}' % chunk_text[:40])
+    monkeypatch.setattr(summary, "call_openai", lambda *args, **kwargs: '{"concepts": ["merged"]}')
+
+    summary.map_reduce_summary(_long_text(), force_chunking=True)
+
+    assert 1 < len(capture_merge["summaries"]) <= 3
+
+
+def test_tree_reduced_items_cite_the_chunks_they_came_from(monkeypatch, capture_reduce):
+    """After the intermediate merges each item is tagged with its group's chunk span"""
+    def fake_summarize_chunk(chunk_text, **kwargs):
+        topic = int(re.search(r"Sentence about topic (\d+)", chunk_text).group(1))
+        # Names far apart, so no two chunks' concepts are merged as the same item
+        return '{"concepts": [{"term": "%s", "definition": "%d"}]}' % (chr(ord("A") + topic) * 6, topic)
+
+    def failing_call_openai(*args, **kwargs):
+        raise RuntimeError("503")  # Group merges fall back to concatenating the items
+
+    monkeypatch.setattr(summary, "summarize_chunk", fake_summarize_chunk)
+    monkeypatch.setattr(summary, "call_openai", failing_call_openai)
+    summary.map_reduce_summary(_long_text(30), force_chunking=True)
+
+    concepts = capture_reduce["knowledge"]["concepts"]
+    assert len(concepts) == 30
+    for concept in concepts:
+        chunk_id = int(concept["definition"]) + 1
+        source = concept["_source"]
+        assert source["chunk"] <= chunk_id <= source["chunk_end"]
+    assert sorted({(c["_source"]["chunk"], c["_source"]["chunk_end"]) for c in concepts}) == [
+        (1, 6), (7, 12), (13, 18), (19, 24), (25, 30)
+    ]
+
+
+def test_merge_skips_source_tags_that_do_not_match_the_summaries(capture_reduce):
+    citations = [{"chunk_id": n, "heading_path": "H%d" % n} for n in range(1, 4)]
+    summary.merge_summaries(['{"concepts": [{"term": "Entropy"}]}'], chunk_citations=citations)
+
+    assert "_source" not in capture_reduce["knowledge"]["concepts"][0]
+
+
+def test_tree_reduce_spans_follow_the_merge_groups():
+    assert summary.tree_reduce_spans(14, fanout=6) == [(0, 5), (6, 11), (12, 13)]
+    assert summary.tree_reduce_spans(40, fanout=3) == [(0, 26), (27, 39)]
+    assert summary.tree_reduce_spans(3, fanout=6) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_gc_pause_is_shared_by_overlapping_requests():
+    import gc
+
+    assert gc.isenabled()
+    with summary._gc_paused():
+        with summary._gc_paused():
+            assert not gc.isenabled()
+        assert not gc.isenabled()  # The outer request is still in its MAP phase
+    assert gc.isenabled()
+
+
+def test_gc_pause_still_collects_when_pauses_keep_overlapping(monkeypatch):
+    """Under steady overlapping load the shared pause never ends; cycles are still collected"""
+    import gc
+
+    monkeypatch.setattr(summary, "MAP_GC_PAUSE_MAX_SECONDS", 5.0)
+    clock = [1000.0]
+    collections = []
+    monkeypatch.setattr(summary.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(summary.gc, "collect", lambda: collections.append(clock[0]))
+
+    pauses = [summary._gc_paused() for _ in range(7)]
+    pauses[0].__enter__()
+    for previous, current in zip(pauses, pauses[1:]):
+        clock[0] += 2  # Each new request starts before the previous one finishes
+        current.__enter__()
+        previous.__exit__(None, None, None)
+        assert not gc.isenabled()
+
+    assert collections == [1006.0, 1012.0]  # Once per MAP_GC_PAUSE_MAX_SECONDS
+    pauses[-1].__exit__(None, None, None)
+    assert gc.isenabled()
+
+
+def test_knowledge_json_truncates_to_valid_json():
+    knowledge = {
+        "total_concepts": 300,
+        "concepts": [{"term": "t%d" % i, "explanation": "x" * 40} for i in range(300)],
+        "formulas": [{"name": "f"}],
+        "source_structure": [],
+    }
+    assert summary._knowledge_json(knowledge, 10 ** 9) == summary.json_codec.dumps_text(knowledge)
+
+    bounded = summary._knowledge_json(knowledge, 2000)
+    parsed = summary.json_codec.loads(bounded)
+    assert len(bounded) < 2200
+    assert 0 < len(parsed["concepts"]) < 300
+    assert parsed["concepts"] == knowledge["concepts"][:len(parsed["concepts"])]
+    assert parsed["formulas"] == [] and parsed["total_concepts"] == 300
+
+
+def test_knowledge_json_sends_reducer_only_what_it_reads():
+    knowledge = {
+        "concepts": [
+            {"term": "Entropy", "definition": "", "example": "", "_source": {"chunk": 2, "heading": "Ch 1 > Info"}},
+            "plain text item",
+            {"term": "Channel", "_source": {"chunk": 7, "chunk_end": 12, "heading": "Ch 2"}},
+        ],
+        "source_structure": [{"chunk_id": 2, "heading_path": "Ch 1 > Info", "char_start": 10, "char_end": 90}],
+    }
+    parsed = summary.json_codec.loads(summary._knowledge_json(knowledge, float("inf")))
+    assert parsed["concepts"] == [{"term": "Entropy", "chunk": 2}, "plain text item", {"term": "Channel", "chunk": "7-12"}]
+    assert parsed["source_structure"] == [{"chunk_id": 2, "heading_path": "Ch 1 > Info"}]
+    # The aggregated items themselves keep their tags for theme inference
+    assert knowledge["concepts"][0]["_source"]["heading"] == "Ch 1 > Info"
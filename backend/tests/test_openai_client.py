@@ -0,0 +1,478 @@
+"""
+Tests for the shared OpenAI HTTP session
+"""
+import socket
+
+from app.config import OPENAI_POOL_MAXSIZE, MAP_CONCURRENCY
+from app.services.openai_client import get_http_session
+from app.utils import json_codec
+
+
+def test_session_is_shared_and_pooled():
+    session = get_http_session()
+    assert get_http_session() is session
+    adapter = session.get_adapter("https://api.openai.com/v1/chat/completions")
+    assert adapter._pool_maxsize == max(OPENAI_POOL_MAXSIZE, MAP_CONCURRENCY + 1)
+    assert adapter._pool_maxsize > MAP_CONCURRENCY
+    assert 429 in adapter.max_retries.status_forcelist
+    assert "POST" in adapter.max_retries.allowed_methods
+    socket_options = adapter.poolmanager.connection_pool_kw["socket_options"]
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in socket_options
+
+
+def test_warm_http_session_opens_connections_in_background(monkeypatch):
+    from app.services import openai_client
+
+    urls = []
+
+    class _Session:
+        def get(self, url, headers=None, timeout=None):
+            urls.append(url)
+            raise ConnectionError("offline")  # Failures must not escape the thread
+
+    monkeypatch.setattr(openai_client, "get_http_session", lambda: _Session())
+    threads = openai_client.warm_http_session("test-key", connections=2)
+    for thread in threads:
+        thread.join()
+    assert urls == [openai_client.OPENAI_API_BASE + "/models"] * 2
+    assert openai_client.warm_http_session("", connections=2) == []
+    assert openai_client.warm_http_session("test-key", connections=0) == []
+
+
+def test_transport_retries_back_off_with_jitter_and_honor_retry_after():
+    retry = get_http_session().get_adapter("https://api.openai.com").max_retries
+    assert retry.respect_retry_after_header
+    assert retry.backoff_jitter > 0
+    # Backoff grows exponentially but each sleep stays under the cap (+ jitter)
+    for _ in range(retry.total - 1):
+        retry = retry.increment(method="POST", url="/v1/chat/completions")
+    assert 0 < retry.get_backoff_time() <= retry.backoff_max + retry.backoff_jitter
+
+
+def test_transport_does_not_resend_posts_that_time_out():
+    import threading
+
+    import pytest
+    import requests
+
+    from app.services.openai_client import _build_session
+
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    accepted = []
+
+    def accept_and_hang():
+        server.settimeout(1)
+        try:
+            while True:
+                accepted.append(server.accept()[0])  # Never replies
+        except OSError:
+            pass
+
+    thread = threading.Thread(target=accept_and_hang, daemon=True)
+    thread.start()
+    session = _build_session()
+    session.mount("http://", session.get_adapter("https://api.openai.com"))
+    try:
+        with pytest.raises(requests.RequestException):
+            session.post("http://127.0.0.1:%d/v1/chat/completions" % server.getsockname()[1], data=b"{}", timeout=0.2)
+    finally:
+        server.close()
+        thread.join()
+        for conn in accepted:
+            conn.close()
+    assert len(accepted) == 1
+    assert session.get_adapter("https://api.openai.com").max_retries.read == 0
+
+
+class _FakeStreamResponse:
+    status_code = 200
+
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_lines(self):
+        return iter(self._lines)
+
+
+class _FakeSession:
+    def __init__(self, lines):
+        self.lines = lines
+        self.payload = None
+
+    def post(self, url, headers=None, data=None, timeout=None, stream=False):
+        self.payload = json_codec.loads(data)
+        return _FakeStreamResponse(self.lines)
+
+
+def test_call_openai_stream_yields_deltas(monkeypatch):
+    from app.services import summary
+
+    lines = [
+        b'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+        b"",
+        b'data: {"choices": [{"delta": {"content": "{\\"a\\""}}]}',
+        b'data: {"choices": [{"delta": {"content": ": 1}"}, "finish_reason": "stop"}]}',
+        b'data: {"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}}',
+        b"data: [DONE]",
+    ]
+    fake = _FakeSession(lines)
+    tracked = []
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    monkeypatch.setattr(summary, "_track_token_usage", lambda usage, user_id, endpoint: tracked.append(usage))
+
+    deltas = list(summary.call_openai_stream("sys", "user", 100, user_id=1))
+
+    assert "".join(deltas) == '{"a": 1}'
+    assert fake.payload["stream"] is True
+    assert tracked == [{"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}]
+
+
+def test_token_bucket_paces_and_pauses_after_429():
+    from app.services.openai_client import TokenBucket
+
+    bucket = TokenBucket(rate_per_second=1000.0, capacity=100.0)
+    assert bucket.acquire(100) == 0.0
+    # Bucket is empty: the next 50 tokens need ~0.05s of refill
+    assert 0.03 < bucket.acquire(50) < 0.5
+
+    bucket.penalize(0.1)
+    assert bucket.acquire(1) >= 0.09
+
+
+class _FakeBatchResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, payload=None, content=b""):
+        self._payload = payload
+        self.content = content
+
+    def json(self):
+        return self._payload
+
+
+class _FakeBatchSession:
+    """Simulates the files/batches endpoints; output lines come back shuffled"""
+
+    def __init__(self, failed_ids=()):
+        self.uploaded = None
+        self.polls = 0
+        self.failed_ids = set(failed_ids)
+
+    def post(self, url, headers=None, json=None, data=None, files=None, timeout=None):
+        if url.endswith("/files"):
+            self.uploaded = files["file"][1]
+            return _FakeBatchResponse({"id": "file-in"})
+        return _FakeBatchResponse({"id": "batch-1"})
+
+    def get(self, url, headers=None, timeout=None):
+        import json as _json
+
+        if url.endswith("/batches/batch-1"):
+            self.polls += 1
+            status = "completed" if self.polls > 1 else "in_progress"
+            return _FakeBatchResponse({"status": status, "output_file_id": "file-out"})
+        lines = [_json.loads(line) for line in self.uploaded.splitlines()]
+        out = [
+            _json.dumps({
+                "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "body": {
+                    "choices": [{"message": {"content": "summary of " + line["custom_id"]}}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+                }}
+            })
+            for line in reversed(lines)
+            if line["custom_id"] not in self.failed_ids
+        ]
+        return _FakeBatchResponse(content="\n".join(out).encode())
+
+
+def test_summarize_chunks_batch_round_trip(monkeypatch):
+    from app.services import openai_client, summary
+
+    fake = _FakeBatchSession()
+    monkeypatch.setattr(openai_client, "get_http_session", lambda: fake)
+    monkeypatch.setattr(openai_client, "OPENAI_BATCH_POLL_SECONDS", 0)
+    monkeypatch.setattr(summary, "wait_for_batch", lambda batch_id, key: openai_client.wait_for_batch(batch_id, key, poll_seconds=0))
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "_track_token_usage", lambda usage, user_id, endpoint, **kwargs: None)
+
+    results = summary.summarize_chunks_batch(["first chunk", "second chunk", "third chunk"])
+
+    assert results == ["summary of req-0", "summary of req-1", "summary of req-2"]
+    assert fake.polls == 2
+    assert b'"url":"/v1/chat/completions"' in fake.uploaded
+
+    # A rerun over the same material is served from the MAP cache: nothing is uploaded
+    rerun = _FakeBatchSession()
+    monkeypatch.setattr(openai_client, "get_http_session", lambda: rerun)
+    assert summary.summarize_chunks_batch(["first chunk", "second chunk", "third chunk"]) == results
+    assert rerun.uploaded is None
+
+
+def test_failed_batch_requests_fall_back_to_sync_calls(monkeypatch):
+    from app.services import openai_client, summary
+
+    fake = _FakeBatchSession(failed_ids={"req-1"})
+    tracked = []
+    monkeypatch.setattr(openai_client, "get_http_session", lambda: fake)
+    monkeypatch.setattr(summary, "wait_for_batch", lambda batch_id, key: openai_client.wait_for_batch(batch_id, key, poll_seconds=0))
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "summarize_chunk", lambda chunk_text, **kwargs: "sync " + chunk_text)
+    monkeypatch.setattr(summary, "_track_token_usage", lambda usage, user_id, endpoint, **kwargs: tracked.append(kwargs))
+
+    results = summary.summarize_chunks_batch(["chunk one", "chunk two", "chunk three"], user_id=7)
+
+    assert results == ["summary of req-0", "sync chunk two", "summary of req-2"]
+    assert tracked == [{"price_factor": summary.OPENAI_BATCH_PRICE_FACTOR}] * 2
+
+
+class _FakeChatResponse:
+    status_code = 200
+
+    def __init__(self, content, finish_reason):
+        self.content = json_codec.dumps(
+            {"choices": [{"message": {"content": content}, "finish_reason": finish_reason}]}
+        )
+
+
+class _FakeChatSession:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.payloads = []
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        self.payloads.append(json_codec.loads(data))
+        return _FakeChatResponse(*self.replies.pop(0))
+
+
+def test_call_openai_continues_truncated_output(monkeypatch):
+    from app.services import summary
+
+    fake = _FakeChatSession([('{"title": "Par', "length"), ('tial"}', "stop")])
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+
+    result = summary.call_openai("sys", "user", 100)
+
+    assert result == '{"title": "Partial"}'
+    assert fake.payloads[1]["max_tokens"] == 100
+    assert fake.payloads[1]["messages"][2] == {"role": "assistant", "content": '{"title": "Par'}
+
+
+def test_call_openai_without_retry_returns_truncated_output(monkeypatch):
+    from app.services import summary
+
+    fake = _FakeChatSession([("cut", "length")])
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+
+    assert summary.call_openai("sys", "user", 100, retry_on_length=False) == "cut"
+    assert len(fake.payloads) == 1
+
+
+def test_json_mode_is_sent_but_not_on_continuations(monkeypatch):
+    from app.services import summary
+
+    fake = _FakeChatSession([('{"a": ', "length"), ("1}", "stop")])
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+
+    result = summary.call_openai("sys", "return json", 100, response_format=summary.JSON_MODE)
+
+    assert result == '{"a": 1}'
+    assert fake.payloads[0]["response_format"] == {"type": "json_object"}
+    assert "response_format" not in fake.payloads[1]
+
+
+def test_call_openai_cache_reuses_identical_requests(monkeypatch):
+    from app.services import summary
+
+    fake = _FakeChatSession([("first", "stop"), ("hot 1", "stop"), ("hot 2", "stop")])
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+
+    assert summary.call_openai("sys", "cache me", 100, cache=True) == "first"
+    assert summary.call_openai("sys", "cache me", 100, cache=True) == "first"
+    assert len(fake.payloads) == 1
+
+    # Sampled replies are meant to vary between calls
+    assert summary.call_openai("sys", "cache me", 100, temperature=0.9, cache=True) == "hot 1"
+    assert summary.call_openai("sys", "cache me", 100, temperature=0.9, cache=True) == "hot 2"
+
+
+def test_call_openai_cache_skips_truncated_replies(monkeypatch):
+    from app.services import summary
+
+    fake = _FakeChatSession([("cut", "length"), ("complete", "stop"), ("again", "stop")])
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+
+    assert summary.call_openai("sys", "cache a cut", 100, retry_on_length=False, cache=True) == "cut"
+    assert summary.call_openai("sys", "cache a cut", 100, retry_on_length=False, cache=True) == "complete"
+    assert summary.call_openai("sys", "cache a cut", 100, retry_on_length=False, cache=True) == "complete"
+    assert len(fake.payloads) == 2
+
+
+def test_call_openai_stream_mode_accumulates_deltas(monkeypatch):
+    from app.services import summary
+
+    lines = [
+        b'data: {"choices": [{"delta": {"content": "{\\"title\\": "}}]}',
+        b'data: {"choices": [{"delta": {"content": "\\"Guide\\"}"}, "finish_reason": "stop"}]}',
+        b'data: {"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}}',
+        b"data: [DONE]",
+    ]
+    fake = _FakeSession(lines)
+    tracked = []
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    monkeypatch.setattr(summary, "_track_token_usage", lambda usage, user_id, endpoint: tracked.append(usage))
+
+    result = summary.call_openai("sys", "user", 100, user_id=1, stream=True)
+
+    assert result == '{"title": "Guide"}'
+    assert fake.payload["stream"] is True
+    assert tracked == [{"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}]
+
+
+def test_call_openai_forwards_deltas_to_callback(monkeypatch):
+    from app.services import summary
+
+    lines = [
+        b'data: {"choices": [{"delta": {"content": "Hel"}}]}',
+        b'data: {"choices": [{"delta": {"content": "lo"}, "finish_reason": "stop"}]}',
+        b"data: [DONE]",
+    ]
+    fake = _FakeSession(lines)
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    deltas = []
+
+    assert summary.call_openai("sys", "user", 100, on_delta=deltas.append) == "Hello"
+    assert deltas == ["Hel", "lo"]
+    assert fake.payload["stream"] is True
+
+
+def test_request_headers_are_built_once_per_key():
+    from app.services.openai_client import json_headers, auth_headers
+
+    headers = json_headers("sk-test")
+    assert json_headers("sk-test") is headers
+    assert headers == {"Authorization": "Bearer sk-test", "Content-Type": "application/json"}
+    assert "Content-Type" not in auth_headers("sk-test")  # multipart uploads set their own
+
+
+def test_call_openai_tags_requests_with_hashed_user(monkeypatch):
+    from app.services import summary
+
+    fake = _FakeChatSession([("{}", "stop"), ("{}", "stop")])
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    monkeypatch.setattr(summary, "_track_token_usage", lambda usage, user_id, endpoint, **kwargs: None)
+
+    summary.call_openai("sys", "user", 100, user_id=42)
+    summary.call_openai("sys", "user", 100)
+
+    tag = fake.payloads[0]["user"]
+    assert tag == summary.openai_user_tag(42) and "42" not in tag
+    assert fake.payloads[0]["messages"][0] == {"role": "system", "content": "sys"}
+    assert "user" not in fake.payloads[1]
+
+
+def test_call_openai_resends_after_dropped_connection(monkeypatch):
+    import requests
+    from app.services import summary
+
+    class _DroppingSession(_FakeChatSession):
+        def post(self, url, headers=None, data=None, timeout=None):
+            if not self.payloads:
+                self.payloads.append(json_codec.loads(data))
+                raise requests.exceptions.ChunkedEncodingError("connection reset")
+            return super().post(url, headers=headers, data=data, timeout=timeout)
+
+    fake = _DroppingSession([("done", "stop")])
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    monkeypatch.setattr(summary, "backoff_seconds", lambda retry: 0)
+
+    assert summary.call_openai("sys", "user", 100) == "done"
+    assert len(fake.payloads) == 2
+
+
+def test_call_openai_does_not_resend_timed_out_requests(monkeypatch):
+    import pytest
+    import requests
+    from urllib3.exceptions import MaxRetryError, ProtocolError, ReadTimeoutError
+
+    from app.services import summary
+
+    def timed_out():
+        return requests.ConnectionError(MaxRetryError(None, "/v1/chat/completions", ReadTimeoutError(None, None, "timed out")))
+
+    def reset_mid_reply():
+        return requests.ConnectionError(MaxRetryError(None, "/v1/chat/completions", ProtocolError("Connection aborted.")))
+
+    class _FailingSession(_FakeChatSession):
+        def __init__(self, errors, replies):
+            super().__init__(replies)
+            self.errors = errors
+
+        def post(self, url, headers=None, data=None, timeout=None):
+            if self.errors:
+                self.payloads.append(json_codec.loads(data))
+                raise self.errors.pop(0)
+            return super().post(url, headers=headers, data=data, timeout=timeout)
+
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "backoff_seconds", lambda retry: 0)
+
+    fake = _FailingSession([timed_out()], [("never sent", "stop")])
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    with pytest.raises(requests.ConnectionError):
+        summary.call_openai("sys", "user", 100)
+    assert len(fake.payloads) == 1
+
+    fake = _FailingSession([reset_mid_reply()], [("done", "stop")])
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    assert summary.call_openai("sys", "user", 100) == "done"
+    assert len(fake.payloads) == 2
+
+
+def test_backoff_grows_and_respects_retry_after():
+    from app.services.openai_client import backoff_seconds, retry_after_seconds
+
+    assert 1.0 <= backoff_seconds(0) <= 2.0
+    assert 4.0 <= backoff_seconds(2) <= 5.0
+    assert backoff_seconds(0, minimum=12.0) == 12.0
+
+    class _Response:
+        headers = {"retry-after-ms": "250", "retry-after": "1"}
+    assert retry_after_seconds(_Response()) == 0.25
+
+
+def test_summarize_no_files_streams_the_reply(monkeypatch):
+    from app.services import summary
+
+    lines = [
+        b'data: {"choices": [{"delta": {"content": "{\\"summary\\": "}}]}',
+        b'data: {"choices": [{"delta": {"content": "{}}"}, "finish_reason": "stop"}]}',
+        b"data: [DONE]",
+    ]
+    fake = _FakeSession(lines)
+    monkeypatch.setattr(summary, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summary, "get_http_session", lambda: fake)
+    deltas = []
+
+    assert summary.summarize_no_files("Photosynthesis", on_delta=deltas.append) == '{"summary": {}}'
+    assert deltas == ['{"summary": ', "{}}"]
+    assert fake.payload["stream"] is True
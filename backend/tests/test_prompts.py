@@ -0,0 +1,57 @@
+"""
+Tests for the precomputed summary prompt templates
+"""
+from app.services import summary
+
+
+def test_chunk_prompt_is_prebuilt_per_language():
+    assert summary.get_chunk_summary_prompt("en") is summary.get_chunk_summary_prompt("en")
+    assert "Write in TURKISH." in summary.get_chunk_summary_prompt("tr")
+    assert "Write in ENGLISH." in summary.get_chunk_summary_prompt("fr")
+
+
+def test_final_merge_prompt_splices_instructions_and_domain():
+    prompt = summary.get_final_merge_prompt("tr", "Focus on chapter 3", "technical")
+    assert "Use TURKISH for ALL output." in prompt
+    assert "For technical content" in prompt
+    assert "USER REQUIREMENTS (FOLLOW STRICTLY):\nFocus on chapter 3\n\nMINDSET CHECK" in prompt
+    assert "USER REQUIREMENTS" not in summary.get_final_merge_prompt("en", "", "procedural")
+    assert summary._SPLICE not in prompt
+
+
+def test_no_files_prompt_fills_every_topic_slot():
+    prompt = summary.get_no_files_prompt("Bayesian Networks", "en")
+    assert prompt.count('"Bayesian Networks"') == 3
+    assert summary._SPLICE not in prompt
+
+
+def test_prompt_prefixes_are_built_once_per_document_settings():
+    first = summary.get_final_merge_prompt("en", "Focus on proofs", "technical")
+    assert summary.get_final_merge_prompt("en", "Focus on proofs", "technical") is first
+
+    prompt, _ = summary._build_chunk_request("CHUNK BODY", "tr", "Be brief", 500)
+    assert prompt.startswith(summary._chunk_prompt_prefix("tr", "Be brief"))
+    assert prompt.endswith("TEXT TO EXTRACT FROM:\nCHUNK BODY")
+    assert "User preferences: Be brief" in prompt
+
+
+def test_reduce_prompts_reuse_static_bodies():
+    assert summary.get_reduce_outline_prompt("en", "general") is summary.get_reduce_outline_prompt("en", "general")
+    fill = summary.get_reduce_fill_prompt("tr", "technical", "Only chapter 2")
+    assert fill.startswith("Fill the given OUTLINE")
+    assert "Use TURKISH for ALL output.\n- NUMERIC EXAMPLES REQUIRED" in fill
+    assert fill.endswith("no markdown.\n\nOnly chapter 2")
+    assert summary.get_reduce_fill_prompt("tr", "technical") == summary._reduce_fill_base("tr", "technical")
+
+
+def test_whitespace_variants_of_instructions_share_one_prompt():
+    first = summary.get_final_merge_prompt("en", "Focus on proofs\r\nSkip history  ", "technical")
+    assert summary.get_final_merge_prompt("en", "  Focus on proofs\nSkip history\n", "technical") is first
+    assert "Focus on proofs\nSkip history\n" in first
+    assert summary.normalize_instructions(None) == ""
+    assert summary.normalize_instructions(" \n ") == ""
+
+
+def test_self_repair_prompt_embeds_compact_json():
+    prompt = summary.build_self_repair_prompt({"summary": {"title": "Özet", "sections": []}}, ["too short"], "en")
+    assert '{"summary":{"title":"Özet","sections":[]}}' in prompt
@@ -0,0 +1,89 @@
+"""
+Tests for the exam-ready quality heuristics
+"""
+import re
+
+from app.utils import quality
+
+
+def test_vague_example_regex_matches_any_single_pattern():
+    samples = [
+        "Consider a simple case where the list is sorted.",
+        "Let's say we have 3 apples and 4 oranges in the basket today.",
+        "For example:",
+        "Used widely, e.g.,",
+        "Given n = 8 the loop runs 3 times, then returns the index 5.",
+        "",
+    ]
+    for sample in samples:
+        expected = any(re.search(p, sample.lower()) for p in quality.VAGUE_EXAMPLE_PATTERNS)
+        assert bool(quality._VAGUE_EXAMPLE_RE.search(sample.lower())) == expected
+
+
+def test_has_concrete_example_rejects_vague_wording():
+    assert not quality.has_concrete_example("Imagine a scenario in which 10 users log in at the same time.")
+    assert quality.has_concrete_example("Given 10 users logging in per second, the queue grows by 4 each step.")
+
+
+def test_detect_domain_signals():
+    assert quality.detect_domain("The THEOREM follows from the lemma") == "quant"
+    assert quality.detect_domain("A poem written by the author") == "qual"
+    assert quality.detect_domain("") == "semi"
+    assert quality.detect_domain("Written in 1850") == "quant"
+    assert quality.detect_domain("The 1848 revolution") == "qual"
+    assert quality.detect_domain("Plain words only") == "semi"
+
+
+def test_detect_domain_stops_at_first_quant_signal(monkeypatch):
+    class NoScan:
+        def search(self, text):
+            raise AssertionError("scan should have been skipped")
+
+    monkeypatch.setattr(quality, "_QUAL_SIGNALS", NoScan())
+    monkeypatch.setattr(quality, "_DIGIT", NoScan())
+    assert quality.detect_domain("The runtime is 3 ms") == "quant"
+
+
+def test_comprehensive_score_readability_and_numeric_density():
+    sentence = " ".join(["word"] * 20) + ". "
+    result = {"summary": {
+        "sections": [{"concepts": [
+            {"example": "x = 3 gives 9", "explanation": sentence * 3},
+            {"example": "no digits here", "explanation": sentence},
+        ]}],
+        "glossary": [{}] * 10,
+    }}
+    scores = quality.calculate_comprehensive_quality_score(result)
+    assert scores["avg_tokens_per_sentence"] == 20.0
+    assert scores["readability_score"] == 1.0
+    assert scores["numeric_density"] == 0.5
+    assert scores["glossary_score"] == 1.0
+
+
+def test_hype_numbers_are_toned_down():
+    result = {"summary": {"sections": [{"heading": "Search", "concepts": [
+        {"term": "Pruning", "explanation": "Cuts the tree from 35^100 to 5 nodes.", "example": ""},
+    ]}]}}
+    enhanced, _ = quality.validate_and_enhance_quality(result)
+    assert enhanced["summary"]["sections"][0]["concepts"][0]["explanation"] == "Cuts the tree from asymptotically better nodes."
+
+
+def test_enforce_logs_detected_domain_instead_of_printing(caplog, capsys):
+    import logging
+
+    result = {"summary": {"sections": [{"heading": "Proofs", "concepts": []}]}}
+    with caplog.at_level(logging.INFO, logger="app.utils.quality"):
+        quality.enforce_exam_ready(result)
+    assert "[ENFORCE] Detected domain" in caplog.text
+    assert capsys.readouterr().out == ""
+
+
+def test_long_control_flow_expressions_move_to_pseudocode():
+    loop = "for each node n in the frontier: if n is a goal then return n else expand n; repeat while x = n + 1"
+    formula = quality.coerce_pseudocode_fields({"expression": loop})
+    assert formula["pseudocode"] == loop
+    assert formula["expression"] == "x = n + 1"
+    short = {"expression": "if x > 0 then y = 1"}
+    assert quality.coerce_pseudocode_fields(dict(short)) == short
+    assert quality.fix_formula_vs_pseudocode("Function g: return x") == "f g: → x"
+    assert quality.fix_formula_vs_pseudocode("Functional forms") == "Functional forms"
@@ -0,0 +1,69 @@
+"""
+Tests for quality telemetry models and recording
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateTable
+
+from app.models.telemetry import SummaryQuality
+
+
+def test_warnings_column_is_jsonb_on_postgres_only():
+    pg_ddl = str(CreateTable(SummaryQuality.__table__).compile(dialect=postgresql.dialect()))
+    sqlite_ddl = str(CreateTable(SummaryQuality.__table__).compile(dialect=sqlite.dialect()))
+    assert "warnings JSONB" in pg_ddl
+    assert "warnings JSON" in sqlite_ddl
+
+
+def _record(db, request_hash):
+    from app.services.telemetry import record_summary_quality
+
+    record_summary_quality(
+        db, request_hash=request_hash, user_id=None, plan="free", domain="general",
+        language="en", input_tokens=100, num_chunks=1, quality_score=0.5,
+        num_concepts=3, num_formulas=0, num_exam_questions=0, num_glossary_terms=0,
+        self_repair_triggered=False, self_repair_improvement=None,
+        total_tokens_used=200, generation_time_seconds=1.0, warnings=["thin"],
+    )
+
+
+def test_quality_records_are_batched_and_visible_in_stats(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app.services import telemetry
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'telemetry.db'}")
+    SummaryQuality.__table__.create(engine)
+    telemetry._telemetry_bind = None
+    telemetry._writer_started = False
+
+    with Session(bind=engine) as db:
+        _record(db, "q1")
+        _record(db, "q2")
+        # Nothing written synchronously
+        assert db.query(SummaryQuality).count() == 0
+
+        stats = telemetry.get_quality_stats(db)
+        assert stats["total_summaries"] == 2
+        patterns = telemetry.get_low_quality_patterns(db)
+        assert {p["request_hash"] for p in patterns} == {"q1", "q2"}
+        assert patterns[0]["warnings"] == ["thin"]
+
+
+def test_token_usage_logging_reuses_one_engine():
+    from sqlalchemy import text
+    from app.services import token_tracker
+
+    factory = token_tracker._get_session_factory()
+    with factory() as db:
+        db.execute(text(
+            "CREATE TABLE IF NOT EXISTS token_usage (id INTEGER PRIMARY KEY, user_id INTEGER, endpoint TEXT, model TEXT, "
+            "input_tokens INTEGER, output_tokens INTEGER, total_tokens INTEGER, estimated_cost REAL, created_at TIMESTAMP)"
+        ))
+        db.commit()
+
+    for _ in range(2):
+        token_tracker.log_token_usage(7, "/summarize", "gpt-4o-mini", 10, 5, 15, 0.001)
+
+    assert token_tracker._get_session_factory() is factory
+    with factory() as db:
+        assert db.execute(text("SELECT COUNT(*) FROM token_usage WHERE user_id = 7")).scalar() == 2
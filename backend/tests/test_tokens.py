@@ -0,0 +1,108 @@
+"""
+Tests for token counting and token-window splitting
+"""
+from app.utils import tokens
+
+
+class _CharEncoding:
+    """Stand-in encoding: one token per character"""
+
+    def encode(self, text, disallowed_special=()):
+        return [ord(c) for c in text]
+
+    def decode(self, toks):
+        return "".join(chr(t) for t in toks)
+
+    def encode_batch(self, texts, disallowed_special=()):
+        self.batches = getattr(self, "batches", []) + [list(texts)]
+        return [self.encode(text) for text in texts]
+
+
+def test_split_by_tokens_uses_exact_windows(monkeypatch):
+    monkeypatch.setattr(tokens, "get_encoding", lambda: _CharEncoding())
+    text = "abcdefghij" * 10
+
+    chunks = tokens.split_text_by_tokens(text, chunk_tokens=30, overlap_tokens=5)
+
+    assert [len(c) for c in chunks] == [30, 30, 30, 25]
+    assert chunks[1].startswith(chunks[0][-5:])
+    assert tokens.count_tokens(text) == 100
+
+
+def test_falls_back_to_approximation_without_tiktoken(monkeypatch):
+    monkeypatch.setattr(tokens, "get_encoding", lambda: None)
+    text = ("Paragraph sentence. " * 200 + "\n\n") * 5
+
+    assert tokens.count_tokens(text) == int(len(text) * 0.25)
+    chunks = tokens.split_text_by_tokens(text, chunk_tokens=500)
+    assert len(chunks) > 1
+    assert all(len(c) <= 2000 for c in chunks)
+
+
+def test_iter_text_chunks_is_lazy(monkeypatch):
+    monkeypatch.setattr(tokens, "get_encoding", lambda: None)
+    text = ("Paragraph sentence. " * 200 + "\n\n") * 5
+
+    chunks = tokens.iter_text_chunks(text, chunk_tokens=500)
+
+    assert not isinstance(chunks, list)
+    assert next(chunks)
+    assert [next(chunks)] + list(chunks) == tokens.split_text_by_tokens(text, chunk_tokens=500)[1:]
+
+
+def test_iter_text_chunks_reuses_caller_tokens(monkeypatch):
+    monkeypatch.setattr(tokens, "get_encoding", lambda: _CharEncoding())
+    text = "abcdefghij" * 10
+    full = tokens.try_encode(text)
+
+    def fail_encode(_text):
+        raise AssertionError("text was re-encoded")
+
+    monkeypatch.setattr(tokens, "encode", fail_encode)
+    chunks = list(tokens.iter_text_chunks(text, chunk_tokens=40, tokens=full))
+
+    assert "".join(chunks) == text
+
+
+def test_approximation_is_calibrated_from_reported_usage(monkeypatch):
+    monkeypatch.setattr(tokens, "get_encoding", lambda: None)
+    monkeypatch.setattr(tokens, "_token_per_char", 0.25)
+
+    tokens.observe_prompt_tokens(200, 150)  # Too short to be representative
+    assert tokens.token_per_char() == 0.25
+
+    tokens.observe_prompt_tokens(10_000, 3_000)
+    assert abs(tokens.token_per_char() - (0.25 + tokens.TOKEN_RATIO_EMA_ALPHA * 0.05)) < 1e-9
+    assert tokens.count_tokens("x" * 10_000) == int(10_000 * tokens.token_per_char())
+
+
+def test_reduce_validation_measures_output_in_tokens(monkeypatch):
+    from app.services import summary
+
+    monkeypatch.setattr(summary, "count_tokens", lambda text: 7000)
+    assert not any("TOO BRIEF" in issue for issue in summary.validate_reduce_output({"summary": {}}))
+    monkeypatch.setattr(summary, "count_tokens", lambda text: 100)
+    assert any("TOO BRIEF" in issue for issue in summary.validate_reduce_output({"summary": {}}))
+
+
+def test_split_at_word_starts_only_cuts_before_a_word():
+    text = "alpha  beta\n gamma delta. epsilon " * 50
+    pieces = tokens.split_at_word_starts(text, 40)
+    assert "".join(pieces) == text
+    assert len(pieces) > 1
+    for piece in pieces[1:]:
+        assert piece[0] == " " and piece[1].isalpha()
+    assert tokens.split_at_word_starts("no-spaces-here" * 10, 5) == ["no-spaces-here" * 10]
+
+
+def test_long_texts_are_encoded_in_parallel_windows(monkeypatch):
+    enc = _CharEncoding()
+    monkeypatch.setattr(tokens, "get_encoding", lambda: enc)
+    monkeypatch.setattr(tokens, "TOKENIZE_PARALLEL_MIN_CHARS", 100)
+    monkeypatch.setattr(tokens, "TOKENIZE_WINDOW_CHARS", 30)
+    text = "Word after word in a long document. " * 20
+
+    assert tokens.encode(text) == enc.encode(text)
+    assert len(enc.batches[0]) > 1
+    assert tokens.count_tokens("short text") == 10
+    assert len(enc.batches) == 1